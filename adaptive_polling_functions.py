@@ -0,0 +1,410 @@
+"""
+Description: This file contains the functions for the adaptive polling of the
+    transit data. Instead of a job for every slot of the fixed grid
+    (scheduler_functions.create_collect_time), each feed of an agency has a
+    single job whose trigger picks the next poll after every poll. The
+    poller polls every fast_poll_secs seconds while a developing delay is
+    near a monitored station, on every slot of the grid while a monitored
+    trip is active according to the schedule monitor and only on every
+    slow_poll_stride slot otherwise. A fast poll is only made if the polls
+    of the day still fit in the number of slots of the grid, so the
+    adaptive poller never makes more api calls than the fixed grid.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import bisect
+import datetime as dt
+import threading
+
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.util import astimezone, localize
+from tzlocal import get_localzone
+
+import config
+import dispatcher_functions as disp
+
+# seconds between the polls while a delay is developing
+fast_poll_secs = 30
+# only every slow_poll_stride slot of the grid is polled while no monitored
+# trip is active
+slow_poll_stride = 3
+# departure delay (seconds) of a developing delay
+developing_delay_secs = 2 * 60
+# a delayed train is near a monitored station if it departs from it within
+# this many seconds
+near_station_secs = 10 * 60
+# seconds that the poller stays fast after the last developing delay
+fast_hold_secs = 5 * 60
+# a monitored trip is active from this many seconds before its scheduled
+# departure from a monitored station until this many seconds after it
+active_lead_secs = 10 * 60
+active_lag_secs = 30 * 60
+seconds_per_day = 24 * 60 * 60
+
+# returns the current time with timezone information, the simulation
+# (simulate_collect_data.py) replaces it with its virtual clock
+now_function = disp.utc_now
+# timezone of the slots and of the local dates of the polls. It is the local
+# timezone of the computer like the cron triggers of the periodic jobs and
+# the completeness check (nightly_check), so the time indexes agree.
+timezone = get_localzone()
+# the state is shared by the siri and gtfs-rt job threads
+poll_lock = threading.Lock()
+# {agency: epoch seconds until which the agency is polled fast}
+fast_until = {}
+# {poll key: {'date', 'calls'}} number of polls of the current day
+poll_counts = {}
+
+
+def create_poll_spec(key, time_df, frequency_mins, schedule_monitor,
+                     stations, agency):
+    """
+    Construct the specification of an adaptive poller from the grid of the
+        fixed periodic jobs and the schedule monitor of the agency
+
+    :param key: identifies the poller, the id modifier of its job
+    :type key: string
+
+    :param time_df: data frame returned by sched.create_collect_time, the
+        index is the slot
+    :type time_df: pandas data frame
+
+    :param frequency_mins: minutes between the slots of the grid
+    :type frequency_mins: float
+
+    :param schedule_monitor: data frame that contains schedule information
+        of the agency
+    :type schedule_monitor: pandas data frame
+
+    :param stations: short names of the monitored stations, all of the
+        stations are monitored if None
+    :type stations: list of strings
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :return poll_spec: dictionary with the key, agency, start_secs,
+        frequency_secs, num_slots, day_codes, stations and windows
+    :rtype: dictionary
+    """
+    slot_secs = (time_df['hours'] * 3600 + time_df['minutes'] * 60 +
+                 time_df['seconds']).astype(int)
+    return {'key': key,
+            'agency': agency,
+            'start_secs': int(slot_secs.iloc[0]),
+            'frequency_secs': int(round(frequency_mins * 60)),
+            'num_slots': len(time_df),
+            'day_codes': str(time_df['day_code'].iloc[0]).split(','),
+            'stations': None if stations is None else sorted(stations),
+            'windows': active_windows(schedule_monitor, stations)}
+
+
+def active_windows(schedule_monitor, stations):
+    """
+    Determine when the monitored trips are active. The windows around the
+        scheduled departures from the monitored stations are merged.
+
+    :param schedule_monitor: data frame that contains schedule information
+        of the agency
+    :type schedule_monitor: pandas data frame
+
+    :param stations: short names of the monitored stations, all of the
+        stations are monitored if None
+    :type stations: list of strings
+
+    :return windows: sorted list of (start, end) seconds from midnight
+    :rtype: list of tuples
+    """
+    departures = schedule_monitor
+    if stations is not None:
+        departures = departures[departures['short_stop_name'].astype(
+            str).isin(stations)]
+    # the trains after midnight are active on the clock time of the day
+    departure_secs = sorted(set(
+        departures['scheduled_departure_time_seconds'].dropna().astype(
+            int) % seconds_per_day))
+    windows = []
+    for secs in departure_secs:
+        (start, end) = (secs - active_lead_secs, secs + active_lag_secs)
+        if len(windows) > 0 and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], end)
+        else:
+            windows.append((start, end))
+    return windows
+
+
+def is_active(poll_spec, secs):
+    """
+    Determine if a monitored trip is active
+
+    :param poll_spec: dictionary returned by create_poll_spec
+    :type poll_spec: dictionary
+
+    :param secs: seconds from midnight
+    :type secs: int
+
+    :return True if a monitored trip is active
+    :rtype: bool
+    """
+    windows = poll_spec['windows']
+    ind = bisect.bisect_right(windows, (secs, float('inf'))) - 1
+    return ind >= 0 and secs <= windows[ind][1]
+
+
+def poll_slots(poll_spec):
+    """
+    Determine the slots of the grid that are polled when the poller is not
+        fast
+
+    :param poll_spec: dictionary returned by create_poll_spec
+    :type poll_spec: dictionary
+
+    :return slots: list of (slot, seconds from midnight)
+    :rtype: list of tuples
+    """
+    slots = []
+    for slot in range(poll_spec['num_slots']):
+        secs = poll_spec['start_secs'] + slot * poll_spec['frequency_secs']
+        if slot % slow_poll_stride == 0 or is_active(poll_spec, secs):
+            slots.append((slot, secs))
+    return slots
+
+
+def time_slot(poll_spec, secs):
+    """
+    Determine the slot of the grid that a poll belongs to, the last slot
+        that started. This is the time index that the poll stores.
+
+    :param poll_spec: dictionary returned by create_poll_spec
+    :type poll_spec: dictionary
+
+    :param secs: seconds from midnight
+    :type secs: float
+
+    :return slot
+    :rtype: int
+    """
+    slot = int((secs - poll_spec['start_secs']) //
+               poll_spec['frequency_secs'])
+    return min(max(slot, 0), poll_spec['num_slots'] - 1)
+
+
+def seconds_of_day(local_time):
+    """
+    Seconds from midnight of a local time
+
+    :param local_time: local time
+    :type local_time: datetime
+
+    :return seconds from midnight
+    :rtype: float
+    """
+    return (local_time.hour * 3600 + local_time.minute * 60 +
+            local_time.second + local_time.microsecond / 1e6)
+
+
+def is_fast(agency, now):
+    """
+    Determine if a delay is developing near a monitored station of the
+        agency
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :param now: current time with timezone information
+    :type now: datetime
+
+    :return True if the agency is polled fast
+    :rtype: bool
+    """
+    with poll_lock:
+        return fast_until.get(agency, 0) > now.timestamp()
+
+
+def within_budget(poll_spec, date, secs):
+    """
+    Determine if an extra poll at secs still fits in the number of slots of
+        the grid. The polls that were made today, the extra poll and the
+        slow polls after it are counted.
+
+    :param poll_spec: dictionary returned by create_poll_spec
+    :type poll_spec: dictionary
+
+    :param date: local date of the poll
+    :type date: date
+
+    :param secs: seconds from midnight of the poll
+    :type secs: float
+
+    :return True if the poll fits
+    :rtype: bool
+    """
+    with poll_lock:
+        counts = poll_counts.get(poll_spec['key'], {})
+        calls = counts['calls'] if counts.get('date') == date else 0
+    remaining = sum(1 for (slot, slot_secs) in poll_slots(poll_spec)
+                    if slot_secs > secs)
+    return calls + 1 + remaining <= poll_spec['num_slots']
+
+
+def next_poll_time(poll_spec, local_now):
+    """
+    Determine the time of the next poll, strictly after local_now. The
+        poller is fast while a delay is developing and the budget allows
+        it, otherwise the next slow slot is polled.
+
+    :param poll_spec: dictionary returned by create_poll_spec
+    :type poll_spec: dictionary
+
+    :param local_now: current time in the timezone of the slots
+    :type local_now: datetime
+
+    :return time of the next poll
+    :rtype: datetime
+    """
+    tz = local_now.tzinfo
+    today = local_now.date()
+    now_secs = seconds_of_day(local_now)
+    fast_secs = now_secs + fast_poll_secs
+    last_secs = (poll_spec['start_secs'] + (poll_spec['num_slots'] - 1) *
+                 poll_spec['frequency_secs'])
+    if (config.day_of_week_codes[today.weekday()] in poll_spec['day_codes']
+            and poll_spec['start_secs'] <= fast_secs <= last_secs and
+            is_fast(poll_spec['agency'], local_now) and
+            within_budget(poll_spec, today, fast_secs)):
+        return local_now + dt.timedelta(seconds=fast_poll_secs)
+    slots = poll_slots(poll_spec)
+    for day in range(8):
+        date = today + dt.timedelta(days=day)
+        if (config.day_of_week_codes[date.weekday()] not in
+                poll_spec['day_codes']):
+            continue
+        for (slot, secs) in slots:
+            if day > 0 or secs > now_secs:
+                return localize(dt.datetime.combine(date, dt.time()) +
+                                dt.timedelta(seconds=secs), tz)
+    return None
+
+
+def update_delay_state(data, agency, stations, now):
+    """
+    Poll the agency fast for fast_hold_secs seconds if a train with a
+        developing delay departs from a monitored station soon
+
+    :param data: data frame returned by compare_actual_to_schedule
+    :type data: pandas data frame
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :param stations: short names of the monitored stations, all of the
+        stations are monitored if None
+    :type stations: list of strings
+
+    :param now: current time with timezone information
+    :type now: datetime
+
+    :return True if a delay is developing
+    :rtype: bool
+    """
+    now_secs = now.timestamp()
+    near = ((data['departure_delay'] >= developing_delay_secs) &
+            (data['aimed_departure_time_utc'] >= now_secs) &
+            (data['aimed_departure_time_utc'] <=
+             now_secs + near_station_secs))
+    if stations is not None:
+        near &= data['short_stop_name'].astype(str).isin(stations)
+    developing = bool(near.any())
+    if developing:
+        with poll_lock:
+            fast_until[agency] = now_secs + fast_hold_secs
+    return developing
+
+
+def record_poll(poll_spec, date):
+    """
+    Count a poll of the day
+
+    :param poll_spec: dictionary returned by create_poll_spec
+    :type poll_spec: dictionary
+
+    :param date: local date of the poll
+    :type date: date
+
+    :return None
+    """
+    with poll_lock:
+        counts = poll_counts.setdefault(poll_spec['key'],
+                                        {'date': date, 'calls': 0})
+        if counts['date'] != date:
+            counts.update(date=date, calls=0)
+        counts['calls'] += 1
+    return None
+
+
+def poll_transit_data(query_function, data_db_location, schedule_monitor,
+                      agency, poll_spec):
+    """
+    Poll a transit feed of an agency. The slot of the grid is stored as the
+        time index so the completeness check and the gap index still work.
+
+    :param query_function: dcf.query_transit_data_siri or
+        dcf.query_transit_data_gtfs_rt
+    :type query_function: function
+
+    :param data_db_location: location of the sql database of the agency to
+        store the results
+    :type data_db_location: string
+
+    :param schedule_monitor: data frame that contains schedule information
+        of the agency
+    :type schedule_monitor: pandas data frame
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :param poll_spec: dictionary returned by create_poll_spec
+    :type poll_spec: dictionary
+
+    :return None
+    """
+    local_now = now_function().astimezone(timezone)
+    record_poll(poll_spec, local_now.date())
+    data = query_function(data_db_location, schedule_monitor, agency,
+                          time_slot(poll_spec, seconds_of_day(local_now)))
+    update_delay_state(data, agency, poll_spec['stations'], now_function())
+    return None
+
+
+class AdaptivePollTrigger(BaseTrigger):
+    """
+    Trigger of an adaptive poller. The dispatcher asks for the next fire
+        time again when a run is done because the next poll depends on the
+        data of the run. The apscheduler fallback asks when the run starts,
+        so it switches to the fast polls one poll later. The next fire time
+        is always after the previous fire time and now, so apscheduler does
+        not run a poll twice.
+
+    :param poll_spec: dictionary returned by create_poll_spec
+    :type poll_spec: dictionary
+
+    :param timezone: timezone of the slots, defaults to the local timezone
+    :type timezone: tzinfo or string
+    """
+    reschedule_on_completion = True
+
+    def __init__(self, poll_spec, timezone=None):
+        self.poll_spec = poll_spec
+        self.timezone = astimezone(timezone) or get_localzone()
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        if previous_fire_time is not None:
+            now = max(now, previous_fire_time)
+        return next_poll_time(self.poll_spec, now.astimezone(self.timezone))
+
+    def __repr__(self):
+        # the repr is part of the job signature, so it is deterministic
+        return '<%s (key=%r, slots=%d, windows=%d, timezone=%r)>' % (
+            self.__class__.__name__, self.poll_spec['key'],
+            self.poll_spec['num_slots'], len(self.poll_spec['windows']),
+            str(self.timezone))
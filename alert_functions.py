@@ -0,0 +1,198 @@
+"""
+Description: This file contains the train delay alert engine. The delay of
+    every train at its next stop is kept in memory across the transit data
+    ticks. The trains are identified by the agency and the trip id because
+    the trip ids of different agencies can be the same. Only the delays of
+    one feed (config.delay_alert_source) are tracked so that a late train is
+    not alerted once per feed. An alert is raised only when a train crosses
+    one of the delay thresholds or its delay changes materially. The text
+    line of each alert is rendered once and kept until the notification with
+    it was sent.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import bisect
+import threading
+import time
+
+# departure delays (seconds) that raise an alert when they are crossed
+delay_alert_thresholds = (5 * 60, 10 * 60, 20 * 60)
+# change in the departure delay (seconds) of a late train that raises an
+# alert
+material_delay_change = 3 * 60
+# a train that has not been seen for this many seconds is forgotten
+train_state_expiry_secs = 3 * 60 * 60
+# header of the alert text
+alert_header = 'Train     Station          Delay (min)'
+
+# the state is shared by the job threads of the agencies
+alert_lock = threading.Lock()
+# {(agency, trip_id): {'level', 'delay', 'seen'}} of the trains that are
+# tracked
+train_states = {}
+# {(agency, trip_id): rendered line} of the alerts that have not been sent
+pending_alerts = {}
+# True while a notification with the pending alerts is being sent
+alerts_in_flight = False
+
+
+def next_stop_delays(data):
+    """
+    Find the departure delay of every train at its next stop, the stop with
+        the earliest aimed departure time
+
+    :param data: data frame returned by compare_actual_to_schedule
+    :type data: pandas data frame
+
+    :return next_stops: data frame with the columns trip_id,
+        short_stop_name and departure_delay
+    :rtype: pandas data frame
+    """
+    data = data[['trip_id', 'short_stop_name', 'aimed_departure_time_seconds',
+                 'departure_delay']].dropna(subset=['departure_delay'])
+    if data.empty:
+        return data
+    next_stop_ind = data.groupby('trip_id', sort=False)[
+        'aimed_departure_time_seconds'].idxmin()
+    return data.loc[next_stop_ind]
+
+
+def delay_level(delay_secs):
+    """
+    Determine how many delay thresholds the delay has crossed
+
+    :param delay_secs: departure delay in seconds
+    :type delay_secs: float
+
+    :return level: 0 if the train is not late
+    :rtype: int
+    """
+    return bisect.bisect_right(delay_alert_thresholds, delay_secs)
+
+
+def render_alert_line(agency, trip_id, station, delay_secs, change):
+    """
+    Render the text line of an alert
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :param trip_id: train number
+    :type trip_id: string
+
+    :param station: short name of the next station
+    :type station: string
+
+    :param delay_secs: departure delay in seconds
+    :type delay_secs: float
+
+    :param change: late, later, earlier or on time
+    :type change: string
+
+    :return line
+    :rtype: string
+    """
+    return '%-9s %-16s %5.1f %s' % (agency + ' ' + trip_id, station,
+                                    delay_secs / 60, change)
+
+
+def update_delay_alerts(data, agency, now=None):
+    """
+    Update the state of every train in data and add an alert to the pending
+        alerts for the trains that crossed a threshold or whose delay changed
+        materially
+
+    :param data: data frame returned by compare_actual_to_schedule of the
+        feed config.delay_alert_source
+    :type data: pandas data frame
+
+    :param agency: 511 operator id of the agency of the trains in data
+    :type agency: string
+
+    :param now: current time in seconds, defaults to time.time()
+    :type now: float
+
+    :return changed: (agency, trip id) of the trains with a new alert
+    :rtype: list
+    """
+    if now is None:
+        now = time.time()
+    next_stops = next_stop_delays(data)
+    changed = []
+    with alert_lock:
+        for (trip_id, station, delay_secs) in zip(
+                next_stops['trip_id'].tolist(),
+                next_stops['short_stop_name'].astype(str).tolist(),
+                next_stops['departure_delay'].tolist()):
+            level = delay_level(delay_secs)
+            train = (agency, trip_id)
+            state = train_states.get(train)
+            if state is None:
+                state = {'level': 0, 'delay': 0.0, 'seen': now}
+                train_states[train] = state
+            state['seen'] = now
+            if level > state['level']:
+                change = 'late' if state['level'] == 0 else 'later'
+            elif level < state['level']:
+                change = 'on time' if level == 0 else 'earlier'
+            elif (level > 0 and abs(delay_secs - state['delay']) >=
+                    material_delay_change):
+                change = 'later' if delay_secs > state['delay'] else 'earlier'
+            else:
+                continue
+            state['level'] = level
+            state['delay'] = delay_secs
+            pending_alerts[train] = render_alert_line(
+                agency, trip_id, station, delay_secs, change)
+            changed.append(train)
+        # forget the trains that have finished their trip
+        for train in [train for (train, state) in train_states.items()
+                      if now - state['seen'] > train_state_expiry_secs]:
+            del train_states[train]
+    return changed
+
+
+def notify_pending_alerts(send_function):
+    """
+    Send the pending alerts. They are kept until the notification was sent,
+        if send_function does not accept them (for example because of the
+        rate limit) or the notification could not be sent they are sent
+        with the next alerts. Only one notification is sent at a time.
+
+    :param send_function: function that is called with the alert text, a
+        function that is called once it was sent and a function that is
+        called if it could not be sent. It returns True if it was accepted.
+    :type send_function: function
+
+    :return True if the alerts were accepted
+    :rtype: bool
+    """
+    global alerts_in_flight
+    with alert_lock:
+        if len(pending_alerts) == 0 or alerts_in_flight:
+            return False
+        sent_alerts = dict(pending_alerts)
+        alerts_in_flight = True
+    body_str = '\n'.join([alert_header] + list(sent_alerts.values()))
+
+    def on_sent():
+        global alerts_in_flight
+        with alert_lock:
+            # an alert that changed while it was sent is kept
+            for (train, line) in sent_alerts.items():
+                if pending_alerts.get(train) == line:
+                    del pending_alerts[train]
+            alerts_in_flight = False
+
+    def on_failed():
+        global alerts_in_flight
+        with alert_lock:
+            alerts_in_flight = False
+    try:
+        accepted = send_function(body_str, on_sent, on_failed)
+    except Exception:
+        on_failed()
+        raise
+    if not accepted:
+        on_failed()
+    return accepted
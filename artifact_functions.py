@@ -0,0 +1,117 @@
+"""
+Description: This file contains the functions that save and load the typed
+    schedule artifacts that are handed from prepare_to_collect_data to the
+    collection, nightly check and analysis programs. The artifacts are Arrow
+    IPC (feather v2) files written without compression so that they can be
+    memory mapped and loaded without copying. Timedeltas and categoricals
+    keep their data types when they are loaded.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# version of the artifact layout. Increment when the layout changes so that
+# old artifacts are rejected instead of silently misread
+artifact_version = '1'
+# key in the arrow schema metadata that stores the version
+artifact_version_key = b'transit_vs_car_artifact_version'
+# key in the arrow schema metadata that stores the name of the index columns
+artifact_index_key = b'transit_vs_car_artifact_index'
+
+
+def save_artifact(df, file_loc):
+    """
+    Save a data frame as a versioned arrow artifact. The index of the data
+        frame is stored as normal columns and restored by load_artifact.
+
+    :param df: data frame to save
+    :type df: pandas data frame
+
+    :param file_loc: location of the artifact file
+    :type file_loc: string
+
+    :return None
+    """
+    index_names = [name for name in df.index.names if name is not None]
+    if len(index_names) > 0:
+        df = df.reset_index()
+    else:
+        df = df.reset_index(drop=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[artifact_version_key] = artifact_version.encode()
+    metadata[artifact_index_key] = ','.join(index_names).encode()
+    table = table.replace_schema_metadata(metadata)
+    # no compression so the file can be memory mapped (zero copy)
+    feather.write_feather(table, file_loc, compression='uncompressed')
+    return None
+
+
+def load_artifact(file_loc, columns=None, memory_map=True):
+    """
+    Load a versioned arrow artifact into a data frame.
+
+    :param file_loc: location of the artifact file
+    :type file_loc: string
+
+    :param columns: only load these columns. If None, load all of the columns
+    :type columns: list of strings
+
+    :param memory_map: memory map the file instead of reading it into memory
+    :type memory_map: bool
+
+    :return df: data frame stored in the artifact
+    :rtype: pandas data frame
+    """
+    table = read_artifact_table(file_loc, columns=columns,
+                                memory_map=memory_map)
+    index_names = artifact_index_names(table)
+    df = table.to_pandas()
+    # only restore the index if all of the index columns were loaded
+    if len(index_names) > 0 and set(index_names).issubset(df.columns):
+        df = df.set_index(index_names)
+    return df
+
+
+def read_artifact_table(file_loc, columns=None, memory_map=True):
+    """
+    Read a versioned arrow artifact into an arrow table. Raises a ValueError
+        if the artifact was written with a different version.
+
+    :param file_loc: location of the artifact file
+    :type file_loc: string
+
+    :param columns: only load these columns. If None, load all of the columns
+    :type columns: list of strings
+
+    :param memory_map: memory map the file instead of reading it into memory
+    :type memory_map: bool
+
+    :return table: arrow table stored in the artifact
+    :rtype: arrow table
+    """
+    table = feather.read_table(file_loc, columns=columns,
+                               memory_map=memory_map)
+    metadata = table.schema.metadata or {}
+    file_version = metadata.get(artifact_version_key, b'').decode()
+    if file_version != artifact_version:
+        raise ValueError(('The artifact %s has version (%s), expected version '
+                          '(%s). Rerun prepare_to_collect_data.') %
+                         (file_loc, file_version, artifact_version))
+    return table
+
+
+def artifact_index_names(table):
+    """
+    Return the names of the index columns stored in the artifact metadata
+
+    :param table: arrow table read from the artifact
+    :type table: arrow table
+
+    :return index_names: names of the index columns
+    :rtype: list of strings
+    """
+    metadata = table.schema.metadata or {}
+    index_str = metadata.get(artifact_index_key, b'').decode()
+    return [name for name in index_str.split(',') if name != '']
@@ -0,0 +1,465 @@
+"""
+Description: This program benchmarks the collection and analysis pipelines.
+    The parse, compare, save, gtfs and plotting functions are timed on
+    synthetic data (and recorded SIRI/GTFS-RT json files if they exist) at
+    several data scales. The throughput and peak memory are written to a
+    json file so that runs can be compared. The import time of the
+    collector is profiled with -X importtime.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import artifact_functions as af
+import config
+import file_functions as ff
+import sql_functions as sf
+import synthetic_data_functions as sd
+
+# data scales that each benchmark is run at
+benchmark_scales = [1, 10, 100]
+# number of timed runs, the fastest run is reported
+benchmark_repeat = 3
+# seed for the synthetic data so that runs are reproducible
+benchmark_seed = 0
+# number of items at a scale of 1
+base_stop_visits = 50
+base_gtfs_trips = 20
+base_traffic_days = 20
+# number of trips plotted by create_plots
+plot_trips = 3
+# modules whose import time is profiled: the collector at startup and the
+# job functions that are imported when the job store is loaded
+startup_modules = ['collect_data', 'data_collection_functions']
+# number of the slowest imports that are reported
+startup_top_imports = 10
+
+
+""" Synthetic Data """
+
+
+def write_synthetic_gtfs_zip(zip_path, num_trips, rng):
+    """
+    Write a synthetic GTFS zip file
+
+    :param zip_path: location of the zip file
+    :type zip_path: string
+
+    :param num_trips: number of weekday trips
+    :type num_trips: int
+
+    :param rng: random number generator
+    :type rng: numpy Generator
+
+    :return None
+    """
+    stop_times = sd.synthetic_stop_times(num_trips, rng)
+    stops = pd.DataFrame({
+        'stop_id': [sd.first_stop_id + 10 * ind
+                    for ind in range(len(sd.synthetic_stations))],
+        'stop_name': [station + ' Caltrain'
+                      for station in sd.synthetic_stations],
+        'stop_lat': np.linspace(37.78, 37.33, len(sd.synthetic_stations)),
+        'stop_lon': np.linspace(-122.39, -121.90,
+                                len(sd.synthetic_stations))})
+    times = pd.DataFrame(stop_times, columns=['trip_id', 'stop_id', 'station',
+                                              'departure_secs'])
+    time_strs = pd.to_timedelta(times['departure_secs'], unit='s').map(
+        lambda x: '%02d:%02d:%02d' % (x.days * 24 + x.seconds // 3600,
+                                      (x.seconds // 60) % 60, x.seconds % 60))
+    times['arrival_time'] = time_strs
+    times['departure_time'] = time_strs
+    times['stop_sequence'] = times.groupby('trip_id').cumcount() + 1
+    trips = pd.DataFrame({'route_id': 'Local',
+                          'service_id': 'weekday',
+                          'trip_id': times['trip_id'].unique()})
+    calendar = pd.DataFrame({'service_id': ['weekday'], 'monday': [1],
+                             'tuesday': [1], 'wednesday': [1],
+                             'thursday': [1], 'friday': [1], 'saturday': [0],
+                             'sunday': [0], 'start_date': ['20180101'],
+                             'end_date': ['20991231']})
+    tables = {
+        'agency.txt': pd.DataFrame({
+            'agency_id': ['CT'], 'agency_name': ['Caltrain'],
+            'agency_url': ['http://www.caltrain.com'],
+            'agency_timezone': ['America/Los_Angeles']}),
+        'routes.txt': pd.DataFrame({'route_id': ['Local'],
+                                    'agency_id': ['CT'],
+                                    'route_type': [2]}),
+        'stops.txt': stops,
+        'trips.txt': trips,
+        'calendar.txt': calendar,
+        'stop_times.txt': times[['trip_id', 'arrival_time', 'departure_time',
+                                 'stop_id', 'stop_sequence']]}
+    with zipfile.ZipFile(zip_path, 'w') as zip_file:
+        for (file_name, df) in tables.items():
+            zip_file.writestr(file_name, df.to_csv(index=False))
+    return None
+
+
+def write_synthetic_traffic_data(db_loc, trips_path, num_days, rng):
+    """
+    Write a synthetic traffic database and trips artifact for create_plots
+
+    :param db_loc: location of the traffic database
+    :type db_loc: string
+
+    :param trips_path: location of the trips artifact
+    :type trips_path: string
+
+    :param num_days: number of days of traffic data for each trip
+    :type num_days: int
+
+    :param rng: random number generator
+    :type rng: numpy Generator
+
+    :return None
+    """
+    sf.create_traffic_data_table(db_loc)
+    first_day = dt.datetime(2018, 1, 1, 7, 0)
+    rows = []
+    for trip_index in range(plot_trips):
+        for day in range(num_days):
+            now = first_day + dt.timedelta(days=day)
+            rows.append((int(now.timestamp()), now.isoweekday(),
+                         trip_index, trip_index + 1, 1, '',
+                         float(rng.normal(60 * 60, 10 * 60)), 0, 0))
+    conn = sf.create_connection(db_loc)
+    try:
+        conn.executemany('INSERT INTO traffic_data VALUES '
+                         '(?,?,?,?,?,?,?,?,?)', rows)
+        conn.commit()
+    finally:
+        conn.close()
+    trips = pd.DataFrame({'trip_index': range(plot_trips),
+                          'trip_id': [101 + trip_index for trip_index in
+                                      range(plot_trips)],
+                          'short_stop_name_start': sd.synthetic_stations[0],
+                          'short_stop_name_stop': sd.synthetic_stations[-1],
+                          'sched_trip_duration_secs': 55 * 60.0,
+                          'scheduled_trip_duration_secs': 55 * 60.0})
+    af.save_artifact(trips, trips_path)
+    return None
+
+
+""" Benchmark Cases """
+
+
+def benchmark_cases(work_dir, scale, rng):
+    """
+    Create the benchmark cases for a data scale. Each case is a tuple of
+        (name, number of items, setup function, timed function). The setup
+        function returns the arguments of the timed function and is not
+        timed.
+
+    :param work_dir: directory for the temporary files
+    :type work_dir: string
+
+    :param scale: data scale
+    :type scale: int
+
+    :param rng: random number generator
+    :type rng: numpy Generator
+
+    :return cases: list of the benchmark cases
+    :rtype: list of tuples
+    """
+    # imported here so that the synthetic data functions can be used
+    # without the collection dependencies
+    import data_analysis as da
+    import data_collection_functions as dcf
+    import prepare_to_collect_data as prep
+
+    now = dt.datetime.now(config.to_zone)
+    num_visits = base_stop_visits * scale
+    siri_data = sd.synthetic_siri(num_visits, rng, now)
+    gtfs_rt_data = sd.synthetic_gtfs_rt(num_visits, rng, now)
+    num_trips = max(1, num_visits // len(sd.synthetic_stations))
+    schedule_monitor = sd.synthetic_schedule_monitor(
+        sd.synthetic_stop_times(num_trips, np.random.default_rng(
+            benchmark_seed)))
+    siri_parsed = dcf.parse_siri_transit_data(siri_data, 0)
+    siri_compared = dcf.compare_actual_to_schedule(siri_parsed.copy(),
+                                                   schedule_monitor)
+    # the trip keys are assigned without a dimension database
+    siri_compared['trip_key'] = pd.factorize(siri_compared['trip_id'])[0]
+    cases = [
+        ('parse_siri_transit_data', num_visits,
+         lambda: (siri_data, 0), dcf.parse_siri_transit_data),
+        ('parse_gtfs_rt_transit_data', num_visits,
+         lambda: (gtfs_rt_data, 0), dcf.parse_gtfs_rt_transit_data),
+        ('compare_actual_to_schedule', num_visits,
+         lambda: (siri_parsed.copy(), schedule_monitor),
+         dcf.compare_actual_to_schedule)]
+    # upsert into a database that already holds the rows
+    siri_db = os.path.join(work_dir, 'siri_%d.sqlite' % scale)
+    sf.create_transit_data_siri_table(config.siri_table_name, siri_db)
+    siri_table_columns = [row[1] for row in sf.query_data(
+        siri_db, 'pragma table_info(%s)' % config.siri_table_name)]
+    siri_prepared = siri_compared.reindex(columns=siri_table_columns)
+    sf.update_entries(siri_db, config.siri_table_name, siri_prepared,
+                      dcf.columns_to_compare)
+    cases.append(('update_entries', len(siri_prepared),
+                  lambda: (siri_db, config.siri_table_name, siri_prepared,
+                           dcf.columns_to_compare),
+                  sf.update_entries))
+    # parse a gtfs zip
+    num_gtfs_trips = base_gtfs_trips * scale
+    gtfs_zip = os.path.join(work_dir, 'gtfs_%d.zip' % scale)
+    write_synthetic_gtfs_zip(gtfs_zip, num_gtfs_trips, rng)
+    cases.append(('parse_gfts', num_gtfs_trips,
+                  lambda: (prep.station_list, gtfs_zip,
+                           os.path.join(work_dir, 'trips.arrow'),
+                           os.path.join(work_dir, 'monitor.arrow'),
+                           config.default_agency,
+                           os.path.join(work_dir, 'dimensions.sqlite')),
+                  prep.parse_gfts))
+    # plot the traffic data
+    num_days = base_traffic_days * scale
+    traffic_db = os.path.join(work_dir, 'traffic_%d.sqlite' % scale)
+    trips_path = os.path.join(work_dir, 'plot_trips_%d.arrow' % scale)
+    write_synthetic_traffic_data(traffic_db, trips_path, num_days, rng)
+    plot_dir = os.path.join(work_dir, 'plots')
+    cases.append(('create_plots', num_days * plot_trips,
+                  lambda: create_plot_args(trips_path, traffic_db, work_dir,
+                                           plot_dir),
+                  da.create_plots))
+    # recorded payloads are tiled to the scale
+    siri_recorded = ff.read_json_files(config.siri_json_dir, 'siri-')
+    if len(siri_recorded) > 0:
+        visits = [visit for payload in siri_recorded for visit in payload]
+        visits = visits * scale
+        cases.append(('parse_siri_transit_data_recorded', len(visits),
+                      lambda: (visits, 0), dcf.parse_siri_transit_data))
+    gtfs_rt_recorded = ff.read_json_files(config.gtfs_rt_json_dir,
+                                           'gtfs-rt-')
+    if len(gtfs_rt_recorded) > 0:
+        entities = [entity for payload in gtfs_rt_recorded
+                    for entity in payload['entity']] * scale
+        trip_updates = {'header': gtfs_rt_recorded[-1]['header'],
+                        'entity': entities}
+        num_updates = sum(len(entity['tripUpdate']['stopTimeUpdate'])
+                          for entity in entities if 'tripUpdate' in entity)
+        cases.append(('parse_gtfs_rt_transit_data_recorded', num_updates,
+                      lambda: (trip_updates, 0),
+                      dcf.parse_gtfs_rt_transit_data))
+    return cases
+
+
+def create_plot_args(trips_path, traffic_db, work_dir, plot_dir):
+    """
+    Create a fresh results database and plot directories for create_plots
+
+    :param trips_path: location of the trips artifact
+    :type trips_path: string
+
+    :param traffic_db: location of the traffic database
+    :type traffic_db: string
+
+    :param work_dir: directory for the temporary files
+    :type work_dir: string
+
+    :param plot_dir: directory for the plots
+    :type plot_dir: string
+
+    :return args: arguments of create_plots
+    :rtype: tuple
+    """
+    results_db = os.path.join(work_dir, 'results.sqlite')
+    ff.remove_files([results_db])
+    sf.create_results_table(results_db)
+    plot_dirs = [os.path.join(plot_dir, name)
+                 for name in ['ecdf', 'hist', 'time']]
+    for directory in plot_dirs:
+        os.makedirs(directory, exist_ok=True)
+    return (trips_path, traffic_db, results_db) + tuple(plot_dirs)
+
+
+def time_case(setup, function, repeat):
+    """
+    Time a benchmark case. The fastest of the timed runs is reported. The
+        peak memory is measured in a separate run because tracemalloc slows
+        down the function.
+
+    :param setup: function that returns the arguments of the timed function
+    :type setup: function
+
+    :param function: the timed function
+    :type function: function
+
+    :param repeat: number of timed runs
+    :type repeat: int
+
+    :return seconds: fastest run time in seconds
+    :rtype: float
+
+    :return peak_memory_mb: peak memory allocated during the run in MB
+    :rtype: float
+    """
+    run_times = []
+    for ind in range(repeat):
+        args = setup()
+        gc.collect()
+        start_time = time.perf_counter()
+        function(*args)
+        run_times.append(time.perf_counter() - start_time)
+    args = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(*args)
+        (current_memory, peak_memory) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(run_times), peak_memory / 1024 / 1024
+
+
+def import_time_profile(module_name, top_imports):
+    """
+    Profile the import of a module in a new interpreter with -X importtime
+
+    :param module_name: name of the module
+    :type module_name: string
+
+    :param top_imports: number of the slowest imports to report
+    :type top_imports: int
+
+    :return profile: dictionary with the import time of the module and the
+        imports with the largest self time in milliseconds
+    :rtype: dictionary
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module_name],
+        capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        return {'module': module_name,
+                'error': completed.stderr.strip().splitlines()[-1]}
+    # each line is 'import time: self [us] | cumulative [us] | name', the
+    # name is indented by two spaces for each level of nesting
+    imports = []
+    total_ms = None
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        (self_us, cumulative_us, name) = line[len('import time:'):].split('|')
+        imports.append((int(self_us) / 1000, name.strip()))
+        if name.strip() == module_name:
+            total_ms = int(cumulative_us) / 1000
+    imports.sort(reverse=True)
+    return {'module': module_name, 'total_ms': total_ms,
+            'slowest': [{'name': name, 'self_ms': ms}
+                        for (ms, name) in imports[:top_imports]]}
+
+
+def run_benchmarks(scales, repeat, results_file):
+    """
+    Run the benchmarks at each scale and write the results to a json file
+
+    :param scales: data scales to run the benchmarks at
+    :type scales: list of int
+
+    :param repeat: number of timed runs
+    :type repeat: int
+
+    :param results_file: location of the results json file
+    :type results_file: string
+
+    :return results: the benchmark results
+    :rtype: dictionary
+    """
+    random.seed(benchmark_seed)
+    work_dir = tempfile.mkdtemp(prefix='transit_vs_car_benchmark_')
+    results = {'date': dt.datetime.now().isoformat(),
+               'python': sys.version, 'platform': platform.platform(),
+               'pandas': pd.__version__, 'cases': []}
+    results['startup'] = [import_time_profile(module_name,
+                                              startup_top_imports)
+                          for module_name in startup_modules]
+    for profile in results['startup']:
+        print('import %s: %s' % (profile['module'], profile.get(
+            'total_ms', profile.get('error'))))
+    try:
+        for scale in scales:
+            rng = np.random.default_rng(benchmark_seed)
+            for (name, num_items, setup, function) in benchmark_cases(
+                    work_dir, scale, rng):
+                case = {'name': name, 'scale': scale, 'items': num_items}
+                try:
+                    (seconds, peak_memory_mb) = time_case(setup, function,
+                                                          repeat)
+                    case.update({'seconds': seconds,
+                                 'items_per_sec': num_items / seconds,
+                                 'peak_memory_mb': peak_memory_mb})
+                except Exception as e:
+                    case['error'] = repr(e)
+                print('%s x%d: %s' % (name, scale, case))
+                results['cases'].append(case)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    with open(results_file, 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+    return results
+
+
+def compare_results(old_results_file, new_results_file):
+    """
+    Print the change in run time and peak memory between two result files
+
+    :param old_results_file: location of the baseline results json file
+    :type old_results_file: string
+
+    :param new_results_file: location of the new results json file
+    :type new_results_file: string
+
+    :return comparison: data frame with the old and new run times and memory
+    :rtype: pandas data frame
+    """
+    frames = []
+    for (label, file_name) in [('old', old_results_file),
+                               ('new', new_results_file)]:
+        with open(file_name) as infile:
+            cases = pd.DataFrame(json.load(infile)['cases'])
+        cases = cases.reindex(columns=['name', 'scale', 'seconds',
+                                       'peak_memory_mb'])
+        frames.append(cases.set_index(['name', 'scale']).add_prefix(
+            label + '_'))
+    comparison = frames[0].join(frames[1], how='outer')
+    comparison['speedup'] = (comparison['old_seconds'] /
+                             comparison['new_seconds'])
+    comparison['memory_ratio'] = (comparison['new_peak_memory_mb'] /
+                                  comparison['old_peak_memory_mb'])
+    print(comparison.to_string())
+    return comparison
+
+
+def main():
+    ff.create_directories([config.benchmark_dir])
+    date_tag = dt.datetime.now().strftime("%Y-%b-%d_%H-%M-%S")
+    results_file = os.path.join(config.benchmark_dir,
+                                'benchmark-%s.json' % date_tag)
+    run_benchmarks(benchmark_scales, benchmark_repeat, results_file)
+    # compare to the previous run if there is one
+    previous_files = sorted(ff.find_files_that_filename_contain(
+        config.benchmark_dir, 'benchmark-'), key=os.path.getmtime)
+    if len(previous_files) > 1:
+        compare_results(previous_files[-2], results_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,26 +5,16 @@ Description: This program was written to collect the data by calling the
 @author: Robert Hennessy (robertghennessy@gmail.com)
 """
 
-import datetime as dt
-import logging.handlers
-
 import config
+import data_collection_functions as dcf
+import file_functions as ff
+from import_functions import lazy_import
+import metrics_functions as mf
 import push_notification as pn
-import scheduler_functions as sched
 
-# set up the root logger
-logger = logging.getLogger('')
-logger.setLevel(logging.INFO)
-dateTag = dt.datetime.now().strftime("%Y-%b-%d_%H-%M-%S")
-log_filename = config.collect_data_log_file % dateTag
-# add a rotating handler, rotate the file every 10 mb. Keep the last 5 logfiles
-formatter = logging.Formatter(
-        '%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
-handler = logging.handlers.RotatingFileHandler(log_filename,
-                                               maxBytes=10*1024*1024,
-                                               backupCount=5)
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+# only the scheduler that is used is loaded
+disp = lazy_import('dispatcher_functions')
+sched = lazy_import('scheduler_functions')
 
 
 def main():
@@ -34,12 +24,30 @@ def main():
     :return None
     :rtype: None
     """
+    # set up the root logger
+    log_filename = ff.create_log_file(config.collect_data_log_file)
+    # the parse workers are started before the other threads of the
+    # collector
+    dcf.start_parse_pool()
     # save the process data monitor and send a push notification 
     # when restarted
     pn.restart_push_notify(config.process_monitor_sql,
                            'Car vs Caltrain Restarted', log_filename)
+    # write the timing metrics of the jobs to the metrics file
+    mf.start_file_exporter(config.metrics_file, config.metrics_export_secs)
+    # the migration does not run while the collector is running
+    ff.start_heartbeat(config.collector_heartbeat_file,
+                       config.collector_heartbeat_secs)
     # run the tasks in the database
-    sched.run_tasks(config.scheduler_sql) 
+    try:
+        if config.scheduler_backend == 'dispatcher':
+            disp.run_dispatcher(config.scheduler_sql,
+                                config.process_monitor_sql,
+                                config.executor_config)
+        else:
+            sched.run_tasks(config.scheduler_sql)
+    finally:
+        dcf.shutdown_parse_pool()
 
 
 if __name__ == '__main__':
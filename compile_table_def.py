@@ -0,0 +1,191 @@
+"""
+Description: This program compiles the table definitions in
+    sql_table_definition.xlsx into the table_def module. Each sheet becomes a
+    dictionary (for example siri_dict) and a compiled table definition (for
+    example siri_table) with the column order, the create table statement,
+    the pandas dtypes and the insert statement, so nothing is computed when
+    the data is saved. The times are stored as integer seconds since the
+    epoch, so the local date and time columns of the spreadsheet are not
+    compiled (they are derived by sql_functions.create_local_time_view).
+    The trip id is stored as the trip key of the dimension tables and the
+    station names are found from the stop id, so they are not compiled.
+    The sha256 hash of the spreadsheet is stored in the module and the
+    module is only written again when the spreadsheet or the compiler
+    (table_def_version) changes. prepare_to_collect_data runs the compiler,
+    the collector only imports the module and does not need openpyxl.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import hashlib
+import logging
+import os
+import pprint
+import re
+
+from import_functions import lazy_import
+
+import config
+import sql_functions as sf
+
+# pandas is only needed to read the spreadsheet
+pd = lazy_import('pandas')
+
+# pandas dtype of each sql type, the other sql types are stored as objects
+sql_type_dtypes = {'text': 'object', 'int': 'Int64', 'integer': 'Int64',
+                   'real': 'float64'}
+# the hash of the spreadsheet is stored on this line of the module
+xls_hash_pattern = re.compile(r"^xls_sha256 = '([0-9a-f]*)'$", re.MULTILINE)
+# version of the compiled definitions, increase it when the compiler changes
+table_def_version = 3
+# local date and time columns that are derived from the epoch columns
+derived_column_pattern = re.compile(
+    r'^(recorded_at|aimed_\w+)_time_(date|time)$')
+# epoch and seconds from midnight columns that are stored as integers
+integer_column_pattern = re.compile(
+    r'^(recorded_at|aimed_\w+)_time_(utc|seconds)$')
+# station name columns that are stored in the dimension tables
+dimension_column_pattern = re.compile(r'^(station_name|short_stop_name)$')
+# columns that are replaced by their integer key in the dimension tables
+dimension_key_columns = {'trip_id': 'trip_key'}
+
+
+def xls_file_hash(xls_file):
+    """
+    Calculate the sha256 hash of the spreadsheet and table_def_version
+
+    :param xls_file: location of the spreadsheet
+    :type xls_file: string
+
+    :return hash as a hex string
+    :rtype: string
+    """
+    with open(xls_file, 'rb') as infile:
+        xls_hash = hashlib.sha256(infile.read())
+    xls_hash.update(str(table_def_version).encode())
+    return xls_hash.hexdigest()
+
+
+def compiled_xls_hash(out_file_name):
+    """
+    Read the hash of the spreadsheet that the module was compiled from. The
+        module is not imported.
+
+    :param out_file_name: location of the compiled module
+    :type out_file_name: string
+
+    :return hash as a hex string or None if the module does not exist
+    :rtype: string
+    """
+    if not os.path.isfile(out_file_name):
+        return None
+    with open(out_file_name) as infile:
+        match = xls_hash_pattern.search(infile.read())
+    return match.group(1) if match else None
+
+
+def compile_table(table_dict):
+    """
+    Compile the definition of one table. The derived local date and time
+        columns and the station names are dropped, the epoch columns are
+        stored as integers and the trip id is replaced by the trip key.
+
+    :param table_dict: dictionary like {column index -> {'pandas_name',
+        'sql_name', 'sql_type'}}
+    :type table_dict: dictionary
+
+    :return table: dictionary with the pandas column order (columns), the
+        sql column order (sql_columns), the create table statement (ddl),
+        the pandas dtypes (dtypes) and the insert statement (insert). The
+        ddl and insert have a %s for the table name.
+    :rtype: dictionary
+    """
+    compiled = {}
+    for (key, column) in table_dict.items():
+        sql_name = column['sql_name']
+        if (derived_column_pattern.search(sql_name) or
+                dimension_column_pattern.search(sql_name)):
+            continue
+        if integer_column_pattern.search(sql_name):
+            column = dict(column, sql_type='integer')
+        if sql_name in dimension_key_columns:
+            column = dict(column, pandas_name=dimension_key_columns[sql_name],
+                          sql_name=dimension_key_columns[sql_name],
+                          sql_type='integer')
+        compiled[key] = column
+    table_dict = compiled
+    ordered = [table_dict[key] for key in sorted(table_dict)]
+    sql_columns = tuple(column['sql_name'] for column in ordered)
+    return {'columns': tuple(column['pandas_name'] for column in ordered),
+            'sql_columns': sql_columns,
+            'ddl': 'CREATE TABLE %%s (%s)' % sf.create_table_def_string(
+                table_dict),
+            'dtypes': {column['pandas_name']: sql_type_dtypes.get(
+                str(column['sql_type']).lower(), 'object')
+                for column in ordered},
+            'insert': 'INSERT INTO %%s (%s) VALUES (%s)' % (
+                ', '.join(sql_columns), ','.join('?' * len(sql_columns)))}
+
+
+def compile_table_def(xls_file, out_file_name):
+    """
+    Compile every sheet of the spreadsheet and write the table_def module.
+        Each row of a sheet is a column of the table and each column of the
+        sheet is a key of that entry.
+
+    :param xls_file: location of the spreadsheet
+    :type xls_file: string
+
+    :param out_file_name: location of the compiled module
+    :type out_file_name: string
+
+    :return None
+    """
+    xls_data = pd.read_excel(xls_file, sheet_name=None)
+    lines = ['"""',
+             'Description: This file is generated by compile_table_def.py '
+             'from',
+             '    %s. Do not edit it.' % os.path.basename(xls_file),
+             '"""',
+             "xls_sha256 = '%s'" % xls_file_hash(xls_file)]
+    for (sheet_name, sheet) in xls_data.items():
+        table_dict = sheet.to_dict('index')
+        table_name = re.sub('_dict$', '', sheet_name) + '_table'
+        lines.append('')
+        lines.append('%s = %s' % (sheet_name, pprint.pformat(table_dict)))
+        lines.append('%s = %s' % (table_name,
+                                  pprint.pformat(compile_table(table_dict))))
+    with open(out_file_name, 'w') as outfile:
+        outfile.write('\n'.join(lines) + '\n')
+    return None
+
+
+def update_table_def(xls_file, out_file_name):
+    """
+    Compile the table_def module if the spreadsheet changed since it was
+        compiled
+
+    :param xls_file: location of the spreadsheet
+    :type xls_file: string
+
+    :param out_file_name: location of the compiled module
+    :type out_file_name: string
+
+    :return True if the module was compiled
+    :rtype: bool
+    """
+    if xls_file_hash(xls_file) == compiled_xls_hash(out_file_name):
+        return False
+    compile_table_def(xls_file, out_file_name)
+    logging.info('Compiled %s from %s' % (out_file_name, xls_file))
+    return True
+
+
+def main():
+    if update_table_def(config.table_def_xls_file, config.table_def_file):
+        print('Compiled %s' % config.table_def_file)
+    else:
+        print('%s is up to date' % config.table_def_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,12 @@ import private_config
 
 # gfts file location
 gtfs_zip_path = private_config.gtfs_zip_path
+# transit agencies that are collected, the key is the 511 operator id and
+# the value is the location of the gtfs file of the agency. The traffic
+# trips are created from the gtfs of the default agency.
+default_agency = 'CT'
+transit_agencies = {default_agency: gtfs_zip_path}
+transit_agencies.update(getattr(private_config, 'agency_gtfs_zip_paths', {}))
 # directories
 base_dir = private_config.base_dir
 # directory names
@@ -28,10 +34,13 @@ test_logs_dir = os.path.join(base_dir, 'test_' + logs_dir_name)
 collect_data_log_filename = 'CollectData-%s.txt'
 prepare_log_filename = 'Prepare-%s.txt'
 transit_log_filename = 'TransitSchedulerLog-%s.txt'
+decision_service_log_filename = 'DecisionService-%s.txt'
 # log file locations
 collect_data_log_file = os.path.join(logs_dir, collect_data_log_filename)
 prepare_log_file = os.path.join(logs_dir, prepare_log_filename)
 transit_log_file = os.path.join(logs_dir, transit_log_filename)
+decision_service_log_file = os.path.join(logs_dir,
+                                         decision_service_log_filename)
 # test log file locations
 test_collect_data_log_file = os.path.join(test_logs_dir,
                                           collect_data_log_filename)
@@ -45,8 +54,45 @@ scheduler_sql_filename = 'tasks.sqlite'
 process_monitor_sql_filename = 'process_monitor.sqlite'
 push_notification_sql_filename = 'push_notification.sqlite'
 results_summary_sql_filename = 'results_summary.sqlite'
+gap_index_sql_filename = 'gap_index.sqlite'
+dimension_sql_filename = 'dimensions.sqlite'
 gfts_rt_table_name = 'transit_data_gtfs_rt'
 siri_table_name = 'transit_data_siri'
+transit_summary_table_name = 'transit_summary'
+
+
+def agency_suffix(agency):
+    """
+    Suffix of the file names, job ids and completeness sources of an agency.
+        The default agency has no suffix so that its existing databases and
+        jobs keep their names.
+
+    :param agency: 511 operator id
+    :type agency: string
+
+    :return suffix
+    :rtype: string
+    """
+    return '' if agency == default_agency else '_' + agency
+
+
+def agency_file_name(file_name, agency):
+    """
+    Add the agency suffix to a file name
+
+    :param file_name: file name with an extension
+    :type file_name: string
+
+    :param agency: 511 operator id
+    :type agency: string
+
+    :return file name of the agency
+    :rtype: string
+    """
+    (root, ext) = os.path.splitext(file_name)
+    return root + agency_suffix(agency) + ext
+
+
 # sql database locations
 traffic_data_sql = os.path.join(file_dir, traffic_data_sql_filename)
 siri_data_sql = os.path.join(file_dir, siri_data_sql_filename)
@@ -55,6 +101,34 @@ scheduler_sql = os.path.join(file_dir, scheduler_sql_filename)
 process_monitor_sql = os.path.join(file_dir, process_monitor_sql_filename)
 push_notification_sql = os.path.join(file_dir, push_notification_sql_filename)
 results_summary_sql = os.path.join(file_dir, results_summary_sql_filename)
+gap_index_sql = os.path.join(file_dir, gap_index_sql_filename)
+# the stations, trips and station pairs of every agency. The data tables
+# store their small integer keys instead of the names.
+dimension_sql = os.path.join(file_dir, dimension_sql_filename)
+# the rows of the traffic, siri and gtfs-rt databases are written to a
+# partition file for each month (strftime format of the date), for example
+# traffic_data-2018-01.sqlite. The partitions that have not been written to
+# for sql_partition_freeze_days days are compacted and made read only.
+sql_partition_format = '%Y-%m'
+sql_partition_freeze_days = 2
+# the raw transit rows of the service days that ended more than
+# transit_retention_days days ago are collapsed into the transit summary
+# table and moved to the archive directory (deleted if it is None). Each
+# run of the retention moves at most retention_batch_rows rows out of the
+# original database.
+transit_retention_days = 90
+transit_archive_dir = os.path.join(base_dir, 'archive')
+retention_batch_rows = 50000
+# the siri and gtfs-rt data of each agency is stored in its own database
+# (shard) so the agencies do not wait for each other's database lock
+siri_data_sql_shards = {
+    agency: os.path.join(file_dir, agency_file_name(siri_data_sql_filename,
+                                                    agency))
+    for agency in transit_agencies}
+gtfs_rt_data_sql_shards = {
+    agency: os.path.join(file_dir, agency_file_name(gtfs_rt_data_sql_filename,
+                                                    agency))
+    for agency in transit_agencies}
 # test sql database locations
 test_traffic_data_sql = os.path.join(test_file_dir, traffic_data_sql_filename)
 test_siri_data_sql = os.path.join(test_file_dir, siri_data_sql_filename)
@@ -64,21 +138,40 @@ test_process_monitor_sql = os.path.join(test_file_dir,
                                         process_monitor_sql_filename)
 test_results_summary_sql = os.path.join(test_file_dir,
                                         results_summary_sql_filename)
+test_push_notification_sql = os.path.join(test_file_dir,
+                                          push_notification_sql_filename)
+test_dimension_sql = os.path.join(test_file_dir, dimension_sql_filename)
+test_siri_data_sql_shards = {
+    agency: os.path.join(test_file_dir,
+                         agency_file_name(siri_data_sql_filename, agency))
+    for agency in transit_agencies}
+test_gtfs_rt_data_sql_shards = {
+    agency: os.path.join(test_file_dir,
+                         agency_file_name(gtfs_rt_data_sql_filename, agency))
+    for agency in transit_agencies}
+# directory to store the benchmark results
+benchmark_dir = os.path.join(base_dir, 'benchmarks')
 # directories to store json
 siri_json_dir = os.path.join(test_file_dir, 'json-siri')
 gtfs_rt_json_dir = os.path.join(test_file_dir, 'json-gtfs-rt')
-# name of the csv files
-trips_csv_filename = 'schedule_trips.csv'
-periodic_jobs_csv_filename = 'periodic_jobs_schedule.csv'
-schedule_monitor_csv_filename = 'schedule_monitor.csv'
-# create csv locations
-trips_csv = os.path.join(file_dir, trips_csv_filename)
-periodic_jobs_csv = os.path.join(file_dir, periodic_jobs_csv_filename)
-schedule_monitor_csv = os.path.join(file_dir, schedule_monitor_csv_filename)
-# create tst csv locations
-test_trips_csv = os.path.join(test_file_dir, trips_csv_filename)
-test_periodic_jobs_csv = os.path.join(test_file_dir,
-                                      periodic_jobs_csv_filename)
+# name of the schedule artifacts (arrow ipc files)
+trips_artifact_filename = 'schedule_trips.arrow'
+periodic_jobs_artifact_filename = 'periodic_jobs_schedule.arrow'
+schedule_monitor_artifact_filename = 'schedule_monitor.arrow'
+# create artifact locations
+trips_artifact = os.path.join(file_dir, trips_artifact_filename)
+periodic_jobs_artifact = os.path.join(file_dir,
+                                      periodic_jobs_artifact_filename)
+schedule_monitor_artifact = os.path.join(file_dir,
+                                         schedule_monitor_artifact_filename)
+schedule_monitor_artifacts = {
+    agency: os.path.join(file_dir, agency_file_name(
+        schedule_monitor_artifact_filename, agency))
+    for agency in transit_agencies}
+# create test artifact locations
+test_trips_artifact = os.path.join(test_file_dir, trips_artifact_filename)
+test_periodic_jobs_artifact = os.path.join(test_file_dir,
+                                           periodic_jobs_artifact_filename)
 
 # pushover keys
 pushover_api_key = private_config.pushover_api_key
@@ -87,15 +180,124 @@ pushover_user_key = private_config.pushover_user_key
 google_transit_api_key = private_config.google_transit_api_key
 # 511 api key
 transit_511_api_key = private_config.transit_511_api_key
+# endpoint of the fake api service (fake_service.py), for example
+# 'http://127.0.0.1:8511'. If None, the live google, 511 and pushover
+# services are used.
+api_endpoint = None
+if api_endpoint is None:
+    google_maps_base_url = 'https://maps.googleapis.com'
+    transit_511_base_url = 'http://api.511.org'
+    pushover_base_url = 'https://api.pushover.net/1/'
+else:
+    google_maps_base_url = api_endpoint
+    transit_511_base_url = api_endpoint
+    pushover_base_url = api_endpoint + '/1/'
+    # the google maps client rejects keys that do not look like google keys
+    google_transit_api_key = 'AIzaFakeServiceKey'
 
 # global constants
 weekday_names = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday',
                  'saturday', 'sunday']
 day_of_week_codes = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
 # used to convert from UTC to PDT/PST
-to_zone = tz.gettz('America/San_Francisco')
+local_timezone = 'America/Los_Angeles'
+to_zone = tz.gettz(local_timezone)
 from_zone = tz.gettz('UTC')
 # dictionary whose values are appended to scheduler id
 scheduler_id_dict = {'siri': 'sr_', 'gtfs-rt': 'grt_'}
-# xls file to define the table
+
+
+def agency_id_modifier(type_switch, agency):
+    """
+    Prefix of the ids of the periodic jobs of an agency, for example sr_ for
+        the default agency and sr_BA_ for BART
+
+    :param type_switch: siri or gtfs-rt
+    :type type_switch: string
+
+    :param agency: 511 operator id
+    :type agency: string
+
+    :return prefix
+    :rtype: string
+    """
+    suffix = agency_suffix(agency)
+    return scheduler_id_dict[type_switch] + (suffix[1:] + '_' if suffix
+                                             else '')
+
+
+# if True, each transit feed of an agency is polled by an adaptive poller
+# (adaptive_polling_functions) instead of the fixed grid of periodic jobs
+adaptive_transit_polling = True
+# agencies whose delays are sent as push notifications
+delay_alert_agencies = [default_agency]
+# feed whose delays are sent as push notifications, siri or gtfs-rt. The
+# feeds report the same trains, alerting from both would send every late
+# train twice.
+delay_alert_source = 'siri'
+# scheduler that runs the collection jobs. 'dispatcher' runs the jobs from
+# an in-process timer heap, 'apscheduler' is the fallback
+scheduler_backend = 'dispatcher'
+# executors that run the collection jobs. The traffic and transit jobs are
+# network bound and each get their own thread pool. The parse executor is a
+# process pool for the cpu heavy parsing of the transit data, set its
+# max_workers to 0 to parse in the job thread instead.
+executor_config = {
+    'default': {'type': 'thread', 'max_workers': 2},
+    'traffic': {'type': 'thread', 'max_workers': 10},
+    'transit': {'type': 'thread', 'max_workers': 4},
+    'parse': {'type': 'process', 'max_workers': 2}}
+# executor that runs each job type
+job_type_executor = {'traffic': 'traffic', 'transit': 'transit'}
+# maximum number of instances of the same job that can run at the same time
+job_max_instances = 1
+# run a job once instead of several times if several runs were missed
+job_coalesce = True
+# seconds after the designated runtime that the job is still allowed to run
+job_misfire_grace_time = 120
+# random delay (seconds) added to the run time of each job type to spread
+# out the rush hour bursts
+job_jitter = {'traffic': 0, 'transit': 0}
+# file that the collection metrics are written to in the prometheus text
+# format and the seconds between writes
+metrics_file = os.path.join(file_dir, 'collect_data_metrics.prom')
+metrics_export_secs = 60
+# the collector touches the heartbeat file every collector_heartbeat_secs
+# seconds. The migration (migrate_databases.py) does not run while the
+# heartbeat is younger than three intervals.
+collector_heartbeat_file = os.path.join(file_dir, 'collect_data.heartbeat')
+collector_heartbeat_secs = 60
+# the google traffic results are shared by the trips between the same
+# stations that depart in the same bucket of traffic_cache_bucket_mins
+# minutes for traffic_cache_ttl_secs seconds (0 turns the cache off). At
+# most traffic_cache_max_entries results are kept.
+traffic_cache_bucket_mins = 5
+traffic_cache_ttl_secs = 5 * 60
+traffic_cache_max_entries = 500
+# the historical traffic model (traffic_model_functions) replaces the google
+# traffic call of a trip if at least traffic_model_min_samples durations
+# were collected at the time of the trip and the interval between the
+# traffic_model_quantiles is at most traffic_model_max_spread times the
+# median. traffic_model_live_rate of these calls are still made live to keep
+# the model fresh.
+traffic_model = True
+traffic_model_min_samples = 6
+traffic_model_quantiles = (0.1, 0.9)
+traffic_model_max_spread = 0.15
+traffic_model_live_rate = 0.2
+# address of the car or train decision service (decision_service.py) and the
+# seconds between the refreshes of its cache
+decision_service_host = '127.0.0.1'
+decision_service_port = 8512
+decision_refresh_secs = 30
+# the completeness check (nightly_check.py) compares the expected and
+# observed collections in buckets of this many minutes. Run it from cron at
+# the same interval. A bucket is checked once this many grace minutes have
+# passed since it ended. The first run checks the last lookback days.
+completeness_check_mins = 15
+completeness_grace_mins = 10
+completeness_lookback_days = 1
+# xls file to define the table and the module it is compiled into
+# (compile_table_def.py)
 table_def_xls_file = os.path.join(base_dir, 'sql_table_definition.xlsx')
+table_def_file = os.path.join(base_dir, 'table_def.py')
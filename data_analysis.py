@@ -14,7 +14,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+import artifact_functions as af
 import config
+import dimension_functions as dim
 import file_functions as ff
 import sql_functions as sf
 
@@ -22,14 +24,35 @@ import sql_functions as sf
 take_train_fraction = 0.5
 
 
-def create_plots(csv_path_in, traffic_db_loc, results_db_loc,
+def read_partitions(db_loc, table_name, sql_query):
+    """
+    Read the result of a query on the table in every partition of a database
+
+    :param db_loc: location of the db locations
+    :type db_loc: string
+
+    :param table_name: name of the table that the query selects from
+    :type table_name: string
+
+    :param sql_query: sql query
+    :type sql_query: string
+
+    :return: data frame with the rows of every partition
+    :rtype: pandas data frame
+    """
+    return pd.concat([pd.read_sql_query(sql_query, conn) for conn in
+                      sf.partition_views(db_loc, table_name)],
+                     ignore_index=True)
+
+
+def create_plots(trips_path_in, traffic_db_loc, results_db_loc,
                  ecdf_dir, hist_dir, time_dir):
     """
     Plots the results and post processes the data to determine statistics for
     the train trips
 
-    :param csv_path_in: file location for schedule_trips.csv
-    :type csv_path_in: string
+    :param trips_path_in: file location for the schedule trips artifact
+    :type trips_path_in: string
     
     :param results_db_loc: file location to store the post processed data.
         This includes the mean and standard deviation of the trip times.
@@ -45,7 +68,7 @@ def create_plots(csv_path_in, traffic_db_loc, results_db_loc,
     :type time_dir: string
     """
     # read in the schedule trips
-    schedule_trips = pd.read_csv(csv_path_in, index_col=0)
+    schedule_trips = af.load_artifact(trips_path_in)
     # query the first and last date in the database  
     first_date = min_max_date(traffic_db_loc, 'traffic_data', 'utc_time',
                               'min')
@@ -54,15 +77,16 @@ def create_plots(csv_path_in, traffic_db_loc, results_db_loc,
     date_min = first_date.replace(day=1)
     # round the last date to the end of the month for plotting
     date_max = last_date.replace(day=1, month=last_date.month + 1)
-    # connect to the data database
-    traffic_conn = sf.create_connection(traffic_db_loc)
 
     for trip_index in list(schedule_trips.index):
         print("plotting trip_index = " + str(trip_index))
-        # read in the data for a given trip_index
-        sql_query = """select * from traffic_data where 
-                        trip_index = %g""" % trip_index
-        traffic_data_df = pd.read_sql_query(sql_query, traffic_conn)
+        # read in the data for a given trip_index, the durations that were
+        # predicted by the traffic model are not plotted
+        sql_query = """select %s as date, * from traffic_data where 
+                        trip_index = %g and from_model = 0""" % (
+                            sf.local_date_sql('utc_time'), trip_index)
+        traffic_data_df = read_partitions(traffic_db_loc, 'traffic_data',
+                                          sql_query)
         # convert the date column to datetime
         traffic_data_df['date'] = pd.to_datetime(traffic_data_df['date'],
                                                  format="%Y-%m-%d")
@@ -75,9 +99,13 @@ def create_plots(csv_path_in, traffic_db_loc, results_db_loc,
                            trip_index]['sched_trip_duration_secs'].values[
                 0] / 60
         duration_in_traffic = traffic_data_df['duration_in_traffic'].values
-        start_station_str = traffic_data_df['start_station'].iloc[0]
-        end_station_str = traffic_data_df['end_station'].iloc[0]
-        train_number = traffic_data_df['trip_id'].iloc[0]
+        # the traffic rows store the keys of the trip and stations, the names
+        # are read from the artifact
+        trip = schedule_trips[schedule_trips['trip_index'] ==
+                              trip_index].iloc[0]
+        start_station_str = str(trip['short_stop_name_start'])
+        end_station_str = str(trip['short_stop_name_stop'])
+        train_number = trip['trip_id']
         title_str = ('Train ' + str(train_number) + ' - ' + start_station_str
                      + ' to ' + end_station_str)
         filename = title_str + '.png'
@@ -152,10 +180,10 @@ def create_traffic_results_df(db_loc, table_name, trip_index):
         duration
     :rtype: pandas data frame
     """
-    traffic_conn = sf.create_connection(db_loc)
-    sql_query = """select * from %s where 
-                    trip_index = %g""" % (table_name, trip_index)
-    traffic_data_df = pd.read_sql_query(sql_query, traffic_conn)
+    sql_query = """select %s as date, * from %s where 
+                    trip_index = %g""" % (sf.local_date_sql('utc_time'),
+                                            table_name, trip_index)
+    traffic_data_df = read_partitions(db_loc, table_name, sql_query)
     # convert the date column to datetime
     traffic_data_df['date'] = pd.to_datetime(traffic_data_df['date'],
                                              format="%Y-%m-%d")
@@ -171,16 +199,18 @@ def create_traffic_results_df(db_loc, table_name, trip_index):
 def create_transit_results_df(db_loc, table_name, trip_id,
                               stop_id, train_sched_trip_duration):
     """                                  
-    Pulls the data from the gtfs-rt transit database and performs some 
-        processing.
+    Pulls the final delay of each day from the transit summary of the
+        gtfs-rt transit database and performs some processing. The summary
+        is kept after the raw rows are removed by the retention.
 
     :param db_loc: location of the db locations
     :type db_loc: string
     
-    :param table_name: name of the table to query
+    :param table_name: name of the transit summary table to query
     :type table_name: string
     
-    :param trip_id: train number
+    :param trip_id: train number of the default agency, it is looked up in
+        the dimension tables
     :type trip_id: string
 
     :param stop_id: stop id number
@@ -193,11 +223,15 @@ def create_transit_results_df(db_loc, table_name, trip_id,
         duration
     :rtype: pandas data frame
     """
-    transit_conn = sf.create_connection(db_loc)
-    sql_query = """select * from %s where 
-                    trip_id = %g and stop_id = %g """ % (table_name, trip_id,
-                                                         stop_id)
-    transit_data_df = pd.read_sql_query(sql_query, transit_conn)
+    # the keys start at 1, a train that is not in the dimension tables
+    # selects no rows
+    trip_key = dim.trip_keys(config.dimension_sql, config.default_agency,
+                             [trip_id], create=False).get(str(trip_id), 0)
+    sql_query = """select train_start_date, 
+                    last_departure_delay as departure_delay from %s where 
+                    trip_key = %d and stop_id = %g """ % (table_name,
+                                                          trip_key, stop_id)
+    transit_data_df = read_partitions(db_loc, table_name, sql_query)
     # convert the date column to date times
     transit_data_df['train_start_date'] = pd.to_datetime(transit_data_df[
                                                              'train_start_date'],
@@ -235,8 +269,10 @@ def min_max_date(db_loc, table, column, func):
     
     """
     sql_query = "select %s(%s) from %s" % (func, column, table)
-    utc = sf.query_data(db_loc, sql_query)
-    utc = utc[0][0]
+    # the query returns one row for every group of partitions
+    utc = [row[0] for row in sf.query_partitions(db_loc, table, sql_query)
+           if row[0] is not None]
+    utc = {'min': min, 'max': max}[func](utc)
     # convert the time code to local time
     date = dt.datetime.utcfromtimestamp(float(utc))
     date = date.replace(tzinfo=config.from_zone)
@@ -300,7 +336,7 @@ def main():
     ff.remove_files([config.results_summary_sql])
     sf.create_results_table(config.results_summary_sql)
 
-    create_plots(config.trips_csv, config.traffic_data_sql,
+    create_plots(config.trips_artifact, config.traffic_data_sql,
                  config.results_summary_sql, ecdf_dir,
                  hist_dir, time_dir)
 
@@ -3,50 +3,73 @@ Description: This file contains the functions that are used to collect data.
     
 @author: Robert Hennessy (robertghennessy@gmail.com)
 """
+import collections
+import concurrent.futures
 import datetime as dt
+import functools
 
-import dateutil.parser as dp
 import json
 import logging
+import multiprocessing
 import os
-import pandas as pd
 import random
-import requests
-
-import googlemaps
-from google.transit import gtfs_realtime_pb2
-from google.protobuf.json_format import MessageToDict
-import tenacity as ten
+import threading
+import time
 
+import alert_functions as al
 import config
+import dimension_functions as dim
+from import_functions import lazy_import
+import metrics_functions as mf
 import push_notification as pn
+import retry_functions as rtf
 import sql_functions as sf
 import table_def
+import traffic_model_functions as tm
+
+# the heavy dependencies are loaded when a job first uses them
+dp = lazy_import('dateutil.parser')
+googlemaps = lazy_import('googlemaps')
+gtfs_realtime_pb2 = lazy_import('google.transit.gtfs_realtime_pb2')
+json_format = lazy_import('google.protobuf.json_format')
+pd = lazy_import('pandas')
+requests = lazy_import('requests')
 
-agency = 'CT'
-gtfs_rt_api = 'http://api.511.org/Transit/TripUpdates?api_key='
-siri_api = 'http://api.511.org/Transit/StopMonitoring?api_key='
-# send push notification is greater than x minutes
-warn_delay_threshold = 5 * 60
+# the 511 base url is added when the api is called so that it can be pointed
+# at the fake service (fake_service.use_fake_service)
+gtfs_rt_api = '/Transit/TripUpdates?api_key='
+siri_api = '/Transit/StopMonitoring?api_key='
 
 # access the root logger
 logger = logging.getLogger('')
 
-siri_columns = ['time_index', 'recorded_at_time_date', 'recorded_at_time_time',
-                'recorded_at_time_utc', 'station_name', 'stop_id', 'trip_id',
-                'vehicle_at_stop', 'aimed_arrival_time_date',
-                'aimed_arrival_time_time', 'aimed_arrival_time_utc',
-                'aimed_departure_time_date', 'aimed_departure_time_time',
+# the times are seconds since the epoch, the local dates and times are
+# derived when they are needed (sql_functions.create_local_time_view). The
+# trip ids and station names are categoricals in memory and the trips are
+# stored as their key in the dimension tables (dimension_functions).
+siri_columns = ['time_index', 'recorded_at_time_utc', 'station_name',
+                'stop_id', 'trip_id', 'vehicle_at_stop',
+                'aimed_arrival_time_utc', 'aimed_departure_time_utc']
+gfts_columns = ['time_index', 'recorded_at_time_utc', 'stop_id', 'trip_id',
                 'aimed_departure_time_utc']
-gfts_columns = ['time_index', 'recorded_at_time_date', 'recorded_at_time_time',
-                'recorded_at_time_utc', 'stop_id', 'trip_id',
-                'aimed_departure_time_date', 'aimed_departure_time_time',
-                'aimed_departure_time_utc']
-columns_to_compare = ['train_start_date', 'trip_id', 'stop_id']
-
-RETRY_PARAMS = dict(wait=ten.wait_random_exponential(multiplier=1, max=10),
-                    reraise=True, stop=ten.stop_after_attempt(5),
-                    before_sleep=ten.before_sleep_log(logger, logging.DEBUG))
+columns_to_compare = ['train_start_date', 'trip_key', 'stop_id']
+# columns of the parsed data that are stored as categoricals
+categorical_columns = ['trip_id', 'station_name']
+
+# process pool for the cpu heavy parsing, created by start_parse_pool when
+# the collector starts. The workers are spawned, a forked worker could
+# inherit a lock that a thread of the collector held (logging, sqlite,
+# metrics).
+parse_pool = None
+parse_pool_lock = threading.Lock()
+# the traffic cache is shared by the traffic job threads
+traffic_cache_lock = threading.Lock()
+# {(start lat, start lng, end lat, end lng, departure bucket): (monotonic
+# time, duration_in_traffic, directions_result)}, the oldest entry first
+traffic_cache = collections.OrderedDict()
+# {key of the traffic cache: future of the google query}. The misses of the
+# same key wait for the query that is in flight instead of calling google.
+traffic_queries = {}
 
 """ Google Traffic Functions """
 
@@ -84,37 +107,122 @@ def query_google_traffic(trip_index, trip_id, start_station, end_station,
     
     :returnNone
     """
-    # query google api    
-    (duration_in_traffic, directions_result) = query_google_api(start_loc,
-                                                                end_loc)
     # construct time objects
-    date_str = dt.datetime.now().date().isoformat()
-    time_str = dt.datetime.now().time().isoformat()
-    day_of_week = dt.datetime.now().isoweekday()
-    utc_time = dt.datetime.utcnow().timestamp()
+    now = dt.datetime.now()
+    (trip_key, pair_key) = traffic_keys(trip_id, start_station, end_station)
+    # use the historical traffic model if it is confident, otherwise query
+    # google api, unless a trip between the same stations that departs in
+    # the same bucket already did
+    prediction = tm.model_duration(sql_db_loc, pair_key, now.timestamp())
+    if prediction is not None:
+        (duration_in_traffic, directions_result, from_cache) = (
+            prediction['median'], {'traffic_model': prediction}, False)
+    else:
+        with mf.time_stage('traffic', 'api_call'):
+            (duration_in_traffic, directions_result,
+             from_cache) = cached_google_api(start_loc, end_loc, now)
     # create the tuple that is inserted into the database. Ensure that all
     # parameters are the right data type
-    data_tuple = (str(date_str), str(time_str), float(utc_time),
-                  int(day_of_week), int(trip_index), int(trip_id),
-                  str(start_station), str(end_station), str(start_loc),
-                  str(end_loc), str(directions_result),
-                  float(duration_in_traffic))
+    data_tuple = (int(now.timestamp()), int(now.isoweekday()),
+                  int(trip_index), trip_key, pair_key,
+                  str(directions_result), float(duration_in_traffic),
+                  int(from_cache), int(prediction is not None))
     # insert the data into the database
-    sf.insert_traffic_data(sql_db_loc, data_tuple)
+    with mf.time_stage('traffic', 'insert'):
+        sf.insert_traffic_data(sql_db_loc, data_tuple)
     # log the task that was just completed
     print_str = (str(trip_index) + ': ' + start_station + ' to ' + end_station
-                 + ' on ' + date_str + ' at ' + time_str)
+                 + ' on ' + now.date().isoformat() + ' at ' +
+                 now.time().isoformat())
     logging.info(print_str)
     return None
 
 
-@ten.retry(**RETRY_PARAMS)
+def cached_google_api(start_loc, end_loc, now):
+    """
+    Return the google traffic result of the trip from the traffic cache if a
+        trip between the same locations that departs in the same bucket of
+        config.traffic_cache_bucket_mins minutes was queried less than
+        config.traffic_cache_ttl_secs seconds ago, otherwise query google
+        and add the result to the cache. A miss waits for the query of the
+        same key that is in flight. The expired and the oldest entries are
+        evicted.
+
+    :param start_loc: dict that contains the latitude and longitude of the
+        start station
+    :type start_loc: dictionary
+
+    :param end_loc: dict that contains the latitude and longitude of the
+        end station
+    :type end_loc: dictionary
+
+    :param now: departure time of the trip
+    :type now: datetime
+
+    :return duration_in_traffic: extracted duration in traffic in seconds
+    :type float
+
+    :return directions_result: the results returned by querying google maps
+    :type dictionary
+
+    :return from_cache: True if the result was taken from the cache
+    :type bool
+    """
+    if config.traffic_cache_ttl_secs <= 0:
+        return query_google_api(start_loc, end_loc) + (False,)
+    key = (start_loc['lat'], start_loc['lng'], end_loc['lat'],
+           end_loc['lng'],
+           int(now.timestamp()) // (config.traffic_cache_bucket_mins * 60))
+    with traffic_cache_lock:
+        # the entries are ordered by the time they were added
+        expired_time = time.monotonic() - config.traffic_cache_ttl_secs
+        while (len(traffic_cache) > 0 and
+               next(iter(traffic_cache.values()))[0] < expired_time):
+            traffic_cache.popitem(last=False)
+        entry = traffic_cache.get(key)
+        query = traffic_queries.get(key)
+        if entry is None and query is None:
+            query = concurrent.futures.Future()
+            traffic_queries[key] = query
+            in_flight = False
+        else:
+            in_flight = True
+    if entry is not None:
+        mf.increment('traffic_cache_requests_total', {'result': 'hit'})
+        return entry[1], entry[2], True
+    if in_flight:
+        # the exception of the query is raised again if it failed
+        mf.increment('traffic_cache_requests_total', {'result': 'waited'})
+        (duration_in_traffic, directions_result) = query.result()
+        return duration_in_traffic, directions_result, True
+    mf.increment('traffic_cache_requests_total', {'result': 'miss'})
+    try:
+        (duration_in_traffic, directions_result) = query_google_api(
+            start_loc, end_loc)
+    except BaseException as e:
+        with traffic_cache_lock:
+            del traffic_queries[key]
+        query.set_exception(e)
+        raise
+    with traffic_cache_lock:
+        traffic_cache[key] = (time.monotonic(), duration_in_traffic,
+                              directions_result)
+        # keep the entries ordered by the time they were added
+        traffic_cache.move_to_end(key)
+        while len(traffic_cache) > config.traffic_cache_max_entries:
+            traffic_cache.popitem(last=False)
+        del traffic_queries[key]
+    query.set_result((duration_in_traffic, directions_result))
+    return duration_in_traffic, directions_result, False
+
+
+@rtf.external_call('google_directions')
 def query_google_api(start_loc, end_loc):
     """
     This program queries the google api to determine the driving time between
-        the start and location. The retry wrapper will retry this function if 
-        an error occurs. The method is exponential back off with jitter and it
-        will retry 5 times before raising an exception.
+        the start and location. The calls go through the circuit breaker of
+        the endpoint and are retried with the shared retry budget
+        (retry_functions).
     
     :param start_loc: dict that contains the latitude and longitude of the
         start station
@@ -132,7 +240,8 @@ def query_google_api(start_loc, end_loc):
     
     """
     # timeout after 5 seconds    
-    gmaps = googlemaps.Client(key=config.google_transit_api_key, timeout=5)
+    gmaps = googlemaps.Client(key=config.google_transit_api_key, timeout=5,
+                              base_url=config.google_maps_base_url)
     now = dt.datetime.now()
     # query google maps for the results
     directions_result = gmaps.directions(start_loc,
@@ -145,60 +254,96 @@ def query_google_api(start_loc, end_loc):
     return duration_in_traffic, directions_result
 
 
+def traffic_keys(trip_id, start_station, end_station):
+    """
+    Look up the keys of the trip and the stations of a traffic trip in the
+        dimension tables. The traffic trips are trips of the default agency.
+
+    :param trip_id: train number
+    :type trip_id: int
+
+    :param start_station: name of the start station
+    :type start_station: string
+
+    :param end_station: name of the end station
+    :type end_station: string
+
+    :return (trip_key, pair_key)
+    :rtype: tuple
+    """
+    trip_key = dim.trip_keys(config.dimension_sql, config.default_agency,
+                             [trip_id])[str(trip_id)]
+    pair_key = dim.pair_key(config.dimension_sql, config.default_agency,
+                            start_station, end_station)
+    return trip_key, pair_key
+
+
 """ Transit Functions """
 
 """ Siri Functions """
 
 
-def query_transit_data_siri(data_db_location, schedule_monitor, time_index):
+def query_transit_data_siri(data_db_location, schedule_monitor, agency,
+                            time_index):
     """
-    :param data_db_location: location of the sql database to store the results
+    :param data_db_location: location of the sql database of the agency to
+        store the results
     :type string
     
     :param schedule_monitor: data frame that contains schedule information
+        of the agency
     :type schedule_monitor: pandas data frame
     
+    :param agency: 511 operator id of the agency
+    :type agency: string
+    
     :param time_index: time index for when the data is collected
     :type integer
     
-    :return None:
-    """
-    monitored_stops = query_siri()
-    write_transit_data_to_json(config.siri_json_dir, 'siri-', monitored_stops)
-    parsed_data = parse_siri_transit_data(monitored_stops, time_index)
-    parsed_data_with_delays = compare_actual_to_schedule(parsed_data,
-                                                         schedule_monitor)
-    save_transit_data(parsed_data_with_delays, 'siri', data_db_location)
-    # Save to task monitor database    
-    sf.insert_periodic_task_monitor(data_db_location, time_index)
-    # determine the delayed trains
-    (max_departure_delay, delayed_trains) = determine_delayed_trains(
-        parsed_data_with_delays)
-    # send a push notification if the trains are delayed significantly
-    if max_departure_delay >= warn_delay_threshold:
-        pn.delay_push_notify(config.push_notification_sql, delayed_trains)
-    return None
-
-
-@ten.retry(**RETRY_PARAMS)
-def query_siri():
+    :return parsed_data_with_delays: the transit data compared to the
+        schedule, it is used by the adaptive poller
+    :rtype: pandas data frame
+    """
+    with mf.time_stage('siri', 'fetch'):
+        monitored_stops = query_siri(agency)
+        write_transit_data_to_json(config.siri_json_dir,
+                                   'siri' + config.agency_suffix(agency) + '-',
+                                   monitored_stops)
+    with mf.time_stage('siri', 'parse'):
+        parsed_data = run_parser(parse_siri_transit_data, monitored_stops,
+                                 time_index)
+    with mf.time_stage('siri', 'schedule_compare'):
+        parsed_data_with_delays = compare_actual_to_schedule(parsed_data,
+                                                             schedule_monitor)
+    with mf.time_stage('siri', 'save'):
+        save_transit_data(parsed_data_with_delays, 'siri', data_db_location,
+                          agency)
+        # Save to task monitor database    
+        sf.insert_periodic_task_monitor(data_db_location, time_index)
+    with mf.time_stage('siri', 'notify'):
+        notify_delays(parsed_data_with_delays, 'siri', agency)
+    return parsed_data_with_delays
+
+
+@rtf.external_call('511_siri')
+def query_siri(agency):
     """
     Query the 511 api to collect stop monitoring information. Convert the json
         to a dict
     
-    :param None
+    :param agency: 511 operator id of the agency
+    :type agency: string
     
     :return list with the stop monitoring information
     """
-    url = (siri_api + config.transit_511_api_key + '&agency=' + agency +
-           '&Format=JSON')
+    url = (config.transit_511_base_url + siri_api +
+           config.transit_511_api_key + '&agency=' + agency + '&Format=JSON')
     json_url = requests.get(url)
     data = json.loads(json_url.content.decode('utf-8-sig'))
     return (data['ServiceDelivery']['StopMonitoringDelivery']
             ['MonitoredStopVisit'])
 
 
-@ten.retry(**RETRY_PARAMS)
 def parse_siri_transit_data(monitored_stops, time_index):
     """
     Parses the siri transit data provided by the query command.
@@ -230,70 +375,67 @@ def parse_siri_transit_data(monitored_stops, time_index):
         except Exception:
             logging.exception('')
             continue
-        # create recorded time objects
-        (recorded_at_time_utc, recorded_at_time_date,
-         recorded_at_time_time) = create_time_objects(
-            dp.parse(recorded_at_time),
-            config.to_zone)
         # convert special train to format used in gfts
         if trip_id[0] == 'S':
             date_str = dt.datetime.now().strftime('%m%d%Y')
             trip_id = trip_id + '_' + date_str
-        # arrival time objects
-        (aimed_arrival_time_utc, aimed_arrival_time_date,
-         aimed_arrival_time_time) = create_time_objects(
-            dp.parse(aimed_arrival_time), config.to_zone)
-        # departure time objects
-        (aimed_departure_time_utc, aimed_departure_time_date,
-         aimed_departure_time_time) = create_time_objects(
-            dp.parse(aimed_departure_time), config.to_zone)
         # append the results to the data list
-        cur_data = [time_index, recorded_at_time_date, recorded_at_time_time,
-                    recorded_at_time_utc, station_name, stop_id, trip_id,
-                    vehicle_at_stop, aimed_arrival_time_date,
-                    aimed_arrival_time_time, aimed_arrival_time_utc,
-                    aimed_departure_time_date, aimed_departure_time_time,
-                    aimed_departure_time_utc]
+        cur_data = [time_index, epoch_seconds(dp.parse(recorded_at_time)),
+                    station_name, stop_id, trip_id, vehicle_at_stop,
+                    epoch_seconds(dp.parse(aimed_arrival_time)),
+                    epoch_seconds(dp.parse(aimed_departure_time))]
         data_list.append(cur_data)
     data = pd.DataFrame(data_list, columns=siri_columns)
     data_columns = ordered_unique_list(siri_columns + gfts_columns)
     data = data.reindex(columns=data_columns)
-    return data
+    return categorize(data)
 
 
 """ GTFS-RT Functions"""
 
 
-def query_transit_data_gtfs_rt(data_db_location, schedule_monitor, time_index):
+def query_transit_data_gtfs_rt(data_db_location, schedule_monitor, agency,
+                               time_index):
     """
-    :param data_db_location: location of the sql database to store the results
+    :param data_db_location: location of the sql database of the agency to
+        store the results
     :type string
     
     :param schedule_monitor: data frame that contains schedule information
+        of the agency
     :type schedule_monitor: pandas data frame
     
+    :param agency: 511 operator id of the agency
+    :type agency: string
+    
     :param time_index: time index for when the data is collected
     :type integer
     
-    :return None:
-    """
-    monitored_stops = query_gtfs_rt()
-    parsed_data = parse_gtfs_rt_transit_data(monitored_stops, time_index)
-    parsed_data_with_delays = compare_actual_to_schedule(parsed_data,
-                                                         schedule_monitor)
-    save_transit_data(parsed_data_with_delays, 'gtfs-rt', data_db_location)
-    # Save to task monitor database    
-    sf.insert_periodic_task_monitor(data_db_location, time_index)
-    # determine the delayed trains
-    (max_departure_delay, delayed_trains) = determine_delayed_trains(
-        parsed_data_with_delays)
-    # send a push notification if the trains are delayed significantly
-    if max_departure_delay >= warn_delay_threshold:
-        pn.delay_push_notify(config.push_notification_sql, delayed_trains)
-    return None
+    :return parsed_data_with_delays: the transit data compared to the
+        schedule, it is used by the adaptive poller
+    :rtype: pandas data frame
+    """
+    with mf.time_stage('gtfs_rt', 'fetch'):
+        monitored_stops = query_gtfs_rt(agency)
+        write_transit_data_to_json(config.gtfs_rt_json_dir,
+                                   'gtfs-rt' + config.agency_suffix(agency) +
+                                   '-', monitored_stops)
+    with mf.time_stage('gtfs_rt', 'parse'):
+        parsed_data = run_parser(parse_gtfs_rt_transit_data,
+                                 monitored_stops, time_index)
+    with mf.time_stage('gtfs_rt', 'schedule_compare'):
+        parsed_data_with_delays = compare_actual_to_schedule(parsed_data,
+                                                             schedule_monitor)
+    with mf.time_stage('gtfs_rt', 'save'):
+        save_transit_data(parsed_data_with_delays, 'gtfs-rt',
+                          data_db_location, agency)
+        # Save to task monitor database    
+        sf.insert_periodic_task_monitor(data_db_location, time_index)
+    with mf.time_stage('gtfs_rt', 'notify'):
+        notify_delays(parsed_data_with_delays, 'gtfs-rt', agency)
+    return parsed_data_with_delays
 
 
-@ten.retry(**RETRY_PARAMS)
 def parse_gtfs_rt_transit_data(transit_data, time_index):
     """
     Parses the gtfs-rt transit data provided by the query command.
@@ -308,14 +450,9 @@ def parse_gtfs_rt_transit_data(transit_data, time_index):
     :type data: pandas data frame
     """
     data_list = []
-    recorded_at_time = transit_data['header']['timestamp']
+    # the gtfs-rt times are already seconds since the epoch
+    recorded_at_time_utc = int(float(transit_data['header']['timestamp']))
     entities = transit_data['entity']
-    # create the recorded at time objects
-    recorded_at_time_dt = dt.datetime.utcfromtimestamp(float(recorded_at_time))
-    recorded_at_time_dt = recorded_at_time_dt.replace(tzinfo=config.from_zone)
-    (recorded_at_time_utc, recorded_at_time_date,
-     recorded_at_time_time) = create_time_objects(recorded_at_time_dt,
-                                                  config.to_zone)
     for entity in entities:
         try:
             trip_id = entity['tripUpdate']['trip']['tripId']
@@ -327,50 +464,141 @@ def parse_gtfs_rt_transit_data(transit_data, time_index):
         for stop_time in stop_time_update:
             try:
                 stop_id = int(stop_time['stopId'])
-                aimed_departure_time = stop_time['departure']['time']
+                aimed_departure_time_utc = int(float(
+                    stop_time['departure']['time']))
             except Exception:
                 logging.exception('')
                 continue
-            # created the aimed departure time objects
-            aimed_departure_time_dt = dt.datetime.utcfromtimestamp(
-                float(aimed_departure_time))
-            aimed_departure_time_dt = aimed_departure_time_dt.replace(
-                tzinfo=config.from_zone)
-            (aimed_departure_time_utc, aimed_departure_time_date,
-             aimed_departure_time_time) = create_time_objects(
-                aimed_departure_time_dt, config.to_zone)
-            cur_data = [time_index, recorded_at_time_date,
-                        recorded_at_time_time,
-                        recorded_at_time_utc, stop_id, trip_id,
-                        aimed_departure_time_date, aimed_departure_time_time,
+            cur_data = [time_index, recorded_at_time_utc, stop_id, trip_id,
                         aimed_departure_time_utc]
             data_list.append(cur_data)
     data = pd.DataFrame(data_list, columns=gfts_columns)
     data_columns = ordered_unique_list(gfts_columns + siri_columns)
     data = data.reindex(columns=data_columns)
-    return data
+    return categorize(data)
 
 
-@ten.retry(**RETRY_PARAMS)
-def query_gtfs_rt():
+@rtf.external_call('511_gtfs_rt')
+def query_gtfs_rt(agency):
     """
     Query the 511 api to collect trip update information. Convert the json
         to a dict
     
-    :param None
+    :param agency: 511 operator id of the agency
+    :type agency: string
     
     :return dictionary with the stop monitoring information
     """
     feed = gtfs_realtime_pb2.FeedMessage()
-    url = (gtfs_rt_api + config.transit_511_api_key + '&agency=' + agency)
+    url = (config.transit_511_base_url + gtfs_rt_api +
+           config.transit_511_api_key + '&agency=' + agency)
     response = requests.get(url)
     feed.ParseFromString(response.content)
-    return MessageToDict(feed)
+    return json_format.MessageToDict(feed)
 
 
 """ Transit Helper Functions """
 
 
+def notify_delays(data, source, agency):
+    """
+    Update the delay of each train and send the alerts for the trains whose
+        delay changed significantly. Only the agencies in
+        config.delay_alert_agencies are alerted and only from the feed
+        config.delay_alert_source.
+
+    :param data: data frame returned by compare_actual_to_schedule
+    :type data: pandas data frame
+
+    :param source: feed of the data, siri or gtfs-rt
+    :type source: string
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :return None
+    """
+    if (agency not in config.delay_alert_agencies or
+            source != config.delay_alert_source):
+        return None
+    al.update_delay_alerts(data, agency)
+    al.notify_pending_alerts(functools.partial(
+        pn.delay_push_notify, config.push_notification_sql))
+    return None
+
+
+def run_parser(parse_function, transit_data, time_index):
+    """
+    Runs the parse function in the parse process pool defined by
+        config.executor_config['parse']. If the pool has no workers, the
+        parse function runs in the calling thread.
+
+    :param parse_function: function that parses the transit data
+    :type parse_function: function
+
+    :param transit_data: data returned by the query function
+    :type transit_data: dictionary
+
+    :param time_index: time index for when the data is collected
+    :type integer
+
+    :return data: pandas data frame that contains the parsed data
+    :type data: pandas data frame
+    """
+    if config.executor_config['parse']['max_workers'] == 0:
+        return parse_function(transit_data, time_index)
+    return start_parse_pool().submit(parse_function, transit_data,
+                                     time_index).result()
+
+
+def start_parse_pool():
+    """
+    Create the parse process pool defined by config.executor_config['parse']
+        and start its workers if it does not exist. The collector calls it
+        when it starts, before the dispatcher runs the jobs.
+
+    :return parse_pool: the parse process pool, None if the pool has no
+        workers
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    global parse_pool
+    max_workers = config.executor_config['parse']['max_workers']
+    with parse_pool_lock:
+        if parse_pool is None and max_workers > 0:
+            parse_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+            # the workers are started and import this module now instead
+            # of delaying the first parse
+            concurrent.futures.wait([parse_pool.submit(parse_worker_pid)
+                                     for _ in range(max_workers)])
+    return parse_pool
+
+
+def parse_worker_pid():
+    """
+    Return the process id of the parse worker, used to start the workers
+
+    :return process id
+    :rtype: int
+    """
+    return os.getpid()
+
+
+def shutdown_parse_pool():
+    """
+    Shut down the parse process pool after the running parses are done
+
+    :return None
+    """
+    global parse_pool
+    with parse_pool_lock:
+        if parse_pool is not None:
+            parse_pool.shutdown(wait=True)
+            parse_pool = None
+    return None
+
+
 def compare_actual_to_schedule(data, schedule_monitor):
     """
     Compares the parsed data to the schedule. Determines which trains are on 
@@ -387,11 +615,11 @@ def compare_actual_to_schedule(data, schedule_monitor):
         performance joined to it
     :type pandas data frame
     """
-    # create time in seconds from midnight
-    data['aimed_arrival_time_seconds'] = seconds_from_midnight(
-        data['aimed_arrival_time_time'])
-    data['aimed_departure_time_seconds'] = seconds_from_midnight(
-        data['aimed_departure_time_time'])
+    # create the local time in seconds from midnight
+    data['aimed_arrival_time_seconds'] = local_seconds_from_midnight(
+        local_datetimes(data['aimed_arrival_time_utc']))
+    data['aimed_departure_time_seconds'] = local_seconds_from_midnight(
+        local_datetimes(data['aimed_departure_time_utc']))
     # create multi-indexes so that they can be merged
     data.set_index(['trip_id', 'stop_id'], inplace=True)
     # merge the two data frames on the index, only keep records in both
@@ -399,9 +627,11 @@ def compare_actual_to_schedule(data, schedule_monitor):
     data = pd.merge(data, schedule_monitor, right_index=True, left_index=True,
                     how='inner')
     data.reset_index(inplace=True)
-    # determine the start date of the train
+    # determine the start date of the train from the local departure date
+    departure_date = local_datetimes(data['aimed_departure_time_utc']
+                                     ).dt.tz_localize(None).dt.normalize()
     data['train_start_date'] = \
-        ((pd.to_datetime(data['aimed_departure_time_date'])
+        ((departure_date
           + pd.to_timedelta(data['trip_start_date_delta'],
                             unit='D')).dt.strftime("%Y-%m-%d"))
     # drop the column trip_start_date_delta because they are not needed
@@ -419,42 +649,7 @@ def compare_actual_to_schedule(data, schedule_monitor):
     return data
 
 
-def determine_delayed_trains(data):
-    """    
-    Creates a data frame with the delayed trains and determines the maximum
-        departure delay.
-    
-    :param data: pandas data frame that contains the parsed real time data
-    :type data: pandas data frame
-    
-    :return delayed_trains: data frame that contains the delayed trains
-    :type delayed_trains: pandas data frame
-    
-    :return max_departure_delay: maximum departure delay
-    :type max_departure_delay: float
-    """
-    # select trains with delay greater than 2 minutes
-    delayed_trains = data[data['departure_delay'] >= 0].copy(deep=True)
-    delayed_trains['departure_delay'] = delayed_trains['departure_delay'] / 60
-    # sort by departure time, ascending
-    delayed_trains.sort_values('aimed_departure_time_seconds', inplace=True)
-    # group the data by trip_id and return the first one
-    # this is the next stop that the train will be going to
-    delayed_trains = delayed_trains.groupby('trip_id').first()
-    delayed_trains.reset_index(inplace=True)
-    delayed_trains = delayed_trains[['trip_id', 'short_stop_name',
-                                     'departure_delay']]
-    delayed_trains = delayed_trains.sort_values(by='departure_delay',
-                                                ascending=False,
-                                                na_position='last')
-    delayed_trains = delayed_trains.loc[
-        delayed_trains['departure_delay'] > warn_delay_threshold]
-    max_departure_delay = delayed_trains['departure_delay'].max()
-    return max_departure_delay, delayed_trains
-
-
-@ten.retry(**RETRY_PARAMS)
-def save_transit_data(data, type_switch, db_location):
+def save_transit_data(data, type_switch, db_location, agency):
     """
     Saves the transit data to sql database.
     
@@ -468,55 +663,75 @@ def save_transit_data(data, type_switch, db_location):
     
     :param db_location: location of the sql file that the data is stored in
     :type string
+
+    :param agency: 511 operator id of the agency, the trips are stored as
+        their key in the dimension tables of the agency
+    :type agency: string
     """
     # select the appropriate table names
     if type_switch == 'siri':
         table_name = config.siri_table_name
-        data_format_dict = table_def.siri_dict
+        table = table_def.siri_table
     elif type_switch == 'gtfs-rt':
         table_name = config.gfts_rt_table_name
-        data_format_dict = table_def.gtfs_dict
+        table = table_def.gtfs_table
     else:
         raise Exception('The type_switch ({}) is not supported'.format(
             type_switch))
+    # the trip ids are replaced by their keys, the station names are found
+    # from the stop id
+    data = data.assign(trip_key=dim.trip_key_series(
+        config.dimension_sql, agency, data['trip_id']))
     # save the results to sql database
     # prepare the pandas data to upload to sql
-    prepared_data = sf.prepare_pandas_to_sql(data, data_format_dict)
-    sf.update_entries(db_location, table_name,
-                      prepared_data, columns_to_compare)
+    prepared_data = sf.prepare_pandas_to_sql(data, table)
+    # each train is stored in the partition of its start date and its
+    # summary is updated for the retention (retention_functions)
+    sf.update_partitioned_entries(db_location, table_name, prepared_data,
+                                  columns_to_compare, 'train_start_date',
+                                  summarize=True, table=table)
 
 
 """ Time Functions """
 
 
-def create_time_objects(input_dt, to_time_zone):
+def epoch_seconds(input_dt):
     """
-    Parses a utc time string and returns different time objects.
+    Converts a datetime to the seconds since the epoch that are stored
 
-    :paraminput_dt: input datetime object with timezone information
-    :typeinput_dt: datetime
-    
-    :paramto_time_zone: time zone object that is used to convert the utc time
-        to the to_time_zone
-    :typeto_time_zone: time zone object
-    
-    :returnutc:
-    :typeutc: float
-    
-    :returndate: Year, month and date for the utc_time_str converted to the
-        to_time_zone
-    :typedate: string
+    :param input_dt: input datetime object with timezone information
+    :type input_dt: datetime
+
+    :return seconds since the epoch
+    :rtype: int
+    """
+    return int(input_dt.timestamp())
+
+
+def local_datetimes(utc_series):
+    """
+    Converts the seconds since the epoch to datetimes in config.to_zone
+
+    :param utc_series: a series that contains the seconds since the epoch
+    :type utc_series: series
+
+    :return series of datetimes with timezone information
+    """
+    return pd.to_datetime(pd.to_numeric(utc_series), unit='s',
+                          utc=True).dt.tz_convert(config.to_zone)
 
-    :returntime: hour, minute and second for the utc_time_str converted to
-        the to_time_zone
-    :typetime: string
 
+def local_seconds_from_midnight(datetime_series):
     """
-    new_dt = input_dt.astimezone(to_time_zone)
-    utc = input_dt.timestamp()
-    date = new_dt.strftime('%Y-%m-%d')
-    time = new_dt.strftime('%H:%M:%S')
-    return utc, date, time
+    Converts the datetimes to seconds from the local midnight
+
+    :param datetime_series: a series that contains the local datetimes
+    :type datetime_series: series
+
+    :return series of seconds, NaN where the datetime is missing
+    """
+    return (60 * 60 * datetime_series.dt.hour +
+            60 * datetime_series.dt.minute + datetime_series.dt.second)
 
 
 def seconds_from_midnight(time_series):
@@ -607,38 +822,33 @@ def dummy_function(trip_index, trip_id, start_station, end_station, start_loc,
     return: None
     """
     # construct time objects
-    date_str = dt.datetime.now().date().isoformat()  # string
-    time_str = dt.datetime.now().time().isoformat()  # string
-    day_of_week = dt.datetime.now().isoweekday()  # integer
-    utc_time = dt.datetime.utcnow().timestamp()
+    now = dt.datetime.now()
     # print out the task that you are calling
     print_str = (str(trip_index) + ': ' + start_station + ' to ' + end_station
-                 + ' on ' + date_str + ' at ' + time_str)
+                 + ' on ' + now.date().isoformat() + ' at ' +
+                 now.time().isoformat())
     print(print_str)
     logger.info(print_str)
     (duration_in_traffic, directions_result) = dummy_query_google_api()
     # create the tuple that is inserted into the database. Ensure that all
     # parameters are the right data type
-    data_tuple = (str(date_str), str(time_str), float(utc_time),
-                  int(day_of_week), int(trip_index), int(trip_id),
-                  str(start_station), str(end_station), str(start_loc),
-                  str(end_loc), str(directions_result),
-                  float(duration_in_traffic))
+    data_tuple = ((int(now.timestamp()), int(now.isoweekday()),
+                   int(trip_index)) +
+                  traffic_keys(trip_id, start_station, end_station) +
+                  (str(directions_result), float(duration_in_traffic), 0,
+                   0))
     # insert the data into the database
     sf.insert_traffic_data(sql_db_loc, data_tuple)
 
     return None
 
 
-@ten.retry(**RETRY_PARAMS)
+@rtf.external_call('dummy_google_directions')
 def dummy_query_google_api():
     """
-    This program is a dummy function used to test various aspects. The retry 
-        wrapper will retry this function if an error occurs. The dummy function
-        will randomly produce a key error. The probability was set so that the
-        key error will propagate after the five attempts. The method is 
-        exponential back off with jitter and it will retry 5 times before
-        raising an exception.
+    This program is a dummy function used to test various aspects. The dummy
+        function will randomly produce an error, so it exercises the retries
+        and the circuit breaker of its endpoint (retry_functions).
     
     :return directions_result: the results returned by querying google maps
     :type dictionary
@@ -671,6 +881,22 @@ def periodic_dummy_function(tst_arg_0, tst_arg_1):
     print(tst_arg_0 + date_str + tst_arg_1)
 
 
+def categorize(data):
+    """
+    Convert the columns of the parsed data that repeat a few values (the
+        trip ids and station names) to categoricals
+
+    :param data: parsed transit data
+    :type data: pandas data frame
+
+    :return data: data frame with the categorical columns
+    :type data: pandas data frame
+    """
+    for column in categorical_columns:
+        data[column] = data[column].astype('category')
+    return data
+
+
 def ordered_unique_list(seq):
     """
     Reduces a list to unique values only while maintaining order.
@@ -5,6 +5,7 @@ Created on Sun Oct 28 15:27:15 2018
 @author: Robert
 """
 import pandas as pd
+import artifact_functions as af
 import sql_functions as sf
 import config
 import numpy as np
@@ -12,7 +13,7 @@ import data_analysis as da
 
 traffic_db_loc = config.traffic_data_sql
 transit_db_loc = config.gtfs_rt_data_sql
-schedule_trips = pd.read_csv(config.trips_csv, index_col=0)
+schedule_trips = af.load_artifact(config.trips_artifact)
 
 last_date_traffic = da.min_max_date(traffic_db_loc, 'traffic_data', 
                                     'utc_time', 'max')
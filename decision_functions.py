@@ -0,0 +1,287 @@
+"""
+Description: This file contains the functions of the car or train decision
+    (decision_service.py). The latest traffic duration of each station
+    pair, the latest delay of each train and stop of today and the traffic
+    durations of each traffic trip are kept in memory. The cache is
+    refreshed incrementally: only the traffic rows with a rowid above the
+    last rowid and the predictions that were recorded since the last
+    prediction that was read from each database file are read. A decision is
+    a few dictionary lookups, so it does not touch the databases.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import bisect
+import datetime as dt
+import threading
+
+import artifact_functions as af
+import config
+import dimension_functions as dim
+import sql_functions as sf
+
+# days of traffic history that are read when the cache is first loaded
+history_days = 365
+# a traffic duration older than this many seconds is not live, the median of
+# the history of the trip is used instead
+live_traffic_max_age_secs = 30 * 60
+# the next departures from the start station that are compared
+num_departures = 3
+
+# the cache is shared by the refresh thread and the request threads
+cache_lock = threading.Lock()
+# {database file: last rowid (traffic) or recorded_at_time_utc (gtfs-rt)
+# that was read}
+last_values = {}
+# {pair_key: (utc_time, duration_in_traffic)} of the latest traffic rows
+latest_traffic = {}
+# {trip_index: sorted traffic durations} of the traffic trips
+traffic_history = {}
+# {(train_start_date, trip_key, stop_id): (recorded_at_time_utc,
+# departure_delay)} of the latest predictions
+latest_delays = {}
+# {(start station, end station): list of the scheduled trips ordered by
+# departure}, {(start station, end station): pair_key} and
+# {trip_id: trip_key}, read once from the artifact and dimension tables
+departures = {}
+pair_keys = {}
+trip_keys = {}
+
+
+def load_schedule(trips_path, dimension_db_loc, agency):
+    """
+    Load the scheduled trips and their keys in the dimension tables
+
+    :param trips_path: location of the trips artifact
+    :type trips_path: string
+
+    :param dimension_db_loc: location of the dimension database
+    :type dimension_db_loc: string
+
+    :param agency: 511 operator id of the agency of the trips
+    :type agency: string
+
+    :return None
+    """
+    schedule_trips = af.load_artifact(trips_path, columns=[
+        'trip_index', 'trip_id', 'short_stop_name_start',
+        'short_stop_name_stop', 'stop_id_start', 'stop_id_stop',
+        'departure_time_timedelta_start', 'arrival_time_timedelta_stop'] +
+        config.weekday_names)
+    trips = {}
+    for trip in schedule_trips.itertuples(index=False):
+        pair = (str(trip.short_stop_name_start),
+                str(trip.short_stop_name_stop))
+        trips.setdefault(pair, []).append({
+            'trip_index': int(trip.trip_index),
+            'trip_id': str(trip.trip_id),
+            'stop_id_start': int(trip.stop_id_start),
+            'stop_id_stop': int(trip.stop_id_stop),
+            'departure_secs': int(
+                trip.departure_time_timedelta_start.total_seconds()),
+            'arrival_secs': int(
+                trip.arrival_time_timedelta_stop.total_seconds()),
+            'weekdays': [day for (day, day_name) in enumerate(
+                config.weekday_names) if getattr(trip, day_name) == 1]})
+    for pair_trips in trips.values():
+        pair_trips.sort(key=lambda trip: trip['departure_secs'])
+    keys = dim.trip_keys(dimension_db_loc, agency, schedule_trips['trip_id'],
+                         create=False)
+    pairs = {(start, end): key for (start, end, key) in sf.query_data(
+        dimension_db_loc, dim.station_pairs_sql(agency))}
+    with cache_lock:
+        departures.clear()
+        departures.update(trips)
+        trip_keys.clear()
+        trip_keys.update(keys)
+        pair_keys.clear()
+        pair_keys.update(pairs)
+    return None
+
+
+def refresh_cache(traffic_db_loc, transit_db_loc, today=None):
+    """
+    Add the traffic and transit rows that are new since the previous refresh
+        to the cache and forget the delays of the previous service days
+
+    :param traffic_db_loc: location of the traffic database
+    :type traffic_db_loc: string
+
+    :param transit_db_loc: location of the gtfs-rt database of the agency
+    :type transit_db_loc: string
+
+    :param today: current date, defaults to today
+    :type today: date
+
+    :return num_rows: number of rows that were added
+    :rtype: int
+    """
+    if today is None:
+        today = dt.date.today()
+    first_date = today - dt.timedelta(days=history_days)
+    # the durations that were predicted by the traffic model are skipped
+    (traffic_rows, traffic_values) = sf.query_new_rows(
+        traffic_db_loc, 'traffic_data',
+        ['utc_time', 'trip_index', 'pair_key', 'duration_in_traffic'],
+        first_date, 'utc_time >= %d and from_model = 0' %
+        sf.local_midnight_epoch(first_date), last_values)
+    # the trains of yesterday can still run after midnight. The updated
+    # predictions keep their rowid, so they are read by their recorded time.
+    yesterday = (today - dt.timedelta(days=1)).isoformat()
+    (transit_rows, transit_values) = sf.query_new_rows(
+        transit_db_loc, config.gfts_rt_table_name,
+        ['train_start_date', 'trip_key', 'stop_id', 'recorded_at_time_utc',
+         'departure_delay'], today - dt.timedelta(days=1),
+        "train_start_date >= '%s'" % yesterday, last_values,
+        'recorded_at_time_utc')
+    with cache_lock:
+        for (utc_time, trip_index, pair_key, duration) in traffic_rows:
+            if utc_time >= latest_traffic.get(pair_key, (0, None))[0]:
+                latest_traffic[pair_key] = (utc_time, duration)
+            bisect.insort(traffic_history.setdefault(trip_index, []),
+                          duration)
+        for (train_start_date, trip_key, stop_id, recorded_utc_time,
+             delay) in transit_rows:
+            key = (train_start_date, trip_key, stop_id)
+            if recorded_utc_time >= latest_delays.get(key, (0, None))[0]:
+                latest_delays[key] = (recorded_utc_time, delay)
+        for key in [key for key in latest_delays if key[0] < yesterday]:
+            del latest_delays[key]
+        last_values.update(traffic_values)
+        last_values.update(transit_values)
+    return len(traffic_rows) + len(transit_rows)
+
+
+def train_delay(train_start_date, trip_key, stop_ids):
+    """
+    Find the latest departure delay of a train at the first of the stops that
+        has a prediction. Call with cache_lock held.
+
+    :param train_start_date: service day of the train, iso format
+    :type train_start_date: string
+
+    :param trip_key: key of the train in the dimension tables
+    :type trip_key: int
+
+    :param stop_ids: stop ids in the order of preference
+    :type stop_ids: list of ints
+
+    :return departure delay in seconds, 0 if there is no prediction
+    :rtype: float
+    """
+    for stop_id in stop_ids:
+        prediction = latest_delays.get((train_start_date, trip_key, stop_id))
+        if prediction is not None and prediction[1] is not None:
+            return prediction[1]
+    return 0
+
+
+def car_duration(pair, trip_index, utc_time_now):
+    """
+    Estimate the duration of the drive between the stations. The latest
+        traffic duration is used if it is live, otherwise the median of the
+        history of the trip. Call with cache_lock held.
+
+    :param pair: (start station, end station)
+    :type pair: tuple
+
+    :param trip_index: index of the traffic trip
+    :type trip_index: int
+
+    :param utc_time_now: current time in seconds since the epoch
+    :type utc_time_now: float
+
+    :return duration in seconds and its source (live, history or None)
+    :rtype: tuple
+    """
+    (utc_time, duration) = latest_traffic.get(pair_keys.get(pair), (0, None))
+    if duration is not None and (utc_time_now - utc_time <=
+                                 live_traffic_max_age_secs):
+        return duration, 'live'
+    history = traffic_history.get(trip_index, [])
+    if len(history) > 0:
+        return history[len(history) // 2], 'history'
+    return None, None
+
+
+def decide(start_station, end_station, now=None):
+    """
+    Decide if it is faster to drive or to take one of the next trains from
+        start_station to end_station when leaving now. The arrival of each
+        train is its scheduled arrival plus its latest delay. The trains of
+        the service day of yesterday that still run after midnight are
+        included, the times are seconds after the midnight of today.
+
+    :param start_station: short name of the start station
+    :type start_station: string
+
+    :param end_station: short name of the end station
+    :type end_station: string
+
+    :param now: local time, defaults to now
+    :type now: datetime
+
+    :return decision: dictionary with the mode (car or train), the next
+        train, the drive and the fraction of the historical drives that took
+        longer than the train ride. None if no train runs between the
+        stations.
+    :rtype: dictionary
+    """
+    if now is None:
+        now = dt.datetime.now()
+    pair = (start_station, end_station)
+    now_secs = now.hour * 3600 + now.minute * 60 + now.second
+    # (service day, seconds from its midnight to the midnight of today), the
+    # gtfs times of the trains of yesterday after midnight are >= 24:00
+    service_days = [(now.date() - dt.timedelta(days=1), 86400),
+                    (now.date(), 0)]
+    with cache_lock:
+        pair_trips = departures.get(pair, [])
+        departure_secs = [trip['departure_secs'] for trip in pair_trips]
+        trains = []
+        for (service_day, day_secs) in service_days:
+            service_date = service_day.isoformat()
+            first = bisect.bisect_left(departure_secs, now_secs + day_secs)
+            day_trains = 0
+            for trip in pair_trips[first:]:
+                if service_day.weekday() not in trip['weekdays']:
+                    continue
+                trip_key = trip_keys.get(trip['trip_id'])
+                arrival_delay = train_delay(service_date, trip_key, [
+                    trip['stop_id_stop'], trip['stop_id_start']])
+                departure_delay = train_delay(service_date, trip_key,
+                                              [trip['stop_id_start']])
+                trains.append({
+                    'trip_id': trip['trip_id'],
+                    'trip_index': trip['trip_index'],
+                    'train_start_date': service_date,
+                    'departure_secs': (trip['departure_secs'] - day_secs +
+                                       departure_delay),
+                    'arrival_secs': (trip['arrival_secs'] - day_secs +
+                                     arrival_delay),
+                    'delay_secs': arrival_delay})
+                day_trains += 1
+                if day_trains == num_departures:
+                    break
+        if len(trains) == 0:
+            return None
+        trains = sorted(trains, key=lambda train: train['departure_secs'])[
+            :num_departures]
+        # the train that arrives first, a later train can be faster
+        train = min(trains, key=lambda train: train['arrival_secs'])
+        (drive_secs, drive_source) = car_duration(pair, train['trip_index'],
+                                                  now.timestamp())
+        # fraction of the historical drives that took longer than the train
+        # ride, like data_analysis.create_plots
+        history = traffic_history.get(train['trip_index'], [])
+        ride_secs = train['arrival_secs'] - train['departure_secs']
+        trip_fraction = ((len(history) - bisect.bisect_right(history,
+                                                             ride_secs)) /
+                         len(history) if len(history) > 0 else None)
+    train['duration_secs'] = train['arrival_secs'] - now_secs
+    take_train = drive_secs is None or train['duration_secs'] <= drive_secs
+    return {'start_station': start_station,
+            'end_station': end_station,
+            'mode': 'train' if take_train else 'car',
+            'train': train,
+            'car': {'duration_secs': drive_secs, 'source': drive_source},
+            'trip_fraction': trip_fraction}
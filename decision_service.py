@@ -0,0 +1,148 @@
+"""
+Description: This program runs a local http service that answers "depart
+    from X to Y now: car or train?" from the in memory cache of
+    decision_functions. A background thread refreshes the cache every
+    config.decision_refresh_secs seconds with the rows that were added since
+    the previous refresh.
+
+    GET /decision?start=Palo%20Alto&end=San%20Francisco returns the decision
+    as json, GET /health returns the time of the last refresh.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import http.server
+import json
+import logging
+import threading
+import time
+import urllib.parse
+
+import config
+import decision_functions as dec
+import file_functions as ff
+
+
+class DecisionHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests to the decision service
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == '/decision':
+            if 'start' not in query or 'end' not in query:
+                self.respond(400, {'error': 'start and end are required'})
+                return
+            decision = dec.decide(query['start'][0], query['end'][0])
+            if decision is None:
+                self.respond(404, {'error': 'no train runs between the '
+                                            'stations'})
+            else:
+                self.respond(200, decision)
+        elif url.path == '/health':
+            self.respond(200, {'refreshed_utc_time':
+                               self.server.refreshed_utc_time})
+        else:
+            self.respond(404, {'error': 'unknown path'})
+
+    def respond(self, status, body):
+        """
+        Send the body as json
+        """
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # the requests are logged at the debug level
+        logging.debug(format % args)
+
+
+def refresh_periodically(server, traffic_db_loc, transit_db_loc,
+                         refresh_secs, stop_event):
+    """
+    Refresh the cache every refresh_secs seconds until stop_event is set
+
+    :param server: the decision service
+    :type server: http.server.ThreadingHTTPServer
+
+    :param traffic_db_loc: location of the traffic database
+    :type traffic_db_loc: string
+
+    :param transit_db_loc: location of the gtfs-rt database of the agency
+    :type transit_db_loc: string
+
+    :param refresh_secs: seconds between the refreshes
+    :type refresh_secs: float
+
+    :param stop_event: event that stops the refreshes when it is set
+    :type stop_event: threading.Event
+
+    :return None
+    """
+    while not stop_event.wait(refresh_secs):
+        try:
+            num_rows = dec.refresh_cache(traffic_db_loc, transit_db_loc)
+            server.refreshed_utc_time = time.time()
+            logging.debug('Decision cache refreshed with %d rows' % num_rows)
+        except Exception:
+            logging.exception('Decision cache refresh failed')
+    return None
+
+
+def start_decision_service(host=config.decision_service_host,
+                           port=config.decision_service_port,
+                           refresh_secs=config.decision_refresh_secs):
+    """
+    Load the cache and start the decision service and the refresh thread in
+        daemon threads
+
+    :param host: address to listen on
+    :type host: string
+
+    :param port: port to listen on, 0 picks a free port
+    :type port: int
+
+    :param refresh_secs: seconds between the refreshes of the cache
+    :type refresh_secs: float
+
+    :return server: the running decision service. Call server.shutdown() and
+        set server.stop_event to stop it.
+    :rtype: http.server.ThreadingHTTPServer
+    """
+    traffic_db_loc = config.traffic_data_sql
+    transit_db_loc = config.gtfs_rt_data_sql_shards[config.default_agency]
+    dec.load_schedule(config.trips_artifact, config.dimension_sql,
+                      config.default_agency)
+    dec.refresh_cache(traffic_db_loc, transit_db_loc)
+    server = http.server.ThreadingHTTPServer((host, port), DecisionHandler)
+    server.daemon_threads = True
+    server.refreshed_utc_time = time.time()
+    server.stop_event = threading.Event()
+    threading.Thread(target=refresh_periodically, name='decision_refresh',
+                     args=(server, traffic_db_loc, transit_db_loc,
+                           refresh_secs, server.stop_event),
+                     daemon=True).start()
+    threading.Thread(target=server.serve_forever, name='decision_service',
+                     daemon=True).start()
+    return server
+
+
+def main():
+    ff.create_log_file(config.decision_service_log_file)
+    server = start_decision_service()
+    print('Decision service listening on http://%s:%d' %
+          server.server_address[:2])
+    try:
+        server.stop_event.wait()
+    except KeyboardInterrupt:
+        server.stop_event.set()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Description: This file contains the functions for the dimension tables. The
+    stations (with their location), the trips and the station pairs of the
+    traffic trips are stored once in the dimension database
+    (config.dimension_sql) and the data tables store their small integer
+    keys. The dimensions are populated when the gtfs is parsed. A key that
+    is not in the dimension database yet, for example the trip of a special
+    train, is created when it is first seen. The keys never change, so they
+    are cached by the job threads.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import threading
+
+from import_functions import lazy_import
+import sql_functions as sf
+
+# pandas is only needed for the series of trip ids
+pd = lazy_import('pandas')
+
+# the caches are shared by the job threads
+dimension_lock = threading.Lock()
+# {(dimension database, agency): {trip_id: trip_key}}
+trip_key_cache = {}
+# {(dimension database, agency): {(start station, end station): pair_key}}
+pair_key_cache = {}
+
+
+def populate_dimensions(db_location, agency, stops, trip_ids,
+                        station_pairs=()):
+    """
+    Add the stations, stops, trips and station pairs of an agency to the
+        dimension database. The location of a station is the mean location
+        of its stops (platforms).
+
+    :param db_location: location of the dimension database
+    :type db_location: string
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :param stops: data frame with the columns stop_id, stop_name,
+        short_stop_name, stop_lat and stop_lon
+    :type stops: pandas data frame
+
+    :param trip_ids: trip ids of the agency
+    :type trip_ids: iterable
+
+    :param station_pairs: (start short_stop_name, end short_stop_name) of the
+        traffic trips
+    :type station_pairs: iterable of tuples
+
+    :return None
+    """
+    sf.create_dimension_tables(db_location)
+    stations = stops.groupby('short_stop_name', observed=True)[
+        ['stop_lat', 'stop_lon']].mean()
+    sf.insert_stations(db_location, [
+        (agency, str(name), float(lat), float(lon)) for (name, lat, lon) in
+        zip(stations.index, stations['stop_lat'], stations['stop_lon'])])
+    sf.insert_stops(db_location, [
+        (agency, stop_id, str(stop_name), str(short_stop_name))
+        for (stop_id, stop_name, short_stop_name) in zip(
+            stops['stop_id'].tolist(), stops['stop_name'].tolist(),
+            stops['short_stop_name'].tolist())])
+    sf.insert_trips(db_location, [(agency, trip_id) for trip_id in
+                                  sorted({str(trip_id) for trip_id in
+                                          trip_ids})])
+    sf.insert_station_pairs(db_location, [
+        (agency, str(start_station), str(end_station))
+        for (start_station, end_station) in station_pairs])
+    return None
+
+
+def trip_keys(db_location, agency, trip_ids, create=True):
+    """
+    Look up the keys of trips. The trips that are not in the dimension
+        database are added if create is True.
+
+    :param db_location: location of the dimension database
+    :type db_location: string
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :param trip_ids: trip ids
+    :type trip_ids: iterable
+
+    :param create: if True, the missing trips are added
+    :type create: bool
+
+    :return dictionary with the trip id (string) as the key and the trip key
+        as the value, the missing trips are left out if create is False
+    :rtype: dictionary
+    """
+    trip_ids = {str(trip_id) for trip_id in trip_ids}
+    with dimension_lock:
+        cache = trip_key_cache.setdefault((db_location, agency), {})
+        missing = trip_ids.difference(cache)
+        if len(missing) > 0:
+            sf.create_dimension_tables(db_location)
+            if create:
+                sf.insert_trips(db_location, [(agency, trip_id) for trip_id
+                                              in sorted(missing)])
+            # the trips table is small, all of the keys are read
+            cache.update(sf.query_data(
+                db_location, "select trip_id, trip_key from trips where "
+                             "agency = '%s'" % agency))
+        return {trip_id: cache[trip_id] for trip_id in trip_ids
+                if trip_id in cache}
+
+
+def trip_key_series(db_location, agency, trip_ids):
+    """
+    Convert a series of trip ids to their keys. Each distinct trip id is
+        looked up once through the categories of the series.
+
+    :param db_location: location of the dimension database
+    :type db_location: string
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :param trip_ids: trip ids, the missing trips are added
+    :type trip_ids: pandas series
+
+    :return series of trip keys with the index of trip_ids
+    :rtype: pandas series
+    """
+    trip_ids = trip_ids.astype(str).astype('category')
+    keys = trip_keys(db_location, agency, trip_ids.cat.categories)
+    return trip_ids.cat.rename_categories(
+        [keys[trip_id] for trip_id in trip_ids.cat.categories]).astype(
+        'int64')
+
+
+def pair_key(db_location, agency, start_station, end_station):
+    """
+    Look up the key of a station pair. The pair and its stations are added
+        if they are not in the dimension database (without a location).
+
+    :param db_location: location of the dimension database
+    :type db_location: string
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :param start_station: short name of the start station
+    :type start_station: string
+
+    :param end_station: short name of the end station
+    :type end_station: string
+
+    :return pair_key
+    :rtype: int
+    """
+    pair = (str(start_station), str(end_station))
+    with dimension_lock:
+        cache = pair_key_cache.setdefault((db_location, agency), {})
+        if pair not in cache:
+            sf.create_dimension_tables(db_location)
+            sf.insert_stations(db_location, [(agency, station, None, None)
+                                             for station in pair])
+            sf.insert_station_pairs(db_location, [(agency,) + pair])
+            cache.update({(start, end): key for (start, end, key) in
+                          sf.query_data(db_location, station_pairs_sql(
+                              agency))})
+        return cache[pair]
+
+
+def station_pairs_sql(agency):
+    """
+    Construct the sql query of the station names of the pairs of an agency
+
+    :param agency: 511 operator id of the agency
+    :type agency: string
+
+    :return sql query that selects the start station, end station and
+        pair_key
+    :rtype: string
+    """
+    return """select s.short_stop_name, e.short_stop_name, p.pair_key
+              from station_pairs as p
+              join stations as s on s.station_key = p.start_station_key
+              join stations as e on e.station_key = p.end_station_key
+              where s.agency = '%s'""" % agency
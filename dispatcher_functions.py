@@ -0,0 +1,434 @@
+"""
+Description: This file contains the functions for the in-process job
+    dispatcher. The jobs created by prepare_to_collect_data are loaded once
+    from the job database into a heap that is ordered by the next fire time.
+    The dispatcher sleeps until the earliest job is due, runs it in a bounded
+    worker pool and records the jobs that misfire. The job database is only
+    read again when prepare_to_collect_data changes it. The next run of a
+    job whose trigger depends on the result of the run (the adaptive
+    pollers) is determined when the run is done. The apscheduler scheduler
+    in scheduler_functions.run_tasks is kept as a fallback.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import collections
+import concurrent.futures
+import datetime as dt
+import heapq
+import itertools
+import logging
+import os
+import threading
+
+import metrics_functions as mf
+import retry_functions as rtf
+import scheduler_functions as sched
+import sql_functions as sf
+
+# seconds between checks of the job database for changed jobs
+job_store_poll_secs = 60
+# clock seconds until a job whose worker pool was full is dispatched again
+pool_full_retry_secs = 1
+
+# access the root logger
+logger = logging.getLogger('')
+
+
+def utc_now():
+    """
+    Current time in utc. This is the clock of the dispatcher unless a virtual
+        clock is passed to run_dispatcher.
+
+    :return now: current time with timezone information
+    :rtype: datetime
+    """
+    return dt.datetime.now(dt.timezone.utc)
+
+
+def job_type(job_id):
+    """
+    Determine the job type (the id prefix, for example trf- or sr_) that is
+        used to label the dispatcher metrics
+
+    :param job_id: id of the job
+    :type job_id: string
+
+    :return job type
+    :rtype: string
+    """
+    return job_id.rstrip('0123456789')
+
+
+def load_jobs(sched_sql_loc):
+    """
+    Load the jobs from the job database
+
+    :param sched_sql_loc: location of the sql job database
+    :type sched_sql_loc: string
+
+    :return jobs: dictionary of the jobs with the job id as the key
+    :rtype: dictionary
+    """
+    (scheduler, job_store) = sched.open_job_store(sched_sql_loc)
+    try:
+        jobs = {job.id: job for job in job_store.get_all_jobs()}
+    finally:
+        job_store.shutdown()
+    return jobs
+
+
+def next_fire_time(job, previous_fire_time, now):
+    """
+    Determine the next time that the job should run
+
+    :param job: apscheduler job
+    :type job: Job
+
+    :param previous_fire_time: the previous time the job was due or None
+    :type previous_fire_time: datetime
+
+    :param now: current time with timezone information
+    :type now: datetime
+
+    :return next fire time or None if the job will not run again
+    :rtype: datetime
+    """
+    return job.trigger.get_next_fire_time(
+        previous_fire_time, now.astimezone(job.trigger.timezone))
+
+
+def create_timer_heap(jobs, now):
+    """
+    Create a heap of (due time, sequence number, job id, fire time). The
+        sequence number keeps the order stable for jobs that are due at the
+        same time. The due time is the fire time unless the job is
+        dispatched again because its worker pool was full.
+
+    :param jobs: dictionary of the jobs with the job id as the key
+    :type jobs: dictionary
+
+    :param now: current time with timezone information
+    :type now: datetime
+
+    :return timer_heap: heap of the jobs ordered by the next fire time
+    :rtype: list of tuples
+    """
+    sequence = itertools.count()
+    timer_heap = []
+    for (job_id, job) in jobs.items():
+        fire_time = next_fire_time(job, None, now)
+        if fire_time is not None:
+            timer_heap.append((fire_time, next(sequence), job_id, fire_time))
+    heapq.heapify(timer_heap)
+    return timer_heap
+
+
+def reload_timer_heap(jobs, timer_heap, now):
+    """
+    Create the timer heap of the reloaded jobs. The jobs that are waiting
+        for a worker of a full pool (due time != fire time) are kept if
+        they still exist. A job that is rescheduled on completion only gets
+        its next run once the waiting run is done.
+
+    :param jobs: dictionary of the reloaded jobs with the job id as the key
+    :type jobs: dictionary
+
+    :param timer_heap: heap of the jobs before the reload
+    :type timer_heap: list of tuples
+
+    :param now: current time with timezone information
+    :type now: datetime
+
+    :return timer_heap: heap of the jobs ordered by the next fire time
+    :rtype: list of tuples
+    """
+    waiting = [entry for entry in timer_heap if entry[0] != entry[3] and
+               entry[2] in jobs]
+    waiting_ids = {entry[2] for entry in waiting}
+    sequence = itertools.count(max([entry[1] for entry in waiting],
+                                   default=-1) + 1)
+    new_heap = waiting
+    for (fire_time, _, job_id, _) in create_timer_heap(jobs, now):
+        if job_id in waiting_ids and getattr(
+                jobs[job_id].trigger, 'reschedule_on_completion', False):
+            continue
+        new_heap.append((fire_time, next(sequence), job_id, fire_time))
+    heapq.heapify(new_heap)
+    return new_heap
+
+
+def record_misfire(monitor_db_loc, job, fire_time, now, reason):
+    """
+    Record a job that was not run within its misfire grace time. An error
+        of the database is only logged, it must not stop the dispatcher.
+
+    :param monitor_db_loc: location of the process monitor database
+    :type monitor_db_loc: string
+
+    :param job: apscheduler job
+    :type job: Job
+
+    :param fire_time: the time the job was due
+    :type fire_time: datetime
+
+    :param now: current time with timezone information
+    :type now: datetime
+
+    :param reason: why the job misfired
+    :type reason: string
+
+    :return None
+    """
+    lag_secs = (now - fire_time).total_seconds()
+    logging.warning('Dispatcher misfire: %s due at %s (%.1f s late, %s)' % (
+        job.id, fire_time.isoformat(), lag_secs, reason))
+    local_now = now.astimezone(fire_time.tzinfo)
+    data_tuple = (int(now.timestamp()), int(local_now.isoweekday()),
+                  str(job.id), int(fire_time.timestamp()), float(lag_secs),
+                  str(reason))
+    try:
+        sf.insert_dispatch_misfire(monitor_db_loc, data_tuple)
+    except Exception:
+        logging.exception('Dispatcher could not record the misfire of %s' %
+                          job.id)
+    mf.increment('dispatch_misfires_total',
+                 {'job_type': job_type(job.id), 'reason': reason})
+    return None
+
+
+def create_pools(executor_config):
+    """
+    Create a worker pool and a semaphore that bounds the number of running
+        jobs for every thread executor in executor_config
+
+    :param executor_config: dictionary with the executor alias as the key
+        and a dictionary with the type and max_workers as the value
+    :type executor_config: dictionary
+
+    :return pools: dictionary with the executor alias as the key and a
+        tuple of the worker pool and semaphore as the value
+    :rtype: dictionary
+    """
+    pools = {}
+    for (alias, executor_def) in executor_config.items():
+        if executor_def['type'] != 'thread':
+            continue
+        pools[alias] = (concurrent.futures.ThreadPoolExecutor(
+                            max_workers=executor_def['max_workers']),
+                        threading.BoundedSemaphore(
+                            executor_def['max_workers']))
+    return pools
+
+
+def run_job(job):
+    """
+    Run the job. Exceptions are logged so that they do not stop the
+        dispatcher. A job that failed fast because the circuit of its
+        endpoint is open is only logged as a warning.
+
+    :param job: apscheduler job
+    :type job: Job
+
+    :return None
+    """
+    try:
+        job.func(*job.args, **job.kwargs)
+    except rtf.CircuitOpenError as error:
+        logging.warning('Dispatcher job %s skipped: %s' % (job.id, error))
+    except Exception:
+        logging.exception('Dispatcher job %s raised an exception' % job.id)
+    return None
+
+
+def dispatch_job(pools, instances, job, fire_time, now, monitor_db_loc,
+                 now_function=utc_now, on_done=None, pool_was_full=False):
+    """
+    Submit the job to the worker pool of its executor if it is still within
+        its misfire grace time, fewer than max_instances of it are running
+        and a worker is free. The dispatcher thread does not wait for a
+        worker, a job whose pool is full is dispatched again later and is
+        recorded as a misfire once its grace time has run out. The time from
+        the fire time to the end of the job is recorded in the
+        dispatch_end_to_end_seconds histogram.
+
+    :param pools: dictionary with the executor alias as the key and a
+        tuple of the worker pool and semaphore as the value
+    :type pools: dictionary
+
+    :param instances: dictionary with the number of running instances of
+        each job id
+    :type instances: collections.Counter
+
+    :param job: apscheduler job
+    :type job: Job
+
+    :param fire_time: the time the job was due
+    :type fire_time: datetime
+
+    :param now: current time with timezone information
+    :type now: datetime
+
+    :param monitor_db_loc: location of the process monitor database
+    :type monitor_db_loc: string
+
+    :param now_function: returns the current time of the dispatcher clock
+    :type now_function: function
+
+    :param on_done: called with the job id when the job is done
+    :type on_done: function
+
+    :param pool_was_full: True if the job is dispatched again because its
+        worker pool was full
+    :type pool_was_full: bool
+
+    :return True if the job was submitted, False if it misfired and None if
+        the pool is full and the job has to be dispatched again
+    :rtype: bool
+    """
+    (pool, slots) = pools.get(job.executor, pools['default'])
+    grace_secs = job.misfire_grace_time
+    is_late = (grace_secs is not None and
+               (now - fire_time).total_seconds() > grace_secs)
+    if is_late:
+        record_misfire(monitor_db_loc, job, fire_time, now,
+                       'pool full' if pool_was_full else 'late')
+        return False
+    if instances[job.id] >= job.max_instances:
+        record_misfire(monitor_db_loc, job, fire_time, now, 'max instances')
+        return False
+    if not slots.acquire(blocking=False):
+        return None
+    instances[job.id] += 1
+
+    def job_done(future):
+        instances[job.id] -= 1
+        slots.release()
+        mf.observe('dispatch_end_to_end_seconds',
+                   (now_function() - fire_time).total_seconds(),
+                   {'job_type': job_type(job.id)})
+        if on_done is not None:
+            on_done(job.id)
+    pool.submit(run_job, job).add_done_callback(job_done)
+    return True
+
+
+def run_dispatcher(sched_sql_loc, monitor_db_loc, executor_config,
+                   stop_event=None, now_function=utc_now, speed=1):
+    """
+    Run the jobs in the job database until stop_event is set. The number of
+        jobs that are due when a job is dispatched is recorded in the
+        dispatch_queue_depth histogram. A virtual clock that runs speed times
+        faster than real time can be used to simulate a day in minutes
+        (simulate_collect_data.py).
+
+    :param sched_sql_loc: location of the sql job database
+    :type sched_sql_loc: string
+
+    :param monitor_db_loc: location of the process monitor database that
+        stores the misfires
+    :type monitor_db_loc: string
+
+    :param executor_config: dictionary with the executor alias as the key
+        and a dictionary with the type and max_workers as the value
+    :type executor_config: dictionary
+
+    :param stop_event: event that stops the dispatcher when it is set
+    :type stop_event: threading.Event
+
+    :param now_function: returns the current time of the dispatcher clock
+    :type now_function: function
+
+    :param speed: number of clock seconds that pass in a real second
+    :type speed: float
+
+    :return None
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+    # the dispatcher sleeps on wakeup so that it is woken up when it is
+    # stopped or a job that is rescheduled on completion is done
+    wakeup = threading.Event()
+    # ids of the jobs that are rescheduled on completion and are done
+    finished = collections.deque()
+
+    def wake_on_stop():
+        stop_event.wait()
+        wakeup.set()
+
+    def job_finished(job_id):
+        finished.append(job_id)
+        wakeup.set()
+    threading.Thread(target=wake_on_stop, name='dispatcher-stop',
+                     daemon=True).start()
+    pools = create_pools(executor_config)
+    instances = collections.Counter()
+    sequence = itertools.count()
+    job_store_mtime = None
+    jobs = {}
+    timer_heap = []
+    try:
+        while not stop_event.is_set():
+            wakeup.clear()
+            now = now_function()
+            # reload the jobs if prepare_to_collect_data changed them
+            if os.path.getmtime(sched_sql_loc) != job_store_mtime:
+                job_store_mtime = os.path.getmtime(sched_sql_loc)
+                jobs = load_jobs(sched_sql_loc)
+                timer_heap = reload_timer_heap(jobs, timer_heap, now)
+                sequence = itertools.count(max(
+                    [entry[1] for entry in timer_heap], default=-1) + 1)
+                logging.info('Dispatcher loaded %d jobs' % len(jobs))
+            while len(finished) > 0:
+                job_id = finished.popleft()
+                if job_id in jobs and job_id not in {
+                        entry[2] for entry in timer_heap}:
+                    fire_time = next_fire_time(jobs[job_id], None, now)
+                    if fire_time is not None:
+                        heapq.heappush(timer_heap, (fire_time, next(sequence),
+                                                    job_id, fire_time))
+            if len(timer_heap) == 0:
+                wakeup.wait(job_store_poll_secs / speed)
+                continue
+            wait_secs = (timer_heap[0][0] - now).total_seconds()
+            if wait_secs > 0:
+                wakeup.wait(min(wait_secs, job_store_poll_secs) / speed)
+                continue
+            mf.observe('dispatch_queue_depth',
+                       sum(1 for entry in timer_heap if entry[0] <= now))
+            (due_time, _, job_id, fire_time) = heapq.heappop(timer_heap)
+            job = jobs[job_id]
+            on_completion = getattr(job.trigger, 'reschedule_on_completion',
+                                    False)
+            pool_was_full = due_time != fire_time
+            submitted = dispatch_job(pools, instances, job, fire_time, now,
+                                     monitor_db_loc, now_function,
+                                     job_finished if on_completion else None,
+                                     pool_was_full)
+            if submitted is None:
+                # the pool is full, the other jobs are dispatched while the
+                # job waits for a worker
+                heapq.heappush(timer_heap, (
+                    now + dt.timedelta(seconds=pool_full_retry_secs),
+                    next(sequence), job_id, fire_time))
+            if on_completion:
+                if submitted is not False:
+                    # the next run is scheduled when the run is done
+                    continue
+            elif pool_was_full:
+                # the next run was scheduled when the job was first
+                # dispatched
+                continue
+            # schedule the next run of the job. If the job coalesces, runs
+            # that were missed while waiting are merged into the next run
+            if job.coalesce:
+                fire_time = next_fire_time(job, None, max(now, fire_time) +
+                                           dt.timedelta(microseconds=1))
+            else:
+                fire_time = next_fire_time(job, fire_time, now)
+            if fire_time is not None:
+                heapq.heappush(timer_heap, (fire_time, next(sequence),
+                                            job_id, fire_time))
+    finally:
+        for (pool, slots) in pools.values():
+            pool.shutdown(wait=True)
+    return None
@@ -0,0 +1,263 @@
+"""
+Description: This program runs a local fake of the google directions, 511
+    (SIRI and GTFS-RT) and pushover apis so that the collector can be tested
+    offline. The responses are recorded payloads if they exist in the json
+    directories, otherwise they are generated. The latency, error rate and
+    payload size can be configured. Set config.api_endpoint to the address of
+    this service to use it.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import http.server
+import json
+import logging
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+from google.protobuf import json_format
+from google.transit import gtfs_realtime_pb2
+
+import config
+import file_functions as ff
+import synthetic_data_functions as sd
+
+# address that the fake service listens on
+fake_service_host = '127.0.0.1'
+fake_service_port = 8511
+# the latency of each response is log normal with this median and sigma
+latency_median_secs = 0.3
+latency_sigma = 0.5
+# fraction of the requests that return a server error
+error_rate = 0.02
+# multiplies the number of stop visits and trip updates in each payload
+payload_scale = 1
+# number of stop visits in a generated payload at a payload scale of 1
+base_stop_visits = 50
+# seed for the latency, errors and generated payloads
+fake_service_seed = 0
+
+
+class FakeServiceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests to the fake service. The settings are stored on the
+        server by create_fake_service.
+    """
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path.startswith('/maps/api/directions/json'):
+            self.respond(directions_response, 'application/json')
+        elif path.startswith('/Transit/StopMonitoring'):
+            self.respond(siri_response, 'application/json')
+        elif path.startswith('/Transit/TripUpdates'):
+            self.respond(gtfs_rt_response, 'application/octet-stream')
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        path = urllib.parse.urlparse(self.path).path
+        # read the body so the connection can be reused
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if path.startswith('/1/messages.json'):
+            self.respond(pushover_response, 'application/json')
+        else:
+            self.send_error(404)
+
+    def respond(self, response_function, content_type):
+        """
+        Wait for the simulated latency and send either a server error or the
+            response created by response_function
+        """
+        server = self.server
+        with server.rng_lock:
+            latency_secs = server.rng.lognormal(
+                np.log(server.settings['latency_median_secs']),
+                server.settings['latency_sigma'])
+            is_error = server.rng.uniform() < server.settings['error_rate']
+        time.sleep(latency_secs)
+        path = urllib.parse.urlparse(self.path).path
+        with server.rng_lock:
+            server.request_counts[path] = server.request_counts.get(
+                path, 0) + 1
+            if is_error:
+                server.error_counts[path] = server.error_counts.get(
+                    path, 0) + 1
+        if is_error:
+            self.send_error(500, 'Fake service error')
+            return
+        body = response_function(server)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('fake service: ' + format % args)
+
+
+def directions_response(server):
+    """
+    Create a google directions response with a random duration in traffic
+
+    :param server: the fake service
+    :type server: http.server.ThreadingHTTPServer
+
+    :return body: json encoded response
+    :rtype: bytes
+    """
+    with server.rng_lock:
+        duration_secs = int(server.rng.normal(45 * 60, 10 * 60))
+    leg = {'duration': {'value': duration_secs,
+                        'text': '%d mins' % (duration_secs // 60)},
+           'duration_in_traffic': {'value': duration_secs,
+                                   'text': '%d mins' % (duration_secs // 60)}}
+    return json.dumps({'status': 'OK',
+                       'routes': [{'legs': [leg]}]}).encode('utf-8')
+
+
+def siri_response(server):
+    """
+    Create a 511 stop monitoring response. Recorded payloads are returned in
+        turn if they exist.
+
+    :param server: the fake service
+    :type server: http.server.ThreadingHTTPServer
+
+    :return body: json encoded response with a byte order mark, like 511
+    :rtype: bytes
+    """
+    with server.rng_lock:
+        if len(server.siri_recorded) > 0:
+            monitored_stops = server.siri_recorded[
+                server.siri_recorded_ind % len(server.siri_recorded)]
+            server.siri_recorded_ind += 1
+            monitored_stops = monitored_stops * server.settings[
+                'payload_scale']
+        else:
+            monitored_stops = sd.synthetic_siri(
+                base_stop_visits * server.settings['payload_scale'],
+                server.rng, dt.datetime.now(config.to_zone))
+    data = {'ServiceDelivery': {'StopMonitoringDelivery': {
+        'MonitoredStopVisit': monitored_stops}}}
+    return json.dumps(data).encode('utf-8-sig')
+
+
+def gtfs_rt_response(server):
+    """
+    Create a 511 gtfs-rt trip update response
+
+    :param server: the fake service
+    :type server: http.server.ThreadingHTTPServer
+
+    :return body: protocol buffer encoded response
+    :rtype: bytes
+    """
+    with server.rng_lock:
+        trip_updates = sd.synthetic_gtfs_rt(
+            base_stop_visits * server.settings['payload_scale'], server.rng,
+            dt.datetime.now(config.to_zone))
+    feed = json_format.ParseDict(trip_updates,
+                                 gtfs_realtime_pb2.FeedMessage())
+    return feed.SerializeToString()
+
+
+def pushover_response(server):
+    """
+    Create a pushover message response
+
+    :param server: the fake service
+    :type server: http.server.ThreadingHTTPServer
+
+    :return body: json encoded response
+    :rtype: bytes
+    """
+    return json.dumps({'status': 1, 'request': 'fake'}).encode('utf-8')
+
+
+def create_fake_service(host=fake_service_host, port=fake_service_port,
+                        **settings):
+    """
+    Create the fake service. The settings override the module defaults
+        (latency_median_secs, latency_sigma, error_rate, payload_scale and
+        seed).
+
+    :param host: address to listen on
+    :type host: string
+
+    :param port: port to listen on, 0 picks a free port
+    :type port: int
+
+    :return server: the fake service
+    :rtype: http.server.ThreadingHTTPServer
+    """
+    server = http.server.ThreadingHTTPServer((host, port), FakeServiceHandler)
+    server.daemon_threads = True
+    server.settings = {'latency_median_secs': latency_median_secs,
+                       'latency_sigma': latency_sigma,
+                       'error_rate': error_rate,
+                       'payload_scale': payload_scale,
+                       'seed': fake_service_seed}
+    server.settings.update(settings)
+    server.rng = np.random.default_rng(server.settings['seed'])
+    server.rng_lock = threading.Lock()
+    server.request_counts = {}
+    server.error_counts = {}
+    server.siri_recorded = ff.read_json_files(config.siri_json_dir, 'siri-')
+    server.siri_recorded_ind = 0
+    return server
+
+
+def start_fake_service(host=fake_service_host, port=fake_service_port,
+                       **settings):
+    """
+    Start the fake service in a daemon thread
+
+    :param host: address to listen on
+    :type host: string
+
+    :param port: port to listen on, 0 picks a free port
+    :type port: int
+
+    :return server: the running fake service. Call server.shutdown() to stop.
+    :rtype: http.server.ThreadingHTTPServer
+    """
+    server = create_fake_service(host, port, **settings)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='fake_service', daemon=True)
+    thread.start()
+    return server
+
+
+def use_fake_service(server):
+    """
+    Point the google, 511 and pushover api urls in config at the fake service.
+        The urls are read when the apis are called, so the jobs that run
+        after this call use the fake service.
+
+    :param server: the running fake service
+    :type server: http.server.ThreadingHTTPServer
+
+    :return None
+    """
+    config.api_endpoint = 'http://%s:%d' % server.server_address[:2]
+    config.google_maps_base_url = config.api_endpoint
+    config.transit_511_base_url = config.api_endpoint
+    config.pushover_base_url = config.api_endpoint + '/1/'
+    # the google maps client rejects keys that do not look like google keys
+    config.google_transit_api_key = 'AIzaFakeServiceKey'
+    return None
+
+
+def main():
+    server = create_fake_service()
+    print('Fake service listening on http://%s:%d' % server.server_address)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -5,9 +5,13 @@ Description: This file contains the functions that do not fit into the
 @author: Robert Hennessy (robertghennessy@gmail.com)
 """
 
+import datetime as dt
 import fnmatch
+import json
+import logging.handlers
 import os
-import pandas as pd
+import threading
+import time
 
 
 def remove_files(file_list):
@@ -49,6 +53,31 @@ def find_files_that_filename_contain(directory, name_contains):
     return ret_list
 
 
+def read_json_files(directory, name_contains):
+    """
+    Read the json files in a directory where the filename contains
+        name_contains. The files are read in the order of their names.
+
+    :param directory: the directory to look into
+    :type directory: string
+
+    :param name_contains: read the files whose names contain name_contains
+    :type name_contains: string
+
+    :return ret_list: a list of the data in each json file. Empty if the
+        directory does not exist.
+    :type ret_list: list
+    """
+    ret_list = []
+    if not os.path.isdir(directory):
+        return ret_list
+    for file in sorted(find_files_that_filename_contain(directory,
+                                                        name_contains)):
+        with open(file) as infile:
+            ret_list.append(json.load(infile))
+    return ret_list
+
+
 def create_directories(directory_list):
     """
     Create directories in the directory list
@@ -66,34 +95,71 @@ def create_directories(directory_list):
     return None
 
 
-def convert_xls_to_dict_file(xls_file, out_file_name):
+def start_heartbeat(file_loc, interval_secs):
     """
-    This converts the sheets in an xls file into a dict that is written to a
-        *.py file. This file will be imported later.
+    Start a daemon thread that touches the heartbeat file every interval_secs
+        so that the other programs can tell that this program is running
 
-    :param xls_file: file path to the xls file. Each row will be an entry and
-        each column is a key for that entry.
-    :type xls_file: string
+    :param file_loc: location of the heartbeat file
+    :type file_loc: string
 
-    :param out_file_name: filename for the output file
-    :type string
+    :param interval_secs: seconds between the heartbeats
+    :type interval_secs: float
 
-    :return None
+    :return thread: the heartbeat thread
+    :rtype: threading.Thread
     """
-    xls_data = pd.read_excel(xls_file, sheet_name=None)
-    # create a list of the sheet names. This will be the variable names
-    sheet_names = [x for x in xls_data.keys()]
-    # write the dictionaries to files
-    with open(out_file_name, 'w') as outfile:
-        for sInd in range(len(sheet_names)):
-            sheet_name = sheet_names[sInd]
-            # dict like {index -> {column -> value}} and convert to string
-            dict_str = str(xls_data[sheet_name].to_dict('index'))
-            # add new lines to make it more readable
-            dict_str = dict_str.replace('}, ', '},\n')
-            outfile.write('%s = { \n' % sheet_name)
-            # remove the beginning { because added to line above
-            outfile.write(dict_str[1:])
-            # add a new line between the dictionaries
-            if sInd < len(sheet_names) - 1:
-                outfile.write('\n')
+    def heartbeat_loop():
+        while True:
+            try:
+                with open(file_loc, 'w') as outfile:
+                    outfile.write(str(os.getpid()))
+            except OSError:
+                logging.exception('Unable to write the heartbeat file')
+            time.sleep(interval_secs)
+    thread = threading.Thread(target=heartbeat_loop, name='heartbeat',
+                              daemon=True)
+    thread.start()
+    return thread
+
+
+def heartbeat_age(file_loc):
+    """
+    Seconds since the heartbeat file was last touched
+
+    :param file_loc: location of the heartbeat file
+    :type file_loc: string
+
+    :return age in seconds, None if there is no heartbeat file
+    :rtype: float
+    """
+    if not os.path.isfile(file_loc):
+        return None
+    return time.time() - os.path.getmtime(file_loc)
+
+
+def create_log_file(log_file_pattern):
+    """
+    Add a rotating log file to the root logger. The file is rotated every
+        10 mb and the last 5 log files are kept.
+    
+    :param log_file_pattern: location of the log file with a %s for the
+        date and time
+    :type log_file_pattern: string
+    
+    :return log_filename: location of the log file
+    :rtype: string
+    """
+    logger = logging.getLogger('')
+    logger.setLevel(logging.INFO)
+    date_tag = dt.datetime.now().strftime("%Y-%b-%d_%H-%M-%S")
+    log_filename = log_file_pattern % date_tag
+    formatter = logging.Formatter(
+            '%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
+    handler = logging.handlers.RotatingFileHandler(log_filename,
+                                                   maxBytes=10*1024*1024,
+                                                   backupCount=5)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    return log_filename
+
@@ -0,0 +1,183 @@
+"""
+Description: This file contains the functions for the gap index. For every
+    source (traffic, siri and gtfs-rt) and date the gap index stores a bitmap
+    of the slots (trip index or time index) that were expected and a bitmap
+    of the slots that were observed. The index is updated by the
+    completeness check in nightly_check. The missing slots can be read by a
+    retry scheduler and the counts are stored so that months of history can
+    be summarized without reading the bitmaps.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import numpy as np
+import pandas as pd
+
+import config
+import scheduler_functions as sched
+import sql_functions as sf
+
+# prefix of the job ids of each source
+source_job_prefix = {'traffic': sched.job_identifier['traffic']}
+for agency in config.transit_agencies:
+    for type_switch in ['siri', 'gtfs-rt']:
+        source_job_prefix[type_switch + config.agency_suffix(agency)] = (
+            config.agency_id_modifier(type_switch, agency))
+
+
+def slots_to_bitmap(slots):
+    """
+    Convert the slots to a bitmap. Bit n is set if slot n is in slots.
+
+    :param slots: slot numbers
+    :type slots: iterable of ints
+
+    :return bitmap
+    :rtype: bytes
+    """
+    slots = np.fromiter(slots, dtype=np.int64)
+    if len(slots) == 0:
+        return b''
+    bits = np.zeros(slots.max() + 1, dtype=np.uint8)
+    bits[slots] = 1
+    return np.packbits(bits).tobytes()
+
+
+def bitmap_to_slots(bitmap):
+    """
+    Convert a bitmap to the slots that are set
+
+    :param bitmap: bitmap created by slots_to_bitmap
+    :type bitmap: bytes
+
+    :return slots: sorted slot numbers
+    :rtype: numpy array
+    """
+    return np.flatnonzero(np.unpackbits(np.frombuffer(bitmap,
+                                                      dtype=np.uint8)))
+
+
+def update_gap_index(db_location, source, expected, observed):
+    """
+    Store the expected and observed slots of every date in expected
+
+    :param db_location: location of the gap index database
+    :type db_location: string
+
+    :param source: name of the source, for example siri
+    :type source: string
+
+    :param expected: data frame of the slots that were expected so far with
+        the columns date and slot
+    :type expected: pandas data frame
+
+    :param observed: set of the observed (date, slot) tuples
+    :type observed: set
+
+    :return None
+    """
+    rows = []
+    for (date, expected_slots) in expected.groupby('date')['slot']:
+        expected_slots = set(expected_slots.tolist())
+        observed_slots = {slot for (observed_date, slot) in observed if
+                          observed_date == date}
+        rows.append((source, date, slots_to_bitmap(expected_slots),
+                     slots_to_bitmap(observed_slots), len(expected_slots),
+                     len(observed_slots),
+                     len(expected_slots - observed_slots)))
+    if len(rows) > 0:
+        sf.insert_gap_index(db_location, rows)
+    return None
+
+
+def missing_slots(db_location, source, start_date, end_date):
+    """
+    Determine the slots that were expected but not observed
+
+    :param db_location: location of the gap index database
+    :type db_location: string
+
+    :param source: name of the source, for example siri
+    :type source: string
+
+    :param start_date: first date, iso format
+    :type start_date: string
+
+    :param end_date: last date, iso format
+    :type end_date: string
+
+    :return missing: dictionary with the date as the key and an array of the
+        missing slots as the value. Dates without missing slots are left out.
+    :rtype: dictionary
+    """
+    rows = sf.query_data(
+        db_location, "select date, expected_bitmap, observed_bitmap from "
+                     "gap_index where source = '%s' and date >= '%s' and "
+                     "date <= '%s' and missing_num > 0" %
+                     (source, start_date, end_date))
+    missing = {}
+    for (date, expected_bitmap, observed_bitmap) in rows:
+        expected_bits = np.frombuffer(expected_bitmap, dtype=np.uint8)
+        observed_bits = np.zeros_like(expected_bits)
+        observed_len = min(len(observed_bitmap), len(expected_bits))
+        observed_bits[:observed_len] = np.frombuffer(
+            observed_bitmap, dtype=np.uint8)[:observed_len]
+        missing[date] = bitmap_to_slots(
+            (expected_bits & ~observed_bits).tobytes())
+    return missing
+
+
+def missing_job_ids(db_location, source, date):
+    """
+    Determine the ids of the jobs that did not collect their data on a date.
+        The jobs can be looked up in the job database and run again. Each
+        slot of the periodic jobs has its own job, so there is one id per
+        missing slot. If config.adaptive_transit_polling is True, a transit
+        feed is polled by a single adaptive job that collects all of its
+        slots, so its id is returned once if any slot is missing. Use
+        missing_slots to find the slots it missed.
+
+    :param db_location: location of the gap index database
+    :type db_location: string
+
+    :param source: name of the source, for example siri
+    :type source: string
+
+    :param date: date, iso format
+    :type date: string
+
+    :return job_ids: ids of the jobs
+    :rtype: list of strings
+    """
+    slots = missing_slots(db_location, source, date, date).get(date, [])
+    if config.adaptive_transit_polling and source != 'traffic':
+        if len(slots) == 0:
+            return []
+        return [sched.adaptive_job_id(source_job_prefix[source])]
+    return [source_job_prefix[source] + str(slot) for slot in slots]
+
+
+def gap_summary(db_location, start_date, end_date):
+    """
+    Summarize the expected, observed and missing counts of every source and
+        date. The bitmaps are not read.
+
+    :param db_location: location of the gap index database
+    :type db_location: string
+
+    :param start_date: first date, iso format
+    :type start_date: string
+
+    :param end_date: last date, iso format
+    :type end_date: string
+
+    :return df: data frame with the columns source, date, expected_num,
+        observed_num and missing_num
+    :rtype: pandas data frame
+    """
+    rows = sf.query_data(
+        db_location, "select source, date, expected_num, observed_num, "
+                     "missing_num from gap_index where date >= '%s' and "
+                     "date <= '%s' order by source, date" %
+                     (start_date, end_date))
+    return pd.DataFrame(rows, columns=['source', 'date', 'expected_num',
+                                       'observed_num', 'missing_num'])
@@ -0,0 +1,85 @@
+"""
+Description: This file contains the function that loads the heavy
+    dependencies (pandas, numpy, googlemaps, protobuf, ...) lazily. A proxy
+    of the module is returned when it is imported and the module is only
+    imported the first time one of its attributes is used, so the collector
+    starts quickly and only pays for the dependencies that its jobs use. The
+    first use can happen in several job threads at the same time, so the
+    module is imported under a lock of the proxy (importlib.util.LazyLoader
+    is not thread safe before python 3.12).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+# lazy modules are created by several job threads
+import_lock = threading.Lock()
+# {module name: proxy} of the modules that are not imported yet
+lazy_modules = {}
+
+
+class LazyModule(types.ModuleType):
+    """
+    Proxy of a module that imports the module when an attribute is first
+        used
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lock = threading.Lock()
+        self._module = None
+
+    def __getattr__(self, attribute):
+        # only called for the attributes that the proxy does not have
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        # the attributes of the proxy start with an underscore, the others
+        # are set on the module, for example pushover.BASE_URL
+        if attribute.startswith('_'):
+            super().__setattr__(attribute, value)
+        else:
+            setattr(self._load(), attribute, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def _load(self):
+        """
+        Import the module once
+
+        :return module: the imported module
+        :rtype: module
+        """
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self.__name__)
+        return self._module
+
+
+def lazy_import(name):
+    """
+    Import a module lazily. If the module has already been imported it is
+        returned as is.
+
+    :param name: full name of the module, for example numpy or
+        google.protobuf.json_format
+    :type name: string
+
+    :return module: the module or its proxy, it is imported when an
+        attribute is used
+    :rtype: module
+    """
+    with import_lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        if name not in lazy_modules:
+            if importlib.util.find_spec(name) is None:
+                raise ModuleNotFoundError('No module named %r' % name,
+                                          name=name)
+            lazy_modules[name] = LazyModule(name)
+        return lazy_modules[name]
@@ -0,0 +1,311 @@
+"""
+Description: This file contains the functions that record timing metrics
+    for the collection jobs. Every stage of a job is timed and stored in a
+    histogram and a ring buffer of the recent samples. Counters are kept for
+    events such as retries. The metrics are written in the Prometheus text
+    format to a file so that they can be read by the node exporter textfile
+    collector or by hand.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import bisect
+import collections
+import contextlib
+import itertools
+import logging
+import os
+import threading
+import time
+
+from import_functions import lazy_import
+
+# numpy is only needed to compute the quantiles
+np = lazy_import('numpy')
+
+# upper bounds (seconds) of the histogram buckets
+histogram_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+                     float('inf'))
+# number of recent samples kept for each metric to compute the quantiles
+ring_buffer_size = 1000
+# quantiles reported from the ring buffer
+reported_quantiles = (0.5, 0.95, 0.99)
+
+# the metrics are shared by all of the scheduler threads
+metrics_lock = threading.Lock()
+# {(name, labels): [count for each bucket]}
+histogram_counts = {}
+# {(name, labels): [sum, count]}
+histogram_totals = {}
+# {(name, labels): deque of the recent samples}
+recent_samples = {}
+# {(name, labels): value}
+counters = {}
+
+
+def labels_key(labels):
+    """
+    Convert a dictionary of labels to a hashable key
+
+    :param labels: dictionary of label names and values
+    :type labels: dictionary
+
+    :return key: sorted tuple of the labels
+    :rtype: tuple
+    """
+    if labels is None:
+        return ()
+    return tuple(sorted((str(key), str(value))
+                        for (key, value) in labels.items()))
+
+
+def observe(name, value, labels=None):
+    """
+    Record a sample in the histogram and ring buffer of a metric
+
+    :param name: name of the metric
+    :type name: string
+
+    :param value: value of the sample
+    :type value: float
+
+    :param labels: dictionary of label names and values
+    :type labels: dictionary
+
+    :return None
+    """
+    key = (name, labels_key(labels))
+    bucket_ind = bisect.bisect_left(histogram_buckets, value)
+    with metrics_lock:
+        if key not in histogram_counts:
+            histogram_counts[key] = [0] * len(histogram_buckets)
+            histogram_totals[key] = [0.0, 0]
+            recent_samples[key] = collections.deque(maxlen=ring_buffer_size)
+        histogram_counts[key][bucket_ind] += 1
+        histogram_totals[key][0] += value
+        histogram_totals[key][1] += 1
+        recent_samples[key].append(value)
+    return None
+
+
+def increment(name, labels=None, amount=1):
+    """
+    Increment a counter
+
+    :param name: name of the counter
+    :type name: string
+
+    :param labels: dictionary of label names and values
+    :type labels: dictionary
+
+    :param amount: amount to add to the counter
+    :type amount: float
+
+    :return None
+    """
+    key = (name, labels_key(labels))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + amount
+    return None
+
+
+@contextlib.contextmanager
+def time_stage(job, stage):
+    """
+    Context manager that records the duration of a stage of a job in the
+        collection_stage_seconds histogram. Exceptions are counted in
+        collection_stage_errors_total and raised again.
+
+    :param job: name of the job, for example siri
+    :type job: string
+
+    :param stage: name of the stage, for example fetch
+    :type stage: string
+    """
+    labels = {'job': job, 'stage': stage}
+    start_time = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        increment('collection_stage_errors_total', labels)
+        raise
+    finally:
+        observe('collection_stage_seconds', time.perf_counter() - start_time,
+                labels)
+
+
+def recent_quantiles(name, labels=None):
+    """
+    Compute the quantiles of the recent samples of a metric
+
+    :param name: name of the metric
+    :type name: string
+
+    :param labels: dictionary of label names and values
+    :type labels: dictionary
+
+    :return quantiles: dictionary with the quantile as the key. Empty if
+        there are no samples.
+    :rtype: dictionary
+    """
+    key = (name, labels_key(labels))
+    with metrics_lock:
+        samples = list(recent_samples.get(key, []))
+    if len(samples) == 0:
+        return {}
+    values = np.quantile(samples, reported_quantiles)
+    return dict(zip(reported_quantiles, values))
+
+
+def summarize_histogram(name):
+    """
+    Summarize every label set of a histogram
+
+    :param name: name of the histogram
+    :type name: string
+
+    :return summaries: list of dictionaries with the labels, count, mean,
+        max and the quantiles of the recent samples
+    :rtype: list
+    """
+    with metrics_lock:
+        items = [(labels, list(totals), list(recent_samples[(name, labels)]))
+                 for ((metric_name, labels), totals) in
+                 sorted(histogram_totals.items()) if metric_name == name]
+    summaries = []
+    for (labels, (total, count), samples) in items:
+        summary = {'labels': dict(labels), 'count': count,
+                   'mean': total / count if count > 0 else None,
+                   'max': max(samples) if len(samples) > 0 else None}
+        if len(samples) > 0:
+            for (quantile, value) in zip(
+                    reported_quantiles,
+                    np.quantile(samples, reported_quantiles)):
+                summary['p%g' % (quantile * 100)] = float(value)
+        summaries.append(summary)
+    return summaries
+
+
+def counter_values(name):
+    """
+    Return the values of every label set of a counter
+
+    :param name: name of the counter
+    :type name: string
+
+    :return values: list of dictionaries with the labels and value
+    :rtype: list
+    """
+    with metrics_lock:
+        return [{'labels': dict(labels), 'value': value}
+                for ((counter_name, labels), value) in sorted(
+                    counters.items()) if counter_name == name]
+
+
+def format_labels(labels, extra=None):
+    """
+    Format the labels in the Prometheus text format
+
+    :param labels: tuple of label names and values
+    :type labels: tuple
+
+    :param extra: extra label name and value
+    :type extra: tuple
+
+    :return label_str: for example {job="siri",stage="fetch"}
+    :rtype: string
+    """
+    labels = list(labels)
+    if extra is not None:
+        labels.append(extra)
+    if len(labels) == 0:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, value)
+                             for (key, value) in labels)
+
+
+def prometheus_text():
+    """
+    Render all of the metrics in the Prometheus text format
+
+    :return text: the metrics
+    :rtype: string
+    """
+    with metrics_lock:
+        histogram_items = sorted((key, list(value)) for (key, value) in
+                                 histogram_counts.items())
+        totals = {key: list(value) for (key, value) in
+                  histogram_totals.items()}
+        counter_items = sorted(counters.items())
+    lines = []
+    typed = set()
+    for ((name, labels), bucket_counts) in histogram_items:
+        if name not in typed:
+            lines.append('# TYPE %s histogram' % name)
+            typed.add(name)
+        cumulative_counts = itertools.accumulate(bucket_counts)
+        for (upper, count) in zip(histogram_buckets, cumulative_counts):
+            upper_str = '+Inf' if upper == float('inf') else '%g' % upper
+            lines.append('%s_bucket%s %d' % (
+                name, format_labels(labels, ('le', upper_str)), count))
+        lines.append('%s_sum%s %f' % (name, format_labels(labels),
+                                      totals[(name, labels)][0]))
+        lines.append('%s_count%s %d' % (name, format_labels(labels),
+                                        totals[(name, labels)][1]))
+    for ((name, labels), bucket_counts) in histogram_items:
+        quantiles = recent_quantiles(name, dict(labels))
+        if name + '_recent' not in typed:
+            lines.append('# TYPE %s_recent gauge' % name)
+            typed.add(name + '_recent')
+        for (quantile, value) in quantiles.items():
+            lines.append('%s_recent%s %f' % (
+                name, format_labels(labels, ('quantile', '%g' % quantile)),
+                value))
+    for ((name, labels), value) in counter_items:
+        if name not in typed:
+            lines.append('# TYPE %s counter' % name)
+            typed.add(name)
+        lines.append('%s%s %g' % (name, format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_file(file_loc):
+    """
+    Write the metrics to a file in the Prometheus text format. The file is
+        replaced atomically so a reader never sees a partial file.
+
+    :param file_loc: location of the metrics file
+    :type file_loc: string
+
+    :return None
+    """
+    temp_file_loc = file_loc + '.tmp'
+    with open(temp_file_loc, 'w') as outfile:
+        outfile.write(prometheus_text())
+    os.replace(temp_file_loc, file_loc)
+    return None
+
+
+def start_file_exporter(file_loc, interval_secs):
+    """
+    Start a daemon thread that writes the metrics file every interval_secs
+
+    :param file_loc: location of the metrics file
+    :type file_loc: string
+
+    :param interval_secs: seconds between writes of the metrics file
+    :type interval_secs: float
+
+    :return thread: the exporter thread
+    :rtype: threading.Thread
+    """
+    def export_loop():
+        while True:
+            time.sleep(interval_secs)
+            try:
+                write_prometheus_file(file_loc)
+            except Exception:
+                logging.exception('Unable to write the metrics file')
+    thread = threading.Thread(target=export_loop, name='metrics_exporter',
+                              daemon=True)
+    thread.start()
+    return thread
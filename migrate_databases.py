@@ -0,0 +1,407 @@
+"""
+Description: This program migrates the databases to the current tables.
+    The collection tables used to store the date text, time text and
+    utc_time real columns of every event and the transit tables the date,
+    time and utc columns of every prediction. Now a single integer epoch
+    (seconds since the epoch) and the integer seconds from midnight are
+    stored and the local date and time are derived by the <table>_local
+    views. The trip ids and station names used to be stored on every row,
+    now the data tables store the integer keys of the dimension tables
+    (dimension_functions). The trips and stations that are not in the
+    dimension tables are added. The traffic rows gained the from_cache
+    and from_model columns. Every database file, partition and archive
+    is copied into a new file with the current tables, which replaces the
+    old file when it is complete, so the files are also compacted. The files
+    that are already migrated are skipped. The rows that the collector
+    writes to a file while it is copied would be lost, so the migration is a
+    separate program that refuses to run while the heartbeat of the
+    collector is recent. prepare_to_collect_data only warns about the files
+    that have to be migrated.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import functools
+import logging
+import os
+import tempfile
+
+import config
+import file_functions as ff
+import sql_functions as sf
+
+# the tables that are migrated and the function that creates the current
+# table in a database
+table_creators = {
+    'traffic_data': sf.create_traffic_data_table,
+    'process_monitor': sf.create_process_monitor_table,
+    'dispatch_misfire': sf.create_dispatch_misfire_table,
+    'periodic_task_monitor': sf.create_periodic_task_monitor_table,
+    'push_monitor': sf.create_push_monitor_table,
+    config.siri_table_name: functools.partial(
+        sf.create_transit_data_siri_table, config.siri_table_name),
+    config.gfts_rt_table_name: functools.partial(
+        sf.create_transit_data_gtfs_rt_table, config.gfts_rt_table_name),
+    config.transit_summary_table_name: sf.create_transit_summary_table}
+# the databases that are migrated with their partitions and archives and
+# the agency of their trips and stations
+migration_databases = [(config.traffic_data_sql, config.default_agency),
+                       (config.process_monitor_sql, None),
+                       (config.push_notification_sql, None)]
+for agency in config.transit_agencies:
+    migration_databases.extend([(config.siri_data_sql_shards[agency], agency),
+                                (config.gtfs_rt_data_sql_shards[agency],
+                                 agency)])
+# sql expression of the key of the trip of a legacy row
+legacy_trip_key_sql = """(SELECT trip_key FROM dim.trips
+                          WHERE agency = '%s'
+                              AND trip_id = CAST(l.trip_id AS TEXT))"""
+# sql expression of the key of the station pair of a legacy traffic row
+legacy_pair_key_sql = """(SELECT p.pair_key FROM dim.station_pairs AS p
+                          JOIN dim.stations AS s
+                              ON s.station_key = p.start_station_key
+                          JOIN dim.stations AS e
+                              ON e.station_key = p.end_station_key
+                          WHERE s.agency = '%s'
+                              AND s.short_stop_name = l.start_station
+                              AND e.short_stop_name = l.end_station)"""
+
+
+def database_files(db_location, archive_dir):
+    """
+    Find the files of a database: the database itself, its partitions and
+        the partitions and rows that the retention moved to the archive
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param archive_dir: archive directory (config.transit_archive_dir)
+    :type archive_dir: string
+
+    :return locations of the files that exist
+    :rtype: list of strings
+    """
+    locations = [db_location] + sf.partition_locations(db_location)
+    if archive_dir is not None:
+        locations.extend(sf.partition_locations(os.path.join(
+            archive_dir, os.path.basename(db_location))))
+    return [location for location in locations if os.path.isfile(location)]
+
+
+def table_columns(conn, schema, table_name):
+    """
+    Read the columns of a table
+
+    :param conn: connection to the database
+    :type conn: sqlite3.Connection
+
+    :param schema: name of the attached database
+    :type schema: string
+
+    :param table_name: name of the table
+    :type table_name: string
+
+    :return list of (column name, lower case sql type) tuples
+    :rtype: list
+    """
+    return [(row[1], row[2].lower()) for row in conn.execute(
+        'pragma %s.table_info(%s)' % (schema, table_name))]
+
+
+def legacy_column_sql(column, column_type, legacy_columns, agency):
+    """
+    Construct the sql expression that converts a legacy column of the
+        legacy table l to the current column. The utc_time of the collection
+        tables is calculated from the stored local date and time because the
+        legacy utc_time was offset by the utc offset
+        (datetime.utcnow().timestamp()). The trip id and the station names
+        are looked up in the dimension tables that are attached as dim.
+
+    :param column: name of the current column
+    :type column: string
+
+    :param column_type: sql type of the current column
+    :type column_type: string
+
+    :param legacy_columns: names of the columns of the legacy table
+    :type legacy_columns: list of strings
+
+    :param agency: 511 operator id of the trips and stations
+    :type agency: string
+
+    :return sql expression
+    :rtype: string
+    """
+    if column == 'utc_time' and {'date', 'time'} <= set(legacy_columns):
+        return ("CAST(strftime('%s', l.date || ' ' || l.time, 'utc') "
+                "AS INTEGER)")
+    if column == 'trip_key' and 'trip_id' in legacy_columns:
+        return legacy_trip_key_sql % agency
+    if column == 'pair_key' and {'start_station',
+                                 'end_station'} <= set(legacy_columns):
+        return legacy_pair_key_sql % agency
+    if (column in ['from_cache', 'from_model'] and
+            column not in legacy_columns):
+        # the traffic rows before the traffic cache and model were queried
+        return '0'
+    if column not in legacy_columns:
+        return 'NULL'
+    if column_type == 'integer':
+        return 'CAST(l.%s AS INTEGER)' % column
+    return 'l.' + column
+
+
+def add_legacy_dimensions(conn, table_name, legacy_columns, agency):
+    """
+    Add the trips and station pairs of the rows of a legacy table that are
+        not in the attached dimension tables yet, for example the special
+        trains
+
+    :param conn: connection to the new database with the legacy database
+        and the dimension database attached
+    :type conn: sqlite3.Connection
+
+    :param table_name: name of the legacy table
+    :type table_name: string
+
+    :param legacy_columns: names of the columns of the legacy table
+    :type legacy_columns: list of strings
+
+    :param agency: 511 operator id of the trips and stations
+    :type agency: string
+
+    :return None
+    """
+    if 'trip_id' in legacy_columns:
+        conn.execute("""INSERT OR IGNORE INTO dim.trips (agency, trip_id)
+                        SELECT DISTINCT '%s', CAST(trip_id AS TEXT)
+                        FROM legacy.%s WHERE trip_id IS NOT NULL""" %
+                     (agency, table_name))
+    if {'start_station', 'end_station'} <= set(legacy_columns):
+        conn.execute("""INSERT OR IGNORE INTO dim.stations
+                            (agency, short_stop_name)
+                        SELECT '%s', start_station FROM legacy.%s
+                        UNION SELECT '%s', end_station FROM legacy.%s""" %
+                     (agency, table_name, agency, table_name))
+        conn.execute("""INSERT OR IGNORE INTO dim.station_pairs
+                            (start_station_key, end_station_key)
+                        SELECT DISTINCT s.station_key, e.station_key
+                        FROM legacy.%s AS l
+                        JOIN dim.stations AS s ON s.agency = '%s'
+                            AND s.short_stop_name = l.start_station
+                        JOIN dim.stations AS e ON e.agency = '%s'
+                            AND e.short_stop_name = l.end_station""" %
+                     (table_name, agency, agency))
+    return None
+
+
+def copy_legacy_tables(conn, legacy_schema, agency):
+    """
+    Copy the rows of the legacy tables of the attached legacy database into
+        the current tables. The tables that are not migrated are copied as
+        they are. The indexes are created after the rows are copied.
+
+    :param conn: connection to the new database with the legacy database
+        and the dimension database attached
+    :type conn: sqlite3.Connection
+
+    :param legacy_schema: (type, name, sql) of the legacy tables and indexes
+    :type legacy_schema: list of tuples
+
+    :param agency: 511 operator id of the trips and stations
+    :type agency: string
+
+    :return None
+    """
+    for (sql_type, table_name, sql_cmd) in legacy_schema:
+        if sql_type != 'table':
+            continue
+        if table_name not in table_creators:
+            conn.execute(sql_cmd)
+            conn.execute('INSERT INTO main.%s SELECT * FROM legacy.%s' %
+                         (table_name, table_name))
+            continue
+        legacy_columns = [column for (column, _) in table_columns(
+            conn, 'legacy', table_name)]
+        columns = table_columns(conn, 'main', table_name)
+        add_legacy_dimensions(conn, table_name, legacy_columns, agency)
+        conn.execute('INSERT INTO main.%s (%s) SELECT %s FROM legacy.%s AS l'
+                     % (table_name, ', '.join(column for (column, _) in
+                                              columns),
+                        ', '.join(legacy_column_sql(column, column_type,
+                                                    legacy_columns, agency)
+                                  for (column, column_type) in columns),
+                        table_name))
+    for (sql_type, _, sql_cmd) in legacy_schema:
+        if sql_type == 'index':
+            conn.execute(sql_cmd)
+    return None
+
+
+def pending_migrations(db_agencies, archive_dir):
+    """
+    Find the database files whose tables are not the current tables. The
+        files are only read.
+
+    :param db_agencies: (location of the database file, agency of its trips
+        and stations) tuples
+    :type db_agencies: list of tuples
+
+    :param archive_dir: archive directory (config.transit_archive_dir)
+    :type archive_dir: string
+
+    :return locations of the files that have to be migrated
+    :rtype: list of strings
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        current_location = os.path.join(temp_dir, 'current.sqlite')
+        for creator in table_creators.values():
+            creator(current_location)
+        conn = sf.create_connection(current_location)
+        try:
+            current_columns = {table_name: table_columns(conn, 'main',
+                                                         table_name)
+                               for table_name in table_creators}
+        finally:
+            conn.close()
+    pending = []
+    for (db_location, _) in db_agencies:
+        for location in database_files(db_location, archive_dir):
+            conn = sf.create_connection(location)
+            try:
+                is_current = all(
+                    table_columns(conn, 'main', table_name) in (
+                        [], current_columns[table_name])
+                    for table_name in table_creators)
+            finally:
+                conn.close()
+            if not is_current:
+                pending.append(location)
+    return pending
+
+
+def collector_is_running(heartbeat_file, heartbeat_secs):
+    """
+    Check if the collector touched its heartbeat file within the last three
+        heartbeat intervals
+
+    :param heartbeat_file: location of the heartbeat file
+    :type heartbeat_file: string
+
+    :param heartbeat_secs: seconds between the heartbeats of the collector
+    :type heartbeat_secs: float
+
+    :return True if the collector is running
+    :rtype: bool
+    """
+    age = ff.heartbeat_age(heartbeat_file)
+    return age is not None and age < 3 * heartbeat_secs
+
+
+def migrate_file(location, agency, dimension_db_loc):
+    """
+    Migrate a database file. The current tables are created in a new file,
+        the rows are converted into them and the new file replaces the old
+        one. Frozen partitions are frozen again.
+
+    :param location: location of the database file
+    :type location: string
+
+    :param agency: 511 operator id of the trips and stations
+    :type agency: string
+
+    :param dimension_db_loc: location of the dimension database
+    :type dimension_db_loc: string
+
+    :return True if the file was migrated
+    :rtype: bool
+    """
+    temp_location = location + '.tmp'
+    if os.path.isfile(temp_location):
+        os.remove(temp_location)
+    legacy_schema = sf.query_data(location, "select type, name, sql from "
+                                            "sqlite_master where sql is not "
+                                            "null and name not like "
+                                            "'sqlite_%'")
+    legacy_tables = [name for (sql_type, name, _) in legacy_schema
+                     if sql_type == 'table']
+    for table_name in legacy_tables:
+        if table_name in table_creators:
+            table_creators[table_name](temp_location)
+    conn = sf.create_connection(temp_location)
+    try:
+        conn.execute("ATTACH DATABASE '%s' AS legacy" % location)
+        is_current = all(table_columns(conn, 'main', table_name) ==
+                         table_columns(conn, 'legacy', table_name)
+                         for table_name in legacy_tables
+                         if table_name in table_creators)
+        if not is_current:
+            sf.create_dimension_tables(dimension_db_loc)
+            conn.execute("ATTACH DATABASE '%s' AS dim" % dimension_db_loc)
+            sf.begin_transaction(conn, temp_location, 'IMMEDIATE')
+            copy_legacy_tables(conn, legacy_schema, agency)
+            conn.commit()
+            conn.execute('DETACH DATABASE dim')
+        conn.execute('DETACH DATABASE legacy')
+    finally:
+        conn.close()
+    if is_current:
+        os.remove(temp_location)
+        return False
+    if sf.is_frozen(location):
+        sf.freeze_partition(temp_location)
+    os.replace(temp_location, location)
+    logging.info('Migrated %s' % location)
+    return True
+
+
+def migrate_databases(db_agencies, dimension_db_loc, gap_db_loc,
+                      archive_dir):
+    """
+    Migrate the files of the databases. If a file was migrated the state of
+        the completeness check is reset, so the next check scans the last
+        config.completeness_lookback_days days with the new encoding.
+
+    :param db_agencies: (location of the database file, agency of its trips
+        and stations) tuples
+    :type db_agencies: list of tuples
+
+    :param dimension_db_loc: location of the dimension database
+    :type dimension_db_loc: string
+
+    :param gap_db_loc: location of the database of the completeness check
+    :type gap_db_loc: string
+
+    :param archive_dir: archive directory (config.transit_archive_dir)
+    :type archive_dir: string
+
+    :return migrated: locations of the files that were migrated
+    :rtype: list of strings
+    """
+    migrated = [location for (db_location, agency) in db_agencies
+                for location in database_files(db_location, archive_dir)
+                if migrate_file(location, agency, dimension_db_loc)]
+    if len(migrated) > 0 and os.path.isfile(gap_db_loc):
+        sf.create_completeness_tables(gap_db_loc)
+        conn = sf.create_connection(gap_db_loc)
+        try:
+            conn.execute('DELETE FROM completeness_state')
+            conn.commit()
+        finally:
+            conn.close()
+    return migrated
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if collector_is_running(config.collector_heartbeat_file,
+                            config.collector_heartbeat_secs):
+        raise Exception('The collector is running, stop it before migrating '
+                        'the databases')
+    migrated = migrate_databases(migration_databases, config.dimension_sql,
+                                 config.gap_index_sql,
+                                 config.transit_archive_dir)
+    print('Migrated %d database files' % len(migrated))
+
+
+if __name__ == '__main__':
+    main()
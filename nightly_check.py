@@ -1,150 +1,304 @@
 """
-Description: This program is to do some of the error handling: 
-1. Sends a push notification if the program restarts
-2. Every night compares the expected number of results to the actual number of
-results. Sends a push notification with the results from this check.
+Description: This program checks that the data is complete. It is run from
+    cron every config.completeness_check_mins minutes. The expected
+    collections (the traffic trips and the periodic transit jobs) are
+    compared to the observed rows in buckets of completeness_check_mins
+    minutes. Each run scans only the rows that were added since the previous
+    run with one grouped query per database and sends a single push
+    notification if any of the newly completed buckets are missing data.
+    The expected and observed slots of each day are stored in the gap index
+    (gap_index_functions).
 
 @author: Robert Hennessy (robertghennessy@gmail.com)
 """
 import datetime as dt
+
 import pandas as pd
 
+import adaptive_polling_functions as ap
+import artifact_functions as af
 import config
+import gap_index_functions as gif
+import retention_functions as rf
 import sql_functions as sf
 import push_notification as pn
 
+# sources that are checked: (name, database, table, slot column). The slot
+# column identifies the scheduled collection of each row. The transit
+# sources of each agency are checked in the database of the agency.
+completeness_sources = [
+    ('traffic', config.traffic_data_sql, 'traffic_data', 'trip_index')]
+for agency in config.transit_agencies:
+    completeness_sources.extend([
+        ('siri' + config.agency_suffix(agency),
+         config.siri_data_sql_shards[agency], 'periodic_task_monitor',
+         'time_index'),
+        ('gtfs-rt' + config.agency_suffix(agency),
+         config.gtfs_rt_data_sql_shards[agency], 'periodic_task_monitor',
+         'time_index')])
+# rows committed up to this many seconds before the previous scan are
+# scanned again, the observed slots are only stored once
+rescan_secs = 5 * 60
+
 
-def nightly_check(sql_db_loc, table_name, expected_num):
+def stored_utc_time(local_dt):
     """
-    Compare the amount of data stored in the the previous day to desired 
-    amount. Send push notification with the result
-    
-    :param sql_db_loc: location of the database file
-    :type sql_db_loc: string
-        
-    :param expected_num: number of expected rows
-    :type expected_num: int
+    Convert a naive local time to the utc_time that the collection jobs store
+        (seconds since the epoch)
+
+    :param local_dt: local time without timezone information
+    :type local_dt: datetime
+
+    :return utc_time
+    :rtype: float
+    """
+    return local_dt.timestamp()
+
+
+def slots_frame(rows):
+    """
+    Create the data frame of the expected slots
+
+    :param rows: list of (date, slot, local time) tuples
+    :type rows: list
 
-    :return None
+    :return df: data frame with the columns date, slot, local_time and
+        utc_time
+    :rtype: pandas data frame
     """
-    utc_time_prev = (dt.datetime.utcnow() + dt.timedelta(days=-1)) 
-    utc_time_prev = utc_time_prev.timestamp()
-    # determine if a push notification occurred during the desired time period
-    # defined by delay_between_push
-    rows_query = ('select count(*) from %s where utc_time > %f ' %
-                  (table_name, utc_time_prev))
-    num_rows = sf.query_data(sql_db_loc, rows_query)[0][0]
-    
-    if num_rows != expected_num:
-        title_str = 'Error: Daily Count: %s' % table_name
-        body_str = 'Desired Count = %d, Actual Count = %d' % (
-            expected_num, num_rows)
-    else:
-        title_str = 'Pass: Daily Count: %s' % table_name
-        body_str = 'Desired Count = %d, Actual Count = %d' % (
-            expected_num, num_rows)
-    pn.send_push_notification(title_str, body_str) 
-
-
-def des_num_traffic_meas(csv_path, day_of_week):
+    return pd.DataFrame([row + (stored_utc_time(row[2]),) for row in rows],
+                        columns=['date', 'slot', 'local_time', 'utc_time'])
+
+
+def expected_traffic_slots(trips_path, dates):
     """
-    Determine the number of measurements that should occur during a given day
-    of the week
-    
-    :param csv_path: location of the csv file
-    :type csv_path: string
-        
-    :param day_of_week: day of the week
-    :type day_of_week: int
-
-    :return None
+    Determine when each traffic trip should be collected on the dates. The
+        trip index is the slot.
+
+    :param trips_path: location of the trips artifact
+    :type trips_path: string
+
+    :param dates: dates to check
+    :type dates: list of dates
+
+    :return df: data frame with the columns date, slot, local_time and
+        utc_time
+    :rtype: pandas data frame
     """
-    df = pd.read_csv(csv_path, index_col=0)
-    trips_today = df[df[config.weekday_names[day_of_week]] == 1]
-    return trips_today.shape[0]
+    df = af.load_artifact(trips_path, columns=config.weekday_names +
+                          ['departure_time_timedelta_start'])
+    # the jobs run at the clock time of the departure, without the seconds
+    departure_secs = (df['departure_time_timedelta_start'].dt.total_seconds()
+                      .astype(int) // 60 * 60) % (24 * 60 * 60)
+    rows = []
+    for date in dates:
+        runs_today = df[config.weekday_names[date.weekday()]] == 1
+        midnight = dt.datetime.combine(date, dt.time())
+        rows.extend((date.isoformat(), int(slot),
+                     midnight + dt.timedelta(seconds=int(secs)))
+                    for (slot, secs) in departure_secs[runs_today].items())
+    return slots_frame(rows)
 
 
-def des_periodic_meas(csv_path, day_of_week):
+def expected_periodic_slots(periodic_jobs_path, dates):
     """
-    Determine the number of measurements that should occur during a given day
-    of the week
-    
-    :param csv_path: location of the csv file
-    :type csv_path: string
-        
-    :param day_of_week: day of the week
-    :type day_of_week: int
-
-    :return None
+    Determine when each periodic job should run on the dates. The time index
+        is the slot. The adaptive pollers only have to poll every
+        ap.slow_poll_stride slot.
+
+    :param periodic_jobs_path: location of the periodic jobs artifact
+    :type periodic_jobs_path: string
+
+    :param dates: dates to check
+    :type dates: list of dates
+
+    :return df: data frame with the columns date, slot, local_time and
+        utc_time
+    :rtype: pandas data frame
     """
-    df = pd.read_csv(csv_path, index_col=0)
-    trips_today = df[df['day_code'].str.contains(
-                        config.day_of_week_codes[day_of_week])]
-    return trips_today.shape[0]
+    df = af.load_artifact(periodic_jobs_path)
+    if config.adaptive_transit_polling:
+        df = df[df.index % ap.slow_poll_stride == 0]
+    rows = []
+    for date in dates:
+        runs_today = df['day_code'].str.contains(
+            config.day_of_week_codes[date.weekday()])
+        midnight = dt.datetime.combine(date, dt.time())
+        rows.extend((date.isoformat(), int(slot),
+                     midnight + dt.timedelta(hours=hours, minutes=minutes,
+                                             seconds=seconds))
+                    for (slot, hours, minutes, seconds) in zip(
+                        df.index[runs_today], df['hours'][runs_today],
+                        df['minutes'][runs_today], df['seconds'][runs_today]))
+    return slots_frame(rows)
 
 
-def nightly_check_periodic(sql_db_loc, table_name, column_name, 
-                           time_column_name, expected_num, task_name):
+def scan_observed_slots(sql_db_loc, table_name, slot_column, since_utc_time):
     """
-    Compare the amount of data stored in the the previous day to desired 
-    amount. Send push notification with the result
-    
+    Find the slots that were observed since since_utc_time with one grouped
+        query on the indexed utc_time column of the partitions that hold
+        the rows since then
+
     :param sql_db_loc: location of the database file
     :type sql_db_loc: string
-    
+
     :param table_name: name of table where the data is stored
     :type table_name: string
-    
-    :param column_name: name of the column to count to compare with the
-        expected number
-    :type column_name: string
-    
-    :param time_column_name: name of the column that contains the time for
-        each row
-    :type time_column_name: string
-        
-    :param expected_num: number of expected rows
-    :type expected_num: int
-    
-    :param task_name: name of the task. This is sent in the push notification.
-    :type task_name: string
-
-    :return None
+
+    :param slot_column: name of the column that identifies the slot
+    :type slot_column: string
+
+    :param since_utc_time: only rows after this time are scanned
+    :type since_utc_time: float
+
+    :return rows: list of (date, slot, number of rows, last utc_time)
+    :rtype: list
+    """
+    start_date = dt.datetime.fromtimestamp(since_utc_time).date()
+    for location in [sql_db_loc] + sf.partition_locations(sql_db_loc,
+                                                          start_date):
+        # the frozen partitions already have the index
+        if not sf.is_frozen(location):
+            sf.create_utc_time_index(location, table_name)
+    # the local date is derived from the stored epoch
+    rows_query = ('select %s as date, %s, count(*), max(utc_time) from %s '
+                  'where utc_time > %d group by 1, 2' %
+                  (sf.local_date_sql('utc_time'), slot_column, table_name,
+                   since_utc_time))
+    return sf.query_partitions(sql_db_loc, table_name, rows_query,
+                               start_date)
+
+
+def check_buckets(expected, observed, checked_utc_time, end_utc_time):
+    """
+    Compare the expected and observed slots in the buckets that end after
+        checked_utc_time and no later than end_utc_time
+
+    :param expected: data frame of the expected slots
+    :type expected: pandas data frame
+
+    :param observed: set of the observed (date, slot) tuples
+    :type observed: set
+
+    :param checked_utc_time: end of the last bucket that was checked
+    :type checked_utc_time: float
+
+    :param end_utc_time: end of the last bucket that is checked
+    :type end_utc_time: float
+
+    :return gaps: list of (first local time of the bucket, expected number,
+        missing number) for the buckets that are missing slots
+    :rtype: list
     """
-    utc_time_prev = (dt.datetime.utcnow() + dt.timedelta(days=-1)) 
-    utc_time_prev = utc_time_prev.timestamp()
-    # determine if a push notification occurred during the desired time period
-    # defined by delay_between_push
-    rows_query = ('select count(distinct %s) from %s where %s > %f ' %
-                  (column_name, table_name, time_column_name, utc_time_prev))
-    num_rows = sf.query_data(sql_db_loc, rows_query)[0][0]
-    if num_rows != expected_num:
-        title_str = 'Error: Daily Count: %s' % task_name
-        body_str = 'Desired Count = %d, Actual Count = %d' % (
-            expected_num, num_rows)
-    else:
-        title_str = 'Pass: Daily Count: %s' % task_name
-        body_str = 'Desired Count = %d, Actual Count = %d' % (
-            expected_num, num_rows)
-    pn.send_push_notification(title_str, body_str)    
-
-
-def main():   
-    day_of_week = (dt.datetime.today()+dt.timedelta(days=-1)).weekday()
-    desired_number_of_traffic_measurements = des_num_traffic_meas(
-                                        config.trips_csv, day_of_week)
-    nightly_check(config.traffic_data_sql, 'traffic_data',
-                  desired_number_of_traffic_measurements)
-    desired_number_of_periodic_measurements = des_periodic_meas(
-        config.periodic_jobs_csv, day_of_week)
-    nightly_check_periodic(config.siri_data_sql, 'periodic_task_monitor',
-                           'time_index', 'utc_time',
-                           desired_number_of_periodic_measurements,
-                           'siri Data')
-    nightly_check_periodic(config.gtfs_rt_data_sql, 'periodic_task_monitor',
-                           'time_index', 'utc_time',
-                           desired_number_of_periodic_measurements,
-                           'gtfs-rt Data')
+    due = expected[(expected['utc_time'] >= checked_utc_time) &
+                   (expected['utc_time'] < end_utc_time)]
+    if due.empty:
+        return []
+    bucket_secs = config.completeness_check_mins * 60
+    is_missing = [(date, slot) not in observed for (date, slot) in
+                  zip(due['date'], due['slot'])]
+    summary = pd.DataFrame({
+        'bucket': (due['utc_time'] // bucket_secs).values,
+        'local_time': due['local_time'].values,
+        'missing': is_missing}).groupby('bucket').agg(
+        local_time=('local_time', 'min'), expected=('missing', 'size'),
+        missing=('missing', 'sum'))
+    summary = summary[summary['missing'] > 0]
+    return list(zip(summary['local_time'], summary['expected'],
+                    summary['missing']))
+
+
+def completeness_check(gap_db_loc, trips_path, periodic_jobs_path):
+    """
+    Check the buckets that were completed since the previous run of every
+        source, update the gap index and store the state so the next run
+        only scans new rows
+
+    :param gap_db_loc: location of the database that stores the state and
+        the gap index
+    :type gap_db_loc: string
+
+    :param trips_path: location of the trips artifact
+    :type trips_path: string
+
+    :param periodic_jobs_path: location of the periodic jobs artifact
+    :type periodic_jobs_path: string
+
+    :return gap_lines: one line for each bucket that is missing data
+    :rtype: list of strings
+    """
+    sf.create_completeness_tables(gap_db_loc)
+    sf.create_gap_index_table(gap_db_loc)
+    state = {source: (scanned, checked) for (source, scanned, checked) in
+             sf.query_data(gap_db_loc,
+                           'select * from completeness_state')}
+    now_utc_time = dt.datetime.now().timestamp()
+    bucket_secs = config.completeness_check_mins * 60
+    # the last bucket that ended more than the grace time ago
+    end_utc_time = ((now_utc_time - config.completeness_grace_mins * 60) //
+                    bucket_secs * bucket_secs)
+    first_utc_time = (now_utc_time -
+                      config.completeness_lookback_days * 24 * 60 * 60)
+    first_utc_time = min([first_utc_time] + [checked for (scanned, checked)
+                                             in state.values()])
+    # the whole of the first date is scanned on the first run so that its
+    # gap index is complete
+    first_date = (dt.datetime.now() - dt.timedelta(
+        seconds=now_utc_time - first_utc_time)).date()
+    first_scan_utc_time = stored_utc_time(dt.datetime.combine(first_date,
+                                                              dt.time()))
+    dates = [first_date + dt.timedelta(days=day) for day in range(
+        (dt.date.today() - first_date).days + 1)]
+    traffic_slots = expected_traffic_slots(trips_path, dates)
+    # the siri and gtfs-rt jobs of every agency run at the same times
+    periodic_slots = expected_periodic_slots(periodic_jobs_path, dates)
+    gap_lines = []
+    for (source, sql_db_loc, table_name, slot_column) in completeness_sources:
+        expected = traffic_slots if source == 'traffic' else periodic_slots
+        (scanned_utc_time, checked_utc_time) = state.get(
+            source, (first_scan_utc_time, first_utc_time // bucket_secs *
+                     bucket_secs))
+        rows = scan_observed_slots(sql_db_loc, table_name, slot_column,
+                                   scanned_utc_time - rescan_secs)
+        if len(rows) > 0:
+            sf.insert_completeness_observed(
+                gap_db_loc, [(source, date, int(slot)) for
+                                 (date, slot, _, _) in rows])
+            scanned_utc_time = max(scanned_utc_time,
+                                   max(row[3] for row in rows))
+        if end_utc_time <= checked_utc_time:
+            continue
+        observed = set(sf.query_data(
+            gap_db_loc, "select date, slot from completeness_observed "
+                        "where source = '%s' and date >= '%s'" %
+                        (source, first_date.isoformat())))
+        for (local_time, expected_num, missing_num) in check_buckets(
+                expected, observed, checked_utc_time, end_utc_time):
+            gap_lines.append('%s %s: %d of %d missing' % (
+                source, local_time.strftime('%a %H:%M'), missing_num,
+                expected_num))
+        gif.update_gap_index(gap_db_loc, source,
+                             expected[expected['utc_time'] < end_utc_time],
+                             observed)
+        sf.update_completeness_state(gap_db_loc, (
+            source, float(scanned_utc_time), float(end_utc_time)))
+    return gap_lines
+
+
+def main():
+    gap_lines = completeness_check(config.gap_index_sql,
+                                   config.trips_artifact,
+                                   config.periodic_jobs_artifact)
+    # compact the partitions that are no longer written to
+    for sql_db_loc in {source[1] for source in completeness_sources}:
+        sf.freeze_cold_partitions(sql_db_loc)
+    # collapse the raw transit rows of the old service days
+    for (sql_db_loc, table_name) in rf.retention_sources:
+        rf.apply_retention(sql_db_loc, table_name)
+    # one notification for all of the sources
+    if len(gap_lines) > 0:
+        pn.send_push_notification('Error: Missing Data',
+                                  '\n'.join(gap_lines))
 
 
 if __name__ == '__main__':
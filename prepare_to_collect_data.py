@@ -6,33 +6,23 @@ Description: This program parses a gfts file.
 
 import datetime as dt
 from itertools import permutations
-import logging.handlers
 import numpy as np
 import os
 import pandas as pd
 
 import partridge as ptg
 
+import adaptive_polling_functions as ap
+import artifact_functions as af
+import compile_table_def as ctd
 import config
 import data_collection_functions as dcf
+import dimension_functions as dim
 import file_functions as ff
+import migrate_databases as mdb
 import scheduler_functions as sched
 import sql_functions as sf
 
-# set up the root logger
-logger = logging.getLogger('')
-logger.setLevel(logging.INFO)
-dateTag = dt.datetime.now().strftime("%Y-%b-%d_%H-%M-%S")
-log_filename = config.prepare_log_file % dateTag
-# add a rotating handler, rotate the file every 10 mb. Keep the last 5 logfiles
-handler = logging.handlers.RotatingFileHandler(log_filename,
-                                               maxBytes=10*1024*1024,
-                                               backupCount=5)
-formatter = logging.Formatter(
-        '%(asctime)s %(name)-12s %(levelname)-8s %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
-
 # determine which days that data is collected
 day_of_interest_start = 0
 # + 1 - slice does not include end
@@ -61,6 +51,8 @@ collect_transit_frequency = 5
 # create the day code to use by scheduler
 collect_transit_day_code = ','.join(config.day_of_week_codes[
     day_of_interest_start:day_of_interest_end])
+# if True, only report the changes to the job database without writing them
+reconcile_dry_run = False
 
 
 # Start of functions
@@ -100,10 +92,12 @@ def trip_list_df(trip_list, stops_df):
     return trip_df
 
 
-def parse_gfts(stations, zip_path, csv_out_path, schedule_monitor_csv):
+def parse_gfts(stations, zip_path, trips_out_path, schedule_monitor_path,
+               agency, dimension_db_loc):
     """
-    Parses the gfts file and outputs a csv file containing information for
-        selected trips
+    Parses the gfts file and outputs an artifact containing information for
+        selected trips. The stations, trips and station pairs are added to
+        the dimension tables.
     
     :param stations: A list of tuples of the stations that you want the trips
         to be between 
@@ -112,13 +106,19 @@ def parse_gfts(stations, zip_path, csv_out_path, schedule_monitor_csv):
     :param zip_path: file location of the gfts
     :type string
     
-    :param csv_out_path: file location of the output csv file
+    :param trips_out_path: file location of the output trips artifact
     :type string
     
-    :param schedule_monitor_csv: file location of the schedule monitor
-        csv file
+    :param schedule_monitor_path: file location of the schedule monitor
+        artifact
     :type string
     
+    :param agency: 511 operator id of the agency of the gfts
+    :type agency: string
+    
+    :param dimension_db_loc: location of the dimension database
+    :type dimension_db_loc: string
+    
     """ 
     # read in the GFTS file to pandas
     feed = ptg.raw_feed(zip_path)
@@ -139,8 +139,13 @@ def parse_gfts(stations, zip_path, csv_out_path, schedule_monitor_csv):
     # create short stop name - remove caltrain from the end of the name
     stops['short_stop_name'] = stops['stop_name'].str.split(
                                     'Caltrain', 1).str[0].str.strip()
+    # create station pairs 
+    trip_list = list(permutations(stations, 2))
+    # add the stations, trips and traffic station pairs to the dimensions
+    dim.populate_dimensions(dimension_db_loc, agency, stops,
+                            schedule['trip_id'].unique(), trip_list)
     # create the schedule monitor
-    create_schedule_monitor_csv(schedule, stops, schedule_monitor_csv)
+    create_schedule_monitor(schedule, stops, schedule_monitor_path)
     # remove the special trains
     schedule = schedule[schedule['trip_id'].isin(train_numbers)]
     # Create new columns with seconds since midnight of the first day because 
@@ -167,8 +172,6 @@ def parse_gfts(stations, zip_path, csv_out_path, schedule_monitor_csv):
     schedule_trips = pd.merge(schedule_trips, calendar, on='service_id')  
     schedule_trips = schedule_trips.set_index(['short_stop_name_start',
                                               'short_stop_name_stop'])
-    # create station pairs 
-    trip_list = list(permutations(stations, 2))
     trip_df = trip_list_df(trip_list, stops)
     schedule_trips = pd.merge(trip_df, schedule_trips, left_index=True,
                               right_index=True)
@@ -212,20 +215,55 @@ def parse_gfts(stations, zip_path, csv_out_path, schedule_monitor_csv):
     schedule_trips['scheduled_trip_duration_secs'] = (schedule_trips[
         'arrival_time_timedelta_stop'] - schedule_trips[
         'departure_time_timedelta_start']).dt.total_seconds()
-    # output to csv
-    schedule_trips.to_csv(csv_out_path)
+    # station names repeat on every row, store them as categoricals
+    for column in ['short_stop_name_start', 'short_stop_name_stop']:
+        schedule_trips[column] = schedule_trips[column].astype('category')
+    # output to the artifact
+    af.save_artifact(schedule_trips, trips_out_path)
+    return None
+
+
+def parse_agency_schedule(zip_path, schedule_monitor_path, agency,
+                          dimension_db_loc):
+    """
+    Parses the gfts file of an agency whose traffic trips are not collected
+        and outputs its schedule monitor artifact. The stations and trips
+        are added to the dimension tables.
+    
+    :param zip_path: file location of the gfts of the agency
+    :type string
+    
+    :param schedule_monitor_path: file location of the schedule monitor
+        artifact
+    :type string
+    
+    :param agency: 511 operator id of the agency
+    :type agency: string
+    
+    :param dimension_db_loc: location of the dimension database
+    :type dimension_db_loc: string
+    
+    :return None
+    """
+    feed = ptg.raw_feed(zip_path)
+    schedule = feed.stop_times.apply(pd.to_numeric, errors='ignore')
+    stops = feed.stops.apply(pd.to_numeric, errors='ignore')
+    stops['short_stop_name'] = stops['stop_name'].str.strip()
+    dim.populate_dimensions(dimension_db_loc, agency, stops,
+                            schedule['trip_id'].unique())
+    create_schedule_monitor(schedule, stops, schedule_monitor_path)
     return None
 
 
-def create_schedule_monitor_csv(schedule, stops, csv_out_path):
+def create_schedule_monitor(schedule, stops, out_path):
     """ 
-    Parses the schedule and creates a csv file to use to determine on time 
+    Parses the schedule and creates an artifact to use to determine on time 
         performance
     
     :param schedule: data frame that contains the scheduler information
     :type pandas data frame
 
-    :param csv_out_path: file location of the output csv file
+    :param out_path: file location of the output artifact
     :type string
     
     :return None
@@ -237,11 +275,15 @@ def create_schedule_monitor_csv(schedule, stops, csv_out_path):
     schedule['trip_start_date_delta'] = -(np.floor(
         schedule['scheduled_departure_time_seconds'] / (60*60*24)))
     schedule = pd.merge(schedule, stops, on='stop_id', how='inner')
-    schedule.to_csv(csv_out_path, columns=['trip_id', 'stop_id',
-                                           'short_stop_name',
-                                           'scheduled_arrival_time_seconds',
-                                           'scheduled_departure_time_seconds',
-                                           'trip_start_date_delta'])
+    schedule = schedule[['trip_id', 'stop_id', 'short_stop_name',
+                         'scheduled_arrival_time_seconds',
+                         'scheduled_departure_time_seconds',
+                         'trip_start_date_delta']].copy()
+    # the trip ids and station names repeat on every stop
+    for column in ['trip_id', 'short_stop_name']:
+        schedule[column] = schedule[column].astype('category')
+    schedule = schedule.set_index(['trip_id', 'stop_id'])
+    af.save_artifact(schedule, out_path)
     return None
 
 
@@ -251,50 +293,100 @@ def main():
                            config.test_file_dir, config.test_plot_dir,
                            config.test_logs_dir, config.siri_json_dir, 
                            config.gtfs_rt_json_dir])  
+    # set up the root logger
+    ff.create_log_file(config.prepare_log_file)
+    # compile the table definitions if the spreadsheet changed
+    ctd.update_table_def(config.table_def_xls_file, config.table_def_file)
     
-    # remove the  files
-    ff.remove_files([config.trips_csv, 
-                     config.scheduler_sql,
-                     config.process_monitor_sql])
-    # parse the gfts
-    parse_gfts(station_list, config.gtfs_zip_path, config.trips_csv,
-               config.schedule_monitor_csv)       
+    # remove the  files. The job database is reconciled and the process
+    # monitor is kept (misfires and restarts) so a running collector keeps
+    # its state
+    ff.remove_files([config.trips_artifact])
+    # parse the gfts, the traffic trips are created from the default agency
+    for (agency, zip_path) in config.transit_agencies.items():
+        if agency == config.default_agency:
+            parse_gfts(station_list, zip_path, config.trips_artifact,
+                       config.schedule_monitor_artifacts[agency], agency,
+                       config.dimension_sql)
+        else:
+            parse_agency_schedule(zip_path,
+                                  config.schedule_monitor_artifacts[agency],
+                                  agency, config.dimension_sql)
     #  Add the traffic jobs
-    sched.add_traffic_jobs(dcf.query_google_traffic, config.trips_csv,
-                           config.scheduler_sql, config.traffic_data_sql)
+    sched.add_traffic_jobs(dcf.query_google_traffic, config.trips_artifact,
+                           config.scheduler_sql, config.traffic_data_sql,
+                           dry_run=reconcile_dry_run)
     # Add the transit jobs
     time_df = sched.create_collect_time(collect_transit_time,
                                         collect_transit_frequency,
                                         collect_transit_day_code,
-                                        config.periodic_jobs_csv)
-    # read in the scheduler monitor
-    schedule_monitor = pd.read_csv(config.schedule_monitor_csv, index_col=0)
-    schedule_monitor.set_index(['trip_id', 'stop_id'], inplace=True)
-    # add in the siri periodic jobs
-    sched.add_periodic_job(config.scheduler_sql,
-                           dcf.query_transit_data_siri, time_df,
-                           config.scheduler_id_dict['siri'],
-                           [config.siri_data_sql, schedule_monitor])
-    # add in the gtfs-rt periodic jobs
-    sched.add_periodic_job(config.scheduler_sql,
-                           dcf.query_transit_data_gtfs_rt, time_df,
-                           config.scheduler_id_dict['gtfs-rt'],
-                           [config.gtfs_rt_data_sql, schedule_monitor])
+                                        config.periodic_jobs_artifact)
+    # each agency has its own periodic jobs and databases so the agencies
+    # are collected in parallel
+    for agency in config.transit_agencies:
+        # read in the scheduler monitor
+        schedule_monitor = af.load_artifact(
+            config.schedule_monitor_artifacts[agency])
+        for (type_switch, query_function, data_sql) in [
+                ('siri', dcf.query_transit_data_siri,
+                 config.siri_data_sql_shards[agency]),
+                ('gtfs-rt', dcf.query_transit_data_gtfs_rt,
+                 config.gtfs_rt_data_sql_shards[agency])]:
+            id_modifier = config.agency_id_modifier(type_switch, agency)
+            if config.adaptive_transit_polling:
+                # the trips of the traffic stations are monitored for the
+                # default agency, all of the trips for the others
+                poll_spec = ap.create_poll_spec(
+                    id_modifier, time_df, collect_transit_frequency,
+                    schedule_monitor, station_list if
+                    agency == config.default_agency else None, agency)
+                sched.add_adaptive_job(
+                    config.scheduler_sql, ap.poll_transit_data,
+                    ap.AdaptivePollTrigger(poll_spec), id_modifier,
+                    [query_function, data_sql, schedule_monitor, agency,
+                     poll_spec], dry_run=reconcile_dry_run)
+            else:
+                sched.add_periodic_job(config.scheduler_sql, query_function,
+                                       time_df, id_modifier,
+                                       [data_sql, schedule_monitor, agency],
+                                       dry_run=reconcile_dry_run)
+    # the databases of the previous collections are converted to the current
+    # tables by migrate_databases.py while the collector is stopped
+    pending = mdb.pending_migrations(mdb.migration_databases,
+                                     config.transit_archive_dir)
+    if len(pending) > 0:
+        print('%d database files have old tables, stop the collector and run '
+              'migrate_databases.py' % len(pending))
     # create the sql files if they do not exist
     if not os.path.isfile(config.traffic_data_sql):
         sf.create_traffic_data_table(config.traffic_data_sql)
-    if not os.path.isfile(config.process_monitor_sql):   
-        sf.create_process_monitor_table(config.process_monitor_sql)
+    # the collector can create an empty process monitor file, so its
+    # tables are created on every run
+    sf.create_process_monitor_table(config.process_monitor_sql)
+    sf.create_dispatch_misfire_table(config.process_monitor_sql)
     if not os.path.isfile(config.push_notification_sql):
         sf.create_push_monitor_table(config.push_notification_sql)
-    if not os.path.isfile(config.siri_data_sql):
-        sf.create_transit_data_siri_table(config.siri_table_name, 
-                                          config.siri_data_sql)
-        sf.create_periodic_task_monitor_table(config.siri_data_sql)
-    if not os.path.isfile(config.gtfs_rt_data_sql):
-        sf.create_transit_data_gtfs_rt_table(config.gfts_rt_table_name,
-                                             config.gtfs_rt_data_sql)
-        sf.create_periodic_task_monitor_table(config.gtfs_rt_data_sql)
+    for agency in config.transit_agencies:
+        siri_data_sql = config.siri_data_sql_shards[agency]
+        if not os.path.isfile(siri_data_sql):
+            sf.create_transit_data_siri_table(config.siri_table_name, 
+                                              siri_data_sql)
+            sf.create_periodic_task_monitor_table(siri_data_sql)
+        gtfs_rt_data_sql = config.gtfs_rt_data_sql_shards[agency]
+        if not os.path.isfile(gtfs_rt_data_sql):
+            sf.create_transit_data_gtfs_rt_table(config.gfts_rt_table_name,
+                                                 gtfs_rt_data_sql)
+            sf.create_periodic_task_monitor_table(gtfs_rt_data_sql)
+        # the summary was added after the first databases were created
+        sf.create_transit_summary_table(siri_data_sql)
+        sf.create_transit_summary_table(gtfs_rt_data_sql)
+        # the index of the new predictions (decision_functions) was added
+        # after the first databases were created
+        for location in [gtfs_rt_data_sql] + sf.partition_locations(
+                gtfs_rt_data_sql):
+            if not sf.is_frozen(location):
+                sf.create_utc_time_index(location, config.gfts_rt_table_name,
+                                         'recorded_at_time_utc')
 
 
 if __name__ == '__main__':
@@ -7,6 +7,9 @@ import os
 
 # gfts file location 
 gtfs_zip_path = os.path.normpath(r'XXX\caltrain-GTFS.zip')
+# gfts file locations of the other transit agencies that are collected, the
+# key is the 511 operator id
+agency_gtfs_zip_paths = {}
 # directories
 base_dir = os.path.normpath(r'XXX\transit_vs_car')
 
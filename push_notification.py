@@ -1,25 +1,79 @@
 """
-Description: This file contains functions to send push notifications
+Description: This file contains functions to send push notifications. The
+    notifications of the collection jobs are rate limited in memory with a
+    token bucket for each push name and sent from a queue by a background
+    thread so that they never block a job. The time of the last notification
+    of each push name is read from the database once, so the limits hold
+    across restarts.
 
 @author: Robert Hennessy (robertghennessy@gmail.com)
 """
 import datetime as dt
-
-import pushover
+import logging
+import queue
+import threading
 
 import config
+from import_functions import lazy_import
 import sql_functions as sf
 
+# the pushover client is loaded when the first notification is sent
+pushover = lazy_import('pushover')
+
 # constants for train delay push notification
 # delay between the push notifications in seconds
 delay_between_push = 5*60
-delay_train_header = ['Train', 'Station', 'Delay (min)']
-delay_train_col_buf = 2
+# delay between the restart push notifications in seconds
+delay_between_restart_push = 60*60
+# token bucket of each push name: (burst, seconds to refill one token)
+push_rate_limits = {'delayed_train': (1, delay_between_push),
+                    'restart': (1, delay_between_restart_push)}
+default_push_rate_limit = (1, delay_between_push)
+# a notification with the same body as the last one of its push name is not
+# sent again within this many seconds
+duplicate_push_secs = 30*60
+# maximum number of notifications waiting to be sent. Notifications are
+# dropped when the queue is full.
+push_queue_size = 100
+
+# the state is shared by all of the job threads
+push_lock = threading.Lock()
+# {push_name: (tokens, utc_time of the last update)}
+token_buckets = {}
+# {push_name: (utc_time, body_str)} of the last notification
+last_sent = {}
+# pushover client, created on first use
+push_client = None
+push_client_base_url = None
+# queue of (title_str, body_str, on_sent) and the thread that sends them
+push_queue = queue.Queue(maxsize=push_queue_size)
+push_thread = None
+
+
+def get_push_client():
+    """
+    Return the pushover client. It is created on first use and again if
+        config.pushover_base_url changes.
+
+    :return client: pushover client
+    :rtype: pushover.Client
+    """
+    global push_client, push_client_base_url
+    with push_lock:
+        if (push_client is None or
+                push_client_base_url != config.pushover_base_url):
+            # send the notification to the live or fake pushover service
+            pushover.BASE_URL = config.pushover_base_url
+            push_client = pushover.Client(config.pushover_user_key,
+                                          api_token=config.pushover_api_key)
+            push_client_base_url = config.pushover_base_url
+        return push_client
 
 
 def send_push_notification(title_str, body_str):
     """
-    Send a push notification to the phone
+    Send a push notification to the phone. This blocks until it is sent, the
+        collection jobs use queue_push_notification instead.
     
     :param title_str: title of the push notification
     :type title_str: string
@@ -29,10 +83,139 @@ def send_push_notification(title_str, body_str):
 
     :return None
     """
-    # send a push notification to phone when the program has restarted
-    client = pushover.Client(config.pushover_user_key, 
-                             api_token=config.pushover_api_key)
-    client.send_message(body_str, title=title_str)
+    get_push_client().send_message(body_str, title=title_str)
+
+
+def send_queued_notifications():
+    """
+    Send the notifications in the queue. Runs in the push thread.
+
+    :return None
+    """
+    while True:
+        (title_str, body_str, on_sent, on_failed) = push_queue.get()
+        try:
+            send_push_notification(title_str, body_str)
+        except Exception:
+            logging.exception('Unable to send push notification: %s' %
+                              title_str)
+            if on_failed is not None:
+                on_failed()
+        else:
+            if on_sent is not None:
+                on_sent()
+        finally:
+            push_queue.task_done()
+
+
+def queue_push_notification(title_str, body_str, on_sent=None,
+                            on_failed=None):
+    """
+    Queue a push notification. It is sent by a background thread, the
+        notification is dropped if the queue is full.
+
+    :param title_str: title of the push notification
+    :type title_str: string
+
+    :param body_str: body of the push notification
+    :type body_str: string
+
+    :param on_sent: function that is called after the notification is sent
+    :type on_sent: function
+
+    :param on_failed: function that is called if the notification could not
+        be sent
+    :type on_failed: function
+
+    :return True if the notification was queued
+    :rtype: bool
+    """
+    global push_thread
+    with push_lock:
+        if push_thread is None:
+            push_thread = threading.Thread(target=send_queued_notifications,
+                                           name='push_notification',
+                                           daemon=True)
+            push_thread.start()
+    try:
+        push_queue.put_nowait((title_str, body_str, on_sent, on_failed))
+    except queue.Full:
+        logging.warning('Push notification queue is full, dropped: %s' %
+                        title_str)
+        return False
+    return True
+
+
+def load_last_sent(sql_db_loc, table_name, push_name):
+    """
+    Read the time of the last notification of push_name from the database
+        and fill its token bucket for the time that has passed since. This
+        is only done the first time that push_name is used.
+
+    :param sql_db_loc: location of the database file
+    :type sql_db_loc: string
+
+    :param table_name: table that records the notifications (push_monitor
+        or process_monitor)
+    :type table_name: string
+
+    :param push_name: name of the notification
+    :type push_name: string
+
+    :return None
+    """
+    if push_name in token_buckets:
+        return None
+    rows_query = ('select max(utc_time) from %s where push_notify = 1' %
+                  table_name)
+    if table_name == 'push_monitor':
+        rows_query = rows_query + ' and push_name = \'%s\'' % push_name
+    last_utc_time = sf.query_data(sql_db_loc, rows_query)[0][0]
+    utc_time_now = dt.datetime.now().timestamp()
+    (burst, refill_secs) = push_rate_limits.get(push_name,
+                                                default_push_rate_limit)
+    if last_utc_time is None:
+        tokens = burst
+    else:
+        tokens = min(burst, (utc_time_now - last_utc_time) / refill_secs)
+        last_sent[push_name] = (last_utc_time, None)
+    token_buckets[push_name] = (tokens, utc_time_now)
+    return None
+
+
+def take_push_token(push_name, utc_time_now, body_str=None):
+    """
+    Take a token from the bucket of push_name. No token is taken if the body
+        is the same as the last notification of push_name and it was sent
+        less than duplicate_push_secs ago.
+
+    :param push_name: name of the notification
+    :type push_name: string
+
+    :param utc_time_now: current utc time
+    :type utc_time_now: float
+
+    :param body_str: body of the push notification
+    :type body_str: string
+
+    :return True if the notification can be sent
+    :rtype: bool
+    """
+    (burst, refill_secs) = push_rate_limits.get(push_name,
+                                                default_push_rate_limit)
+    (tokens, updated_utc_time) = token_buckets.get(push_name,
+                                                   (burst, utc_time_now))
+    tokens = min(burst, tokens + (utc_time_now - updated_utc_time) /
+                 refill_secs)
+    (last_utc_time, last_body_str) = last_sent.get(push_name, (None, None))
+    is_duplicate = (body_str is not None and body_str == last_body_str and
+                    utc_time_now - last_utc_time < duplicate_push_secs)
+    if tokens < 1 or is_duplicate:
+        token_buckets[push_name] = (tokens, utc_time_now)
+        return False
+    token_buckets[push_name] = (tokens - 1, utc_time_now)
+    last_sent[push_name] = (utc_time_now, body_str)
+    return True
 
 
 def restart_push_notify(sql_db_loc, title_str, log_name):
@@ -48,113 +231,62 @@ def restart_push_notify(sql_db_loc, title_str, log_name):
 
     :return None
     """
-    # delay between the push notifications in seconds
-    delay_between_restart_push = 60*60
-    # create the time and date objects
-    date_str = dt.datetime.now().date().isoformat()
-    time_str = dt.datetime.now().time().isoformat()
-    day_of_week = dt.datetime.now().isoweekday()
-    utc_time_now = dt.datetime.utcnow().timestamp()
-    utc_time_prev = (dt.datetime.now() + 
-                     dt.timedelta(seconds=-delay_between_restart_push)) 
-    utc_time_prev = utc_time_prev.timestamp()
-    # determine if a push notification occurred during the desired time period
-    # defined by delay_between_push
-    rows_query = (('select count(*) from process_monitor where utc_time > %f' 
-                   ' and push_notify = 1') % utc_time_prev)
-    num_rows = sf.query_data(sql_db_loc, rows_query)[0][0]
-    if num_rows == 0:
-        push_notify = 1
-        body_str = 'time = %s' % time_str
-        send_push_notification(title_str, body_str)
-    else:
-        push_notify = 0
+    # create the time objects
+    now = dt.datetime.now()
+    utc_time_now = now.timestamp()
+    # determine if a push notification can be sent, the restarts are limited
+    # to one every delay_between_restart_push
+    with push_lock:
+        load_last_sent(sql_db_loc, 'process_monitor', 'restart')
+        push_notify = int(take_push_token('restart', utc_time_now))
+    if push_notify == 1:
+        body_str = 'time = %s' % now.time().isoformat()
+        queue_push_notification(title_str, body_str)
     # create the tuple that is inserted into the database. Ensure that all
     # parameters are the right data type
-    data_tuple = (str(date_str), str(time_str), float(utc_time_now), 
-                  int(day_of_week), int(push_notify), str(log_name))
+    data_tuple = (int(utc_time_now), int(now.isoweekday()), int(push_notify),
+                  str(log_name))
     sf.insert_process_monitor(sql_db_loc, data_tuple)
  
 
-def delay_push_notify(sql_db_loc, delay_df):
+def delay_push_notify(sql_db_loc, body_str, on_sent=None, on_failed=None):
     """
-     Send a push notification because a train is delay
+    Send a push notification because trains are delayed
     
     :param sql_db_loc: location of the database push notification database
     :type sql_db_loc: string
         
-    :param delay_df: data frame that contains information about the delayed
-        trains
-    :type delay_df: pandas data frame
+    :param body_str: the delay alerts (alert_functions)
+    :type body_str: string
 
-    :return None
-    """
-    # create the time and date objects
-    date_str = dt.datetime.now().date().isoformat()
-    time_str = dt.datetime.now().time().isoformat()
-    day_of_week = dt.datetime.now().isoweekday()
-    utc_time_now = dt.datetime.utcnow().timestamp()
-    utc_time_prev = (dt.datetime.now() + 
-                     dt.timedelta(seconds=-delay_between_push)) 
-    utc_time_prev = utc_time_prev.timestamp()
-    # determine if a push notification occurred during the desired time period
-    # defined by delay_between_push
-    rows_query = ('select count(*) from push_monitor where utc_time > %f and ' 
-                  'push_notify = 1 and push_name = \'%s\'' %
-                  (utc_time_prev, 'delayed_train'))
-    num_rows = sf.query_data(sql_db_loc, rows_query)[0][0]
-    if num_rows == 0:
-        push_notify = 1
-        title_str = 'Train Delays'
-        body_str = construct_delay_text(delay_df, delay_train_header, 
-                                        delay_train_col_buf)
-        send_push_notification(title_str, body_str)
-        # create the tuple that is inserted into the database. Ensure that all
-        # parameters are the right data type
-        data_tuple = (str(date_str), str(time_str), float(utc_time_now),
-                      int(day_of_week), int(push_notify), 'delayed_train')
-        sf.insert_push_monitor(sql_db_loc, data_tuple)
+    :param on_sent: function that is called after the notification is sent
+    :type on_sent: function
 
+    :param on_failed: function that is called if the notification could not
+        be sent
+    :type on_failed: function
 
-def construct_delay_text(delay_df, header, col_buf):
+    :return True if the notification was queued
+    :rtype: bool
     """
-    Construct the train delay text
-    
-    :param delay_df: data frame that contains information about the delayed
-        trains
-    :type delay_df: pandas data frame
-    
-    :param header: a list that contains the header of the push notification
-    :type header: a list of strings
-    
-    :param col_buf: the number of spaces between columns
-    :type col_buf: int
-
-    :return body_str: string for the body of the push notification
-    :type body_str: string
-    
-    """
-    if len(delay_df.columns) != len(header):
-        raise ValueError(('Length of the header does not match the' 
-                          'number of columns in the delay_df'))
-    # determine which columns have float and int types 
-    index_number = delay_df.select_dtypes(include=['float', 'int']).columns
-    # convert the numbers to have two decimal points
-    delay_df[index_number] = delay_df[index_number].applymap(
-                                        lambda x: '{0:.2f}'.format(x))
-    (num_rows, num_cols) = delay_df.shape
-    # creates a list of list with the values
-    values_list = delay_df.values.tolist() 
-    # inserts the header into the beginning
-    values_list.insert(0, header)
-    num_rows = num_rows + 1
-    # determine the maximum length in all columns. add 2*col_buf
-    col_len = [len(max([item[ind] for item in values_list], key=len)) +
-               col_buf for ind in range(num_cols)]
-    # pad the strings so that each element in each column has the same length
-    body_str = [[values_list[rInd][cInd].center(col_len[cInd])
-                 for cInd in range(num_cols)] for rInd in range(num_rows)]
-    # collapse the rows into strings
-    body_str = [''.join(item) for item in body_str]
-    body_str = '\n'.join(body_str)
-    return body_str
+    # create the time objects
+    now = dt.datetime.now()
+    utc_time_now = now.timestamp()
+    # determine if a push notification can be sent, the delay notifications
+    # are limited to one every delay_between_push
+    with push_lock:
+        load_last_sent(sql_db_loc, 'push_monitor', 'delayed_train')
+        if not take_push_token('delayed_train', utc_time_now, body_str):
+            return False
+    title_str = 'Train Delays'
+    # create the tuple that is inserted into the database once the
+    # notification is sent. Ensure that all parameters are the right data
+    # type
+    data_tuple = (int(utc_time_now), int(now.isoweekday()), 1,
+                  'delayed_train')
+    def record_sent():
+        sf.insert_push_monitor(sql_db_loc, data_tuple)
+        if on_sent is not None:
+            on_sent()
+    return queue_push_notification(title_str, body_str, record_sent,
+                                   on_failed)
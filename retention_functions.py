@@ -0,0 +1,222 @@
+"""
+Description: This file contains the retention policy of the transit data.
+    Every poll keeps the latest prediction of each train and stop in the raw
+    transit tables and updates the transit summary table (first and last
+    prediction, maximum delay and final delay, see
+    sql_functions.transit_summary_sql). Once a service day ended more than
+    config.transit_retention_days days ago its raw rows are no longer
+    needed. The frozen partitions that only hold such days are collapsed
+    into the summary of the original database and moved to the archive
+    directory. The rows that were written before the data was partitioned
+    are moved out of the original database in batches. Each run only does
+    the work that became due since the previous run.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import logging
+import os
+import shutil
+
+import config
+import sql_functions as sf
+
+# databases and raw transit tables that the retention is applied to
+retention_sources = []
+for agency in config.transit_agencies:
+    retention_sources.extend([
+        (config.siri_data_sql_shards[agency], config.siri_table_name),
+        (config.gtfs_rt_data_sql_shards[agency], config.gfts_rt_table_name)])
+
+
+def summary_from_raw_sql(schema, table_name, where):
+    """
+    Construct the sql command that adds the summary of the raw transit rows
+        that are not in the transit summary yet, for example the rows that
+        were written before the summary existed. Each raw row is the last
+        prediction, so it is also used as the first prediction.
+
+    :param schema: name of the database that holds the raw rows
+    :type schema: string
+
+    :param table_name: name of the raw transit table
+    :type table_name: string
+
+    :param where: where statement that selects the raw rows
+    :type where: string
+
+    :return sql command
+    :rtype: string
+    """
+    return """INSERT OR IGNORE INTO main.%s
+              SELECT train_start_date, trip_key, stop_id,
+                  recorded_at_time_utc, recorded_at_time_utc,
+                  departure_delay, departure_delay, departure_delay, %s, 1
+              FROM %s.%s %s""" % (
+        config.transit_summary_table_name,
+        'arrival_delay' if table_name == config.siri_table_name else 'NULL',
+        schema, table_name, where)
+
+
+def archive_location(db_location, archive_dir):
+    """
+    Location of the archive of the rows that were written to the original
+        database before the data was partitioned
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param archive_dir: archive directory
+    :type archive_dir: string
+
+    :return location of the archive database
+    :rtype: string
+    """
+    (root, ext) = os.path.splitext(os.path.basename(db_location))
+    return os.path.join(archive_dir, root + '-archive' + ext)
+
+
+def collapse_partition(db_location, table_name, location, archive_dir):
+    """
+    Copy the transit summary of a partition into the original database and
+        move the partition to the archive directory
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param table_name: name of the raw transit table
+    :type table_name: string
+
+    :param location: location of the partition file
+    :type location: string
+
+    :param archive_dir: archive directory, the partition is deleted if None
+    :type archive_dir: string
+
+    :return None
+    """
+    summary_table = config.transit_summary_table_name
+    conn = None
+    try:
+        conn = sf.create_connection(db_location)
+        conn.execute("ATTACH DATABASE '%s' AS p" % location)
+        sf.begin_transaction(conn, db_location, 'IMMEDIATE')
+        conn.execute(sf.transit_summary_table_sql)
+        has_summary = conn.execute(
+            "select count(*) from p.sqlite_master where name = '%s'" %
+            summary_table).fetchone()[0]
+        if has_summary:
+            conn.execute('INSERT OR REPLACE INTO main.%s SELECT * FROM p.%s'
+                         % (summary_table, summary_table))
+        conn.execute(summary_from_raw_sql('p', table_name, ''))
+        conn.commit()
+        conn.execute('DETACH DATABASE p')
+    finally:
+        if conn:
+            conn.close()
+    if archive_dir is None:
+        os.remove(location)
+    else:
+        os.makedirs(archive_dir, exist_ok=True)
+        shutil.move(location, os.path.join(archive_dir,
+                                           os.path.basename(location)))
+    return None
+
+
+def prune_original_rows(db_location, table_name, cutoff_date, archive_dir,
+                        batch_rows):
+    """
+    Summarize the raw transit rows of the original database whose service
+        day is before cutoff_date, move them to the archive database and
+        delete them. At most batch_rows rows are moved so that a run does
+        not lock the database for long.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param table_name: name of the raw transit table
+    :type table_name: string
+
+    :param cutoff_date: service days before this date are pruned
+    :type cutoff_date: date
+
+    :param archive_dir: archive directory, the rows are deleted if None
+    :type archive_dir: string
+
+    :param batch_rows: maximum number of rows that are moved
+    :type batch_rows: int
+
+    :return num_rows: number of rows that were moved
+    :rtype: int
+    """
+    conn = None
+    try:
+        conn = sf.create_connection(db_location)
+        if archive_dir is not None:
+            os.makedirs(archive_dir, exist_ok=True)
+            conn.execute("ATTACH DATABASE '%s' AS a" % archive_location(
+                db_location, archive_dir))
+        sf.begin_transaction(conn, db_location, 'IMMEDIATE')
+        conn.execute(sf.transit_summary_table_sql)
+        conn.execute("CREATE TEMP TABLE retired AS SELECT rowid AS id FROM %s "
+                     "WHERE train_start_date < '%s' LIMIT %d" %
+                     (table_name, cutoff_date.isoformat(), batch_rows))
+        num_rows = conn.execute('select count(*) from retired').fetchone()[0]
+        where = 'WHERE rowid IN (SELECT id FROM retired)'
+        if num_rows > 0:
+            conn.execute(summary_from_raw_sql('main', table_name, where))
+            if archive_dir is not None:
+                conn.execute('CREATE TABLE IF NOT EXISTS a.%s AS SELECT * '
+                             'FROM main.%s WHERE 0' % (table_name,
+                                                       table_name))
+                conn.execute('INSERT INTO a.%s SELECT * FROM main.%s %s' %
+                             (table_name, table_name, where))
+            conn.execute('DELETE FROM main.%s %s' % (table_name, where))
+        conn.execute('DROP TABLE retired')
+        conn.commit()
+    finally:
+        if conn:
+            conn.close()
+    return num_rows
+
+
+def apply_retention(db_location, table_name, today=None):
+    """
+    Apply the retention policy to a transit database
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param table_name: name of the raw transit table
+    :type table_name: string
+
+    :param today: current date, defaults to today
+    :type today: date
+
+    :return collapsed: locations of the partitions that were collapsed
+    :rtype: list of strings
+
+    :return num_rows: number of rows moved out of the original database
+    :rtype: int
+    """
+    if today is None:
+        today = dt.date.today()
+    cutoff_date = today - dt.timedelta(days=config.transit_retention_days)
+    collapsed = []
+    # only the frozen partitions are no longer written to
+    for location in sf.partition_locations(db_location):
+        if not sf.is_frozen(location):
+            continue
+        last_date = sf.query_data(location, 'select max(train_start_date) '
+                                            'from %s' % table_name)[0][0]
+        if last_date is None or last_date < cutoff_date.isoformat():
+            collapse_partition(db_location, table_name, location,
+                               config.transit_archive_dir)
+            collapsed.append(location)
+    num_rows = prune_original_rows(db_location, table_name, cutoff_date,
+                                   config.transit_archive_dir,
+                                   config.retention_batch_rows)
+    if len(collapsed) > 0 or num_rows > 0:
+        logging.info('Retention of %s: collapsed %d partitions and moved %d '
+                     'rows' % (db_location, len(collapsed), num_rows))
+    return collapsed, num_rows
@@ -0,0 +1,241 @@
+"""
+Description: This file contains the retry policy of the calls to the external
+    apis. Each endpoint has a circuit breaker. After
+    breaker_failure_threshold consecutive failures the circuit opens and the
+    calls fail fast with CircuitOpenError for breaker_open_secs seconds.
+    Then a single trial call is let through, the circuit closes if it
+    succeeds and opens again if it fails. The retries of all of the job
+    threads share one token bucket, so an outage does not turn every job
+    into five calls against a dead endpoint. The trips, recoveries, fast
+    failures and retries that were refused are counted in the metrics.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import functools
+import logging
+import threading
+import time
+
+import tenacity as ten
+
+import metrics_functions as mf
+
+# maximum number of attempts of a call, including the first one
+max_attempts = 5
+# retry token bucket shared by the job threads: (burst, seconds to refill
+# one token)
+retry_rate_limit = (10, 2)
+# consecutive failures of an endpoint that open its circuit
+breaker_failure_threshold = 5
+# seconds that an open circuit fails fast before a trial call is let through
+breaker_open_secs = 60
+
+# access the root logger
+logger = logging.getLogger('')
+log_retry = ten.before_sleep_log(logger, logging.DEBUG)
+
+# the state is shared by all of the job threads
+retry_lock = threading.Lock()
+# (tokens, monotonic time of the last update) of the retry token bucket
+retry_bucket = None
+# {endpoint: {'state', 'failures', 'opened', 'trial'}} of the circuit
+# breakers. The state is closed, open or half-open.
+breakers = {}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit is open
+    """
+    pass
+
+
+def take_retry_token(now=None):
+    """
+    Take a token from the retry token bucket
+
+    :param now: monotonic time, defaults to now
+    :type now: float
+
+    :return True if the call can be retried
+    :rtype: bool
+    """
+    global retry_bucket
+    if now is None:
+        now = time.monotonic()
+    (burst, refill_secs) = retry_rate_limit
+    with retry_lock:
+        (tokens, updated) = retry_bucket or (burst, now)
+        tokens = min(burst, tokens + (now - updated) / refill_secs)
+        retry_bucket = (max(tokens - 1, 0), now)
+    return tokens >= 1
+
+
+def breaker_state(endpoint):
+    """
+    Return the state of the circuit breaker of an endpoint, it is created
+        closed. Call with retry_lock held.
+
+    :param endpoint: name of the endpoint
+    :type endpoint: string
+
+    :return state: dictionary with the state, failures, opened and trial
+    :rtype: dictionary
+    """
+    return breakers.setdefault(endpoint, {'state': 'closed', 'failures': 0,
+                                          'opened': None, 'trial': False})
+
+
+def before_call(endpoint, now=None):
+    """
+    Check the circuit breaker before an endpoint is called. A single trial
+        call is let through once the circuit was open for breaker_open_secs
+        seconds.
+
+    :param endpoint: name of the endpoint
+    :type endpoint: string
+
+    :param now: monotonic time, defaults to now
+    :type now: float
+
+    :raises CircuitOpenError: if the circuit is open
+
+    :return None
+    """
+    if now is None:
+        now = time.monotonic()
+    with retry_lock:
+        state = breaker_state(endpoint)
+        if (state['state'] == 'open' and
+                now - state['opened'] >= breaker_open_secs):
+            state['state'] = 'half-open'
+        if state['state'] == 'half-open' and not state['trial']:
+            state['trial'] = True
+            return None
+        is_open = state['state'] != 'closed'
+    if is_open:
+        mf.increment('circuit_breaker_rejections_total',
+                     {'endpoint': endpoint})
+        raise CircuitOpenError('The circuit of %s is open' % endpoint)
+    return None
+
+
+def record_success(endpoint):
+    """
+    Close the circuit of an endpoint after a successful call
+
+    :param endpoint: name of the endpoint
+    :type endpoint: string
+
+    :return None
+    """
+    with retry_lock:
+        state = breaker_state(endpoint)
+        recovered = state['state'] != 'closed'
+        state.update(state='closed', failures=0, opened=None, trial=False)
+    if recovered:
+        logging.info('Circuit of %s closed' % endpoint)
+        mf.increment('circuit_breaker_recoveries_total',
+                     {'endpoint': endpoint})
+    return None
+
+
+def record_failure(endpoint, now=None):
+    """
+    Count a failed call of an endpoint. The circuit opens after
+        breaker_failure_threshold consecutive failures or when the trial
+        call fails.
+
+    :param endpoint: name of the endpoint
+    :type endpoint: string
+
+    :param now: monotonic time, defaults to now
+    :type now: float
+
+    :return None
+    """
+    if now is None:
+        now = time.monotonic()
+    with retry_lock:
+        state = breaker_state(endpoint)
+        state['failures'] += 1
+        failures = state['failures']
+        tripped = (state['state'] == 'half-open' or
+                   (state['state'] == 'closed' and
+                    state['failures'] >= breaker_failure_threshold))
+        if tripped:
+            state.update(state='open', opened=now, trial=False)
+    if tripped:
+        logging.warning('Circuit of %s opened after %d failures' % (
+            endpoint, failures))
+        mf.increment('circuit_breaker_trips_total', {'endpoint': endpoint})
+    return None
+
+
+def count_retry(retry_state):
+    """
+    Counts the retry in the metrics and logs it. Called by tenacity before
+        sleeping between attempts.
+
+    :param retry_state: state of the retry provided by tenacity
+    :type retry_state: tenacity.RetryCallState
+
+    :return None
+    """
+    mf.increment('collection_retries_total',
+                 {'function': retry_state.fn.__name__})
+    log_retry(retry_state)
+    return None
+
+
+def stop_without_retry_token(retry_state):
+    """
+    Stop retrying if the retry token bucket is empty. Called by tenacity
+        after a failed attempt.
+
+    :param retry_state: state of the retry provided by tenacity
+    :type retry_state: tenacity.RetryCallState
+
+    :return True if the call is not retried
+    :rtype: bool
+    """
+    if take_retry_token():
+        return False
+    mf.increment('retry_budget_exhausted_total',
+                 {'function': retry_state.fn.__name__})
+    return True
+
+
+def external_call(endpoint):
+    """
+    Decorator of a function that calls an external endpoint. The calls go
+        through the circuit breaker of the endpoint and the failed calls are
+        retried with exponential back off and jitter while the retry token
+        bucket has tokens, at most max_attempts times. A call that fails
+        fast because the circuit is open is not retried.
+
+    :param endpoint: name of the endpoint
+    :type endpoint: string
+
+    :return decorator
+    :rtype: function
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def guarded_call(*args, **kwargs):
+            before_call(endpoint)
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                record_failure(endpoint)
+                raise
+            record_success(endpoint)
+            return result
+        return ten.retry(
+            wait=ten.wait_random_exponential(multiplier=1, max=10),
+            reraise=True,
+            stop=(ten.stop_after_attempt(max_attempts) |
+                  stop_without_retry_token),
+            retry=ten.retry_if_not_exception_type(CircuitOpenError),
+            before_sleep=count_retry)(guarded_call)
+    return decorator
@@ -6,18 +6,32 @@ Description: This file contains all functions that are related to the
 """
 
 import datetime as dt
-import numpy as np
-import pandas as pd
+import logging
+import pickle
 
+from apscheduler.executors.pool import ProcessPoolExecutor
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.job import Job
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import datetime_to_utc_timestamp
 
 import config
+from import_functions import lazy_import
+
+# only prepare_to_collect_data needs these to create the jobs
+af = lazy_import('artifact_functions')
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 job_identifier = {'traffic': 'trf-', 'transit-siri': 't_siri-',
                   'transit-gtfs-rt': 't_gtfs_rt-'}
+# seconds between checks of the job database for reconciled jobs
+job_store_poll_secs = 60
 weekday_names = config.weekday_names
 day_of_week_codes = config.day_of_week_codes
 
@@ -32,25 +46,57 @@ def run_tasks(sql_loc):
     :return None
     """
     jobstores = {
-        'default': SQLAlchemyJobStore(url='sqlite:///%s' % sql_loc)
+        'default': SQLAlchemyJobStore(url='sqlite:///%s' % sql_loc),
+        'memory': MemoryJobStore()
     }
-    scheduler = BlockingScheduler(jobstores=jobstores)
+    job_defaults = {'coalesce': config.job_coalesce,
+                    'max_instances': config.job_max_instances,
+                    'misfire_grace_time': config.job_misfire_grace_time}
+    scheduler = BlockingScheduler(jobstores=jobstores,
+                                  executors=create_executors(),
+                                  job_defaults=job_defaults)
+    # wake up the scheduler periodically so that jobs reconciled into the job
+    # database by prepare_to_collect_data are picked up without a restart
+    scheduler.add_job(scheduler.wakeup, 'interval',
+                      seconds=job_store_poll_secs, jobstore='memory',
+                      id='job_store_poll')
     scheduler.start()    
     scheduler.print_jobs()
     return None
     
 
-def add_traffic_jobs(function_to_run, csv_path_in, scheduler_sql_loc,
-                     out_sql_loc):
+def create_executors():
+    """
+    Create the apscheduler executors for the job types in
+        config.job_type_executor from config.executor_config
+
+    :return executors: dictionary of the executors with the alias as the key
+    :rtype: dictionary
     """
-    Create the job database that the scheduler uses.
+    aliases = set(['default'] + list(config.job_type_executor.values()))
+    executors = {}
+    for alias in aliases:
+        executor_def = config.executor_config[alias]
+        if executor_def['type'] == 'process':
+            executors[alias] = ProcessPoolExecutor(executor_def['max_workers'])
+        else:
+            executors[alias] = ThreadPoolExecutor(executor_def['max_workers'])
+    return executors
+
+
+def add_traffic_jobs(function_to_run, trips_path_in, scheduler_sql_loc,
+                     out_sql_loc, dry_run=False):
+    """
+    Reconcile the traffic jobs in the job database that the scheduler uses
+        with the trips. Only the jobs that changed are written, in a single
+        transaction.
     
     :param function_to_run: The function that is being scheduled
-    :type csv_path_in: function
+    :type function_to_run: function
     
-    :param csv_path_in: The path to the csv file that contains the trip
+    :param trips_path_in: The path to the artifact that contains the trip
         information. 
-    :type csv_path_in: string
+    :type trips_path_in: string
     
     :param scheduler_sql_loc: location of the sql job database generated by
         this program and used by the scheduler
@@ -58,70 +104,99 @@ def add_traffic_jobs(function_to_run, csv_path_in, scheduler_sql_loc,
     
     :param out_sql_loc: location of the sql job database that the scheduled
         task stores its results
-    :type sched_sql_loc: string
+    :type out_sql_loc: string
+
+    :param dry_run: if True, only report the difference to the existing jobs
+        and do not modify the job database
+    :type dry_run: bool
     
-    :return None
+    :return job_diff: ids of the jobs that are added, modified, unchanged
+        and removed
+    :rtype: dictionary
+    """
+    schedule_trips = af.load_artifact(trips_path_in)
+    job_specs = traffic_job_specs(schedule_trips, out_sql_loc)
+    return reconcile_jobs(scheduler_sql_loc, function_to_run, job_specs,
+                          job_identifier['traffic'], 'traffic',
+                          dry_run=dry_run)
+
+
+def traffic_job_specs(schedule_trips, out_sql_loc):
+    """
+    Construct the cron specification of the traffic jobs. One job is created
+        for every trip.
+
+    :param schedule_trips: data frame that contains the trip information
+    :type schedule_trips: pandas data frame
+
+    :param out_sql_loc: location of the sql job database that the scheduled
+        task stores its results
+    :type out_sql_loc: string
+
+    :return job_specs: data frame with the columns id, day_of_week, hour,
+        minute, second and args
+    :rtype: pandas data frame
     """
-    schedule_trips = pd.read_csv(csv_path_in, index_col=0)
     schedule_trips = schedule_trips.sort_values([
         'departure_time_timedelta_start', 'arrival_time_timedelta_stop'])
-    schedule_trips_index = schedule_trips.index
-    # open the scheduler object and associate the job database with it
-    scheduler = BackgroundScheduler()
-    scheduler.add_jobstore('sqlalchemy', url='sqlite:///%s' %
-                                             scheduler_sql_loc)
-    # loop through all of the trips and add them to the jobs database
-    for sInd in range(len(schedule_trips)):
-            trip = schedule_trips.loc[sInd]
-            trip_index = schedule_trips_index[sInd]
-            trip_id = trip['trip_id']
-            start_station = trip['short_stop_name_start']
-            end_station = trip['short_stop_name_stop']
-            # create the location dictionaries
-            start_loc = {
-                "lat": trip['stop_lat_start'],
-                "lng": trip['stop_lon_start']
-            }
-            end_loc = {
-                "lat": trip['stop_lat_stop'],
-                "lng": trip['stop_lon_stop']
-            }         
-            sched_time = dt.datetime.strptime(trip['departure_time_start'],
-                                              "%H:%M:%S")
-            day_code = ''
-            for day_ind in range(len(weekday_names)):
-                if trip[weekday_names[day_ind]]:
-                    if day_code == '':
-                        day_code = day_code + day_of_week_codes[day_ind]
-                    else:
-                        day_code = day_code + ',' + day_of_week_codes[day_ind]
-            # misfire_grace_time - seconds after the designated runtime that 
-            # the job is still allowed to be run
-            scheduler.add_job(function_to_run, 'cron', day_of_week=day_code,
-                              hour=sched_time.hour, minute=sched_time.minute, 
-                              misfire_grace_time=120,
-                              id=(job_identifier['traffic']+str(trip_index)),
-                              args=[trip_index, trip_id, start_station, 
-                                    end_station, start_loc, end_loc, 
-                                    out_sql_loc])
-    scheduler.print_jobs()
-    scheduler.start()
-    scheduler.shutdown()
-    return None
+    trip_index = schedule_trips.index.to_series()
+    # hours past midnight (24:00:00 and later) run on the same clock time
+    departure_secs = schedule_trips[
+        'departure_time_timedelta_start'].dt.total_seconds().astype(int)
+    # create the location dictionaries
+    start_locs = [{"lat": lat, "lng": lng} for (lat, lng) in zip(
+        schedule_trips['stop_lat_start'].tolist(),
+        schedule_trips['stop_lon_start'].tolist())]
+    end_locs = [{"lat": lat, "lng": lng} for (lat, lng) in zip(
+        schedule_trips['stop_lat_stop'].tolist(),
+        schedule_trips['stop_lon_stop'].tolist())]
+    args = [list(item) for item in zip(
+        trip_index.tolist(), schedule_trips['trip_id'].tolist(),
+        schedule_trips['short_stop_name_start'].astype(str).tolist(),
+        schedule_trips['short_stop_name_stop'].astype(str).tolist(),
+        start_locs, end_locs, [out_sql_loc] * len(schedule_trips))]
+    job_specs = pd.DataFrame({
+        'id': trip_index.astype(str).values,
+        'day_of_week': create_day_code(schedule_trips).values,
+        'hour': ((departure_secs // 3600) % 24).values,
+        'minute': ((departure_secs // 60) % 60).values,
+        'second': 0,
+        'args': args})
+    return job_specs
+
+
+def create_day_code(df):
+    """
+    Construct the apscheduler day_of_week code (for example 'mon,tue') from
+        the weekday columns of a data frame.
+
+    :param df: data frame that contains a column for each day of the week.
+        A value of 1 means that the trip runs on that day.
+    :type df: pandas data frame
+
+    :return day_code: the day code for each row
+    :rtype: pandas series
+    """
+    day_code = pd.Series('', index=df.index)
+    for (day_name, day_code_str) in zip(weekday_names, day_of_week_codes):
+        day_code = day_code.str.cat(np.where(df[day_name] == 1,
+                                             day_code_str + ',', ''))
+    return day_code.str.rstrip(',')
 
 
 def add_periodic_job(sched_sql_loc, function_to_run, time_df, id_modifier, 
-                     args):
+                     args, dry_run=False):
     """
-    Adds a job to the scheduler database. This function must have the same
-        arguments for all runs.
+    Reconciles the periodic jobs in the scheduler database with time_df. This
+        function must have the same arguments for all runs. Only the jobs that
+        changed are written, in a single transaction.
     
     :param sched_sql_loc: location of the sql job database generated by
         this program and used by the scheduler
     :type sched_sql_loc: string
     
     :param function_to_run: The function that is being scheduled
-    :type csv_path_in: function
+    :type function_to_run: function
 
     :param time_df: pandas data frame that contains when the function should
         run
@@ -132,39 +207,391 @@ def add_periodic_job(sched_sql_loc, function_to_run, time_df, id_modifier,
     
     :param args: list of arguments that are used by function_to_run
     :type args: list
+
+    :param dry_run: if True, only report the difference to the existing jobs
+        and do not modify the job database
+    :type dry_run: bool
+
+    :return job_diff: ids of the jobs that are added, modified, unchanged
+        and removed
+    :rtype: dictionary
+    """
+    job_specs = periodic_job_specs(time_df, args)
+    return reconcile_jobs(sched_sql_loc, function_to_run, job_specs,
+                          id_modifier, 'transit', dry_run=dry_run)
+
+
+def periodic_job_specs(time_df, args):
+    """
+    Construct the cron specification of the periodic jobs. The index of
+        time_df is appended to the arguments of each job.
+
+    :param time_df: pandas data frame that contains when the function should
+        run
+    :type time_df: pandas data frame
+
+    :param args: list of arguments that are used by function_to_run
+    :type args: list
+
+    :return job_specs: data frame with the columns id, day_of_week, hour,
+        minute, second and args
+    :rtype: pandas data frame
+    """
+    sched_index = time_df.index.to_series()
+    job_specs = pd.DataFrame({
+        'id': sched_index.astype(str).values,
+        'day_of_week': time_df['day_code'].values,
+        'hour': time_df['hours'].astype(int).values,
+        'minute': time_df['minutes'].astype(int).values,
+        'second': time_df['seconds'].astype(int).values,
+        'args': [args + [ind] for ind in sched_index.tolist()]})
+    return job_specs
+
+
+def open_job_store(sched_sql_loc):
+    """
+    Open the sql job store without starting a scheduler. The scheduler that
+        is returned is only used to construct the jobs.
+
+    :param sched_sql_loc: location of the sql job database
+    :type sched_sql_loc: string
+
+    :return scheduler: scheduler that is associated with the job store
+    :rtype: BackgroundScheduler
+
+    :return job_store: the sql job store
+    :rtype: SQLAlchemyJobStore
     """
-    # open the scheduler object and associate the job database with it
     scheduler = BackgroundScheduler()
-    scheduler.add_jobstore('sqlalchemy', url='sqlite:///%s' % sched_sql_loc)
-    sched_time_hours = time_df['hours'].values
-    sched_time_minutes = time_df['minutes'].values
-    sched_time_seconds = time_df['seconds'].values
-    sched_day_code = time_df['day_code'].values
-    sched_index = time_df.index.values
-    for ind in range(len(sched_time_hours)):
-        # misfire_grace_time - seconds after the designated runtime that 
-        # the job is still allowed to be run
-        tempargs = args.copy()        
-        tempargs.append(sched_index[ind])
-        scheduler.add_job(function_to_run, 'cron',
-                          day_of_week=sched_day_code[ind], 
-                          hour=int(sched_time_hours[ind]), 
-                          minute=int(sched_time_minutes[ind]),
-                          second=int(sched_time_seconds[ind]),
-                          misfire_grace_time=120,
-                          id=(id_modifier+str(sched_index[ind])),
-                          args=tempargs)
-    scheduler.print_jobs()
-    scheduler.start()
-    scheduler.shutdown()
+    job_store = SQLAlchemyJobStore(url='sqlite:///%s' % sched_sql_loc)
+    # creates the job table if it does not exist
+    job_store.start(scheduler, 'default')
+    return scheduler, job_store
+
+
+def create_jobs(scheduler, function_to_run, job_specs, id_modifier,
+                job_type):
+    """
+    Construct the apscheduler cron jobs from the job specification. The
+        executor, jitter and job defaults are taken from config.
+
+    :param scheduler: scheduler that the jobs belong to
+    :type scheduler: apscheduler scheduler
+
+    :param function_to_run: The function that is being scheduled
+    :type function_to_run: function
+
+    :param job_specs: data frame with the columns id, day_of_week, hour,
+        minute, second and args
+    :type job_specs: pandas data frame
+
+    :param id_modifier: string that will be added to the id of each job
+    :type id_modifier: string
+
+    :param job_type: type of the job, a key of config.job_type_executor
+    :type job_type: string
+
+    :return jobs: dictionary of the jobs with the job id as the key
+    :rtype: dictionary
+    """
+    now = dt.datetime.now(scheduler.timezone)
+    jobs = {}
+    for spec in job_specs.itertuples(index=False):
+        trigger = CronTrigger(day_of_week=spec.day_of_week,
+                              hour=int(spec.hour), minute=int(spec.minute),
+                              second=int(spec.second),
+                              timezone=scheduler.timezone,
+                              jitter=config.job_jitter[job_type] or None)
+        job_id = id_modifier + spec.id
+        jobs[job_id] = Job(scheduler, id=job_id, func=function_to_run,
+                           trigger=trigger,
+                           executor=config.job_type_executor[job_type],
+                           args=spec.args, kwargs={},
+                           misfire_grace_time=config.job_misfire_grace_time,
+                           coalesce=config.job_coalesce,
+                           max_instances=config.job_max_instances,
+                           next_run_time=trigger.get_next_fire_time(None,
+                                                                    now))
+    return jobs
+
+
+def job_signature(job):
+    """
+    Construct a signature of a job that does not depend on the next run time.
+        Two jobs with the same signature run the same function, with the same
+        arguments, at the same time.
+
+    :param job: apscheduler job
+    :type job: Job
+
+    :return signature: the signature of the job
+    :rtype: bytes
+    """
+    return pickle.dumps((job.func_ref, repr(job.trigger), job.args,
+                         job.kwargs, job.executor, job.misfire_grace_time,
+                         job.coalesce, job.max_instances))
+
+
+def diff_jobs(existing_jobs, new_jobs, id_modifier):
+    """
+    Compare the jobs that are in the job store to the new jobs. Only the
+        existing jobs whose id is id_modifier followed by the index are
+        compared, so the jobs of the other agencies (sr_ and sr_BA_) are not
+        touched.
+
+    :param existing_jobs: jobs in the job store
+    :type existing_jobs: list of Job
+
+    :param new_jobs: dictionary of the new jobs with the job id as the key
+    :type new_jobs: dictionary
+
+    :param id_modifier: prefix of the job ids that are compared
+    :type id_modifier: string
+
+    :return job_diff: ids of the jobs that are added, modified, unchanged
+        and removed
+    :rtype: dictionary
+    """
+    existing_jobs = {job.id: job for job in existing_jobs
+                     if job.id.startswith(id_modifier) and
+                     job.id[len(id_modifier):].isdigit()}
+    job_diff = {'add': [], 'modify': [], 'unchanged': [], 'remove': []}
+    for (job_id, job) in new_jobs.items():
+        if job_id not in existing_jobs:
+            job_diff['add'].append(job_id)
+        elif job_signature(existing_jobs[job_id]) != job_signature(job):
+            job_diff['modify'].append(job_id)
+        else:
+            job_diff['unchanged'].append(job_id)
+    job_diff['remove'] = [job_id for job_id in existing_jobs
+                          if job_id not in new_jobs]
+    return job_diff
+
+
+def job_rows(job_store, jobs):
+    """
+    Construct the rows of the apscheduler job table
+
+    :param job_store: the sql job store
+    :type job_store: SQLAlchemyJobStore
+
+    :param jobs: jobs to convert to rows
+    :type jobs: list of Job
+
+    :return rows: a list of dictionaries, one dictionary for each row
+    :rtype: list of dictionaries
+    """
+    return [{'id': job.id,
+             'next_run_time': datetime_to_utc_timestamp(job.next_run_time),
+             'job_state': pickle.dumps(job.__getstate__(),
+                                       job_store.pickle_protocol)}
+            for job in jobs]
+
+
+def reconcile_jobs(sched_sql_loc, function_to_run, job_specs, id_modifier,
+                   job_type, dry_run=False):
+    """
+    Reconcile the jobs in the job database with the job specification. The
+        jobs are compared by id and only the jobs that were added, modified
+        or removed are written, in a single transaction. Unchanged jobs keep
+        their state (next run time). Only jobs whose id starts with
+        id_modifier are touched so the traffic, siri and gtfs-rt jobs can be
+        reconciled independently. It is safe to run while collect_data is
+        running because the scheduler rereads the job database.
+
+    :param sched_sql_loc: location of the sql job database
+    :type sched_sql_loc: string
+
+    :param function_to_run: The function that is being scheduled
+    :type function_to_run: function
+
+    :param job_specs: data frame with the columns id, day_of_week, hour,
+        minute, second and args
+    :type job_specs: pandas data frame
+
+    :param id_modifier: string that will be added to the id of each job
+    :type id_modifier: string
+
+    :param job_type: type of the job, a key of config.job_type_executor
+    :type job_type: string
+
+    :param dry_run: if True, only report the difference to the existing jobs
+        and do not modify the job database
+    :type dry_run: bool
+
+    :return job_diff: ids of the jobs that are added, modified, unchanged
+        and removed
+    :rtype: dictionary
+    """
+    (scheduler, job_store) = open_job_store(sched_sql_loc)
+    try:
+        new_jobs = create_jobs(scheduler, function_to_run, job_specs,
+                               id_modifier, job_type)
+        job_diff = reconcile_job_store(job_store, new_jobs, id_modifier,
+                                       dry_run)
+    finally:
+        job_store.shutdown()
+    return job_diff
+
+
+def reconcile_job_store(job_store, new_jobs, id_modifier, dry_run=False):
+    """
+    Compare the new jobs to the jobs in the open job store whose id starts
+        with id_modifier and write the difference
+
+    :param job_store: the sql job store
+    :type job_store: SQLAlchemyJobStore
+
+    :param new_jobs: dictionary of the new jobs with the job id as the key
+    :type new_jobs: dictionary
+
+    :param id_modifier: prefix of the job ids that are reconciled
+    :type id_modifier: string
+
+    :param dry_run: if True, only report the difference to the existing jobs
+        and do not modify the job database
+    :type dry_run: bool
+
+    :return job_diff: ids of the jobs that are added, modified, unchanged
+        and removed
+    :rtype: dictionary
+    """
+    job_diff = diff_jobs(job_store.get_all_jobs(), new_jobs, id_modifier)
+    log_job_diff(id_modifier, job_diff, dry_run)
+    if not dry_run:
+        apply_job_diff(job_store, new_jobs, job_diff)
+    return job_diff
+
+
+def adaptive_job_id(id_modifier):
+    """
+    Id of the job of the adaptive poller with the id_modifier. A poller has
+        a single job that collects all of the slots of its feed.
+
+    :param id_modifier: string that is added to the id of the job
+    :type id_modifier: string
+
+    :return job_id
+    :rtype: string
+    """
+    return id_modifier + '0'
+
+
+def add_adaptive_job(sched_sql_loc, function_to_run, trigger, id_modifier,
+                     args, dry_run=False):
+    """
+    Reconciles the job of an adaptive poller (adaptive_polling_functions)
+        with the job database. The poller replaces the periodic jobs with
+        the same id_modifier, so they are removed.
+
+    :param sched_sql_loc: location of the sql job database generated by
+        this program and used by the scheduler
+    :type sched_sql_loc: string
+
+    :param function_to_run: The function that is being scheduled
+    :type function_to_run: function
+
+    :param trigger: trigger that determines the next poll
+    :type trigger: ap.AdaptivePollTrigger
+
+    :param id_modifier: string that will be added to the id of the job
+    :type id_modifier: string
+
+    :param args: list of arguments that are used by function_to_run
+    :type args: list
+
+    :param dry_run: if True, only report the difference to the existing jobs
+        and do not modify the job database
+    :type dry_run: bool
+
+    :return job_diff: ids of the jobs that are added, modified, unchanged
+        and removed
+    :rtype: dictionary
+    """
+    (scheduler, job_store) = open_job_store(sched_sql_loc)
+    try:
+        now = dt.datetime.now(scheduler.timezone)
+        job_id = adaptive_job_id(id_modifier)
+        new_jobs = {job_id: Job(
+            scheduler, id=job_id, func=function_to_run, trigger=trigger,
+            executor=config.job_type_executor['transit'], args=args,
+            kwargs={}, misfire_grace_time=config.job_misfire_grace_time,
+            coalesce=config.job_coalesce,
+            max_instances=config.job_max_instances,
+            next_run_time=trigger.get_next_fire_time(None, now))}
+        job_diff = reconcile_job_store(job_store, new_jobs, id_modifier,
+                                       dry_run)
+    finally:
+        job_store.shutdown()
+    return job_diff
+
+
+def apply_job_diff(job_store, new_jobs, job_diff):
+    """
+    Write the difference between the new and existing jobs to the job store
+        in a single transaction.
+
+    :param job_store: the sql job store
+    :type job_store: SQLAlchemyJobStore
+
+    :param new_jobs: dictionary of the new jobs with the job id as the key
+    :type new_jobs: dictionary
+
+    :param job_diff: ids of the jobs that are added, modified, unchanged
+        and removed
+    :type job_diff: dictionary
+
+    :return None
+    """
+    jobs_t = job_store.jobs_t
+    with job_store.engine.begin() as connection:
+        if len(job_diff['remove']) > 0:
+            connection.execute(jobs_t.delete().where(
+                jobs_t.c.id.in_(job_diff['remove'])))
+        if len(job_diff['modify']) > 0:
+            # the row is replaced so the next run time is recalculated
+            connection.execute(jobs_t.delete().where(
+                jobs_t.c.id.in_(job_diff['modify'])))
+        rows = job_rows(job_store, [new_jobs[job_id] for job_id in
+                                    job_diff['add'] + job_diff['modify']])
+        if len(rows) > 0:
+            connection.execute(jobs_t.insert(), rows)
+    return None
+
+
+def log_job_diff(id_modifier, job_diff, dry_run):
+    """
+    Log a summary of the difference between the new and existing jobs
+
+    :param id_modifier: prefix of the job ids that were compared
+    :type id_modifier: string
+
+    :param job_diff: ids of the jobs that are added, modified, unchanged
+        and removed
+    :type job_diff: dictionary
+
+    :param dry_run: True if the job database was not modified
+    :type dry_run: bool
+
+    :return None
+    """
+    print_str = ('%s jobs%s: %d added, %d modified, %d unchanged, '
+                 '%d removed') % (id_modifier, ' (dry run)' if dry_run else '',
+                                  len(job_diff['add']),
+                                  len(job_diff['modify']),
+                                  len(job_diff['unchanged']),
+                                  len(job_diff['remove']))
+    print(print_str)
+    logging.info(print_str)
+    return None
 
 
 def create_collect_time(collect_time, collect_frequency, 
-                        collect_day_code, csv_file_loc):
+                        collect_day_code, artifact_loc):
     """
     This function constructs a data frame for when apscheduler to schedule
         a periodic job. It returns the data frame and store the data frame
-        in a csv file
+        in an artifact
     
     :param collect_time: time to collect data in hours
     :type collect_start_time: tuple of floats
@@ -175,8 +602,8 @@ def create_collect_time(collect_time, collect_frequency,
     :param collect_day_code: days of the week to collect the data
     :type collect_day_code: string
     
-    :param csv_file_loc: location for the csv file to store data frame
-    :type csv_file_loc: string
+    :param artifact_loc: location for the artifact to store data frame
+    :type artifact_loc: string
     
     :return df: data frame that was constructed by this function
     :type df: pandas data frame
@@ -196,5 +623,5 @@ def create_collect_time(collect_time, collect_frequency,
     d = {'day_code': collect_day_code, 'hours': sched_time_hours, 
          'minutes': sched_time_minutes, 'seconds': sched_time_seconds}
     df = pd.DataFrame(data=d)
-    df.to_csv(csv_file_loc)
+    af.save_artifact(df, artifact_loc)
     return df
@@ -0,0 +1,313 @@
+"""
+Description: This program load tests the collector by simulating a full
+    commute day in minutes. The jobs in the job database are copied, pointed
+    at the test sql databases and run by the dispatcher on a virtual clock
+    that runs simulation_speed times faster than real time. The google, 511
+    and pushover apis are replaced by the fake service. The misfires, sqlite
+    lock waits, queue depth and end to end latency of each job type are
+    reported and written to a json file in the benchmark directory.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import adaptive_polling_functions as ap
+import config
+import data_collection_functions as dcf
+import dispatcher_functions as disp
+import fake_service as fs
+import file_functions as ff
+import metrics_functions as mf
+import scheduler_functions as sched
+import sql_functions as sf
+
+# number of simulated seconds that pass in a real second
+simulation_speed = 60
+# local time and day of the week (0 is monday) that the simulation starts
+simulation_start_clock = dt.time(5, 0)
+simulation_weekday = 1
+# number of simulated hours, 19 hours take 19 minutes at a speed of 60
+simulation_hours = 19
+# the production databases in the job arguments are replaced by these
+simulation_db_map = {config.traffic_data_sql: config.test_traffic_data_sql}
+for agency in config.transit_agencies:
+    simulation_db_map[config.siri_data_sql_shards[agency]] = (
+        config.test_siri_data_sql_shards[agency])
+    simulation_db_map[config.gtfs_rt_data_sql_shards[agency]] = (
+        config.test_gtfs_rt_data_sql_shards[agency])
+
+
+def simulation_start_time(weekday, start_clock):
+    """
+    Determine the next date with the given day of the week at start_clock.
+        The local time of the computer is used, like the job triggers.
+
+    :param weekday: day of the week, 0 is monday
+    :type weekday: int
+
+    :param start_clock: local time that the simulation starts
+    :type start_clock: datetime.time
+
+    :return start time in utc
+    :rtype: datetime
+    """
+    today = dt.date.today()
+    start_date = today + dt.timedelta(days=(weekday - today.weekday()) % 7)
+    start_time = dt.datetime.combine(start_date, start_clock).astimezone()
+    return start_time.astimezone(dt.timezone.utc)
+
+
+def create_virtual_clock(start_time, speed):
+    """
+    Create a clock that starts at start_time and runs speed times faster
+        than real time
+
+    :param start_time: simulated time when the clock is created
+    :type start_time: datetime
+
+    :param speed: number of simulated seconds that pass in a real second
+    :type speed: float
+
+    :return virtual_now: function that returns the simulated time
+    :rtype: function
+    """
+    real_start = time.monotonic()
+
+    def virtual_now():
+        return start_time + dt.timedelta(
+            seconds=(time.monotonic() - real_start) * speed)
+    return virtual_now
+
+
+def prepare_simulation_jobs(sched_sql_loc, sim_sched_sql_loc, db_map):
+    """
+    Copy the job database and replace the production databases in the job
+        arguments so that the simulation does not write to them
+
+    :param sched_sql_loc: location of the sql job database
+    :type sched_sql_loc: string
+
+    :param sim_sched_sql_loc: location of the copy of the job database
+    :type sim_sched_sql_loc: string
+
+    :param db_map: dictionary with the production database as the key and
+        the simulation database as the value
+    :type db_map: dictionary
+
+    :return num_jobs: number of jobs in the simulation
+    :rtype: int
+    """
+    shutil.copyfile(sched_sql_loc, sim_sched_sql_loc)
+    (scheduler, job_store) = sched.open_job_store(sim_sched_sql_loc)
+    try:
+        jobs = job_store.get_all_jobs()
+        for job in jobs:
+            job.args = tuple(db_map[arg] if isinstance(arg, str) and
+                             arg in db_map else arg for arg in job.args)
+            job_store.update_job(job)
+    finally:
+        job_store.shutdown()
+    return len(jobs)
+
+
+def create_simulation_databases(db_map, monitor_db_loc, push_db_loc):
+    """
+    Create empty simulation databases. The databases from the previous
+        simulation are removed.
+
+    :param db_map: dictionary with the production database as the key and
+        the simulation database as the value
+    :type db_map: dictionary
+
+    :param monitor_db_loc: location of the process monitor database
+    :type monitor_db_loc: string
+
+    :param push_db_loc: location of the push notification database
+    :type push_db_loc: string
+
+    :return None
+    """
+    ff.remove_files(list(db_map.values()) + [monitor_db_loc, push_db_loc] +
+                    [partition for db_loc in db_map.values() for partition
+                     in sf.partition_locations(db_loc)])
+    sf.create_traffic_data_table(db_map[config.traffic_data_sql])
+    for agency in config.transit_agencies:
+        siri_data_sql = db_map[config.siri_data_sql_shards[agency]]
+        sf.create_transit_data_siri_table(config.siri_table_name,
+                                          siri_data_sql)
+        sf.create_periodic_task_monitor_table(siri_data_sql)
+        sf.create_transit_summary_table(siri_data_sql)
+        gtfs_rt_data_sql = db_map[config.gtfs_rt_data_sql_shards[agency]]
+        sf.create_transit_data_gtfs_rt_table(config.gfts_rt_table_name,
+                                             gtfs_rt_data_sql)
+        sf.create_periodic_task_monitor_table(gtfs_rt_data_sql)
+        sf.create_transit_summary_table(gtfs_rt_data_sql)
+    sf.create_process_monitor_table(monitor_db_loc)
+    sf.create_dispatch_misfire_table(monitor_db_loc)
+    sf.create_push_monitor_table(push_db_loc)
+    return None
+
+
+def run_simulation(sched_sql_loc, speed, hours):
+    """
+    Run the jobs in the job database against the fake service on a virtual
+        clock
+
+    :param sched_sql_loc: location of the sql job database
+    :type sched_sql_loc: string
+
+    :param speed: number of simulated seconds that pass in a real second
+    :type speed: float
+
+    :param hours: number of simulated hours
+    :type hours: float
+
+    :return report: dictionary with the results of the simulation
+    :rtype: dictionary
+    """
+    # the jobs write to the test databases and call the fake service
+    create_simulation_databases(simulation_db_map,
+                                config.test_process_monitor_sql,
+                                config.test_push_notification_sql)
+    num_jobs = prepare_simulation_jobs(sched_sql_loc, config.test_scheduler_sql,
+                                       simulation_db_map)
+    config.push_notification_sql = config.test_push_notification_sql
+    # the keys of the simulated trips are added to a copy of the dimension
+    # tables
+    if os.path.isfile(config.dimension_sql):
+        shutil.copyfile(config.dimension_sql, config.test_dimension_sql)
+    config.dimension_sql = config.test_dimension_sql
+    # the parse workers are started before the virtual clock
+    dcf.start_parse_pool()
+    # scale the latency so that it is realistic on the virtual clock
+    server = fs.start_fake_service(
+        port=0, latency_median_secs=fs.latency_median_secs / speed)
+    fs.use_fake_service(server)
+    start_time = simulation_start_time(simulation_weekday,
+                                       simulation_start_clock)
+    virtual_now = create_virtual_clock(start_time, speed)
+    # the adaptive pollers pick their slot and delay state on the same clock
+    ap.now_function = virtual_now
+    stop_event = threading.Event()
+    dispatcher = threading.Thread(
+        target=disp.run_dispatcher, name='dispatcher',
+        args=(config.test_scheduler_sql, config.test_process_monitor_sql,
+              config.executor_config, stop_event, virtual_now, speed))
+    real_start = time.perf_counter()
+    dispatcher.start()
+    stop_event.wait(hours * 3600 / speed)
+    stop_event.set()
+    # the dispatcher waits for the running jobs to finish
+    dispatcher.join()
+    dcf.shutdown_parse_pool()
+    real_secs = time.perf_counter() - real_start
+    server.shutdown()
+    return simulation_report(server, num_jobs, start_time, hours, speed,
+                             real_secs)
+
+
+def simulation_report(server, num_jobs, start_time, hours, speed, real_secs):
+    """
+    Collect the dispatcher, sqlite and fake service metrics of a simulation
+
+    :param server: the fake service used by the simulation
+    :type server: http.server.ThreadingHTTPServer
+
+    :param num_jobs: number of jobs in the simulation
+    :type num_jobs: int
+
+    :param start_time: simulated start time
+    :type start_time: datetime
+
+    :param hours: number of simulated hours
+    :type hours: float
+
+    :param speed: number of simulated seconds that pass in a real second
+    :type speed: float
+
+    :param real_secs: real seconds the simulation took
+    :type real_secs: float
+
+    :return report: dictionary with the results of the simulation
+    :rtype: dictionary
+    """
+    return {'start_time': start_time.astimezone().isoformat(),
+            'hours': hours,
+            'speed': speed,
+            'real_secs': real_secs,
+            'num_jobs': num_jobs,
+            'misfires': mf.counter_values('dispatch_misfires_total'),
+            'end_to_end_secs': mf.summarize_histogram(
+                'dispatch_end_to_end_seconds'),
+            'queue_depth': mf.summarize_histogram('dispatch_queue_depth'),
+            'lock_wait_secs': mf.summarize_histogram(
+                'sqlite_lock_wait_seconds'),
+            'stage_secs': mf.summarize_histogram('collection_stage_seconds'),
+            'retries': mf.counter_values('collection_retries_total'),
+            'retry_budget_exhausted': mf.counter_values(
+                'retry_budget_exhausted_total'),
+            'circuit_breaker_trips': mf.counter_values(
+                'circuit_breaker_trips_total'),
+            'circuit_breaker_rejections': mf.counter_values(
+                'circuit_breaker_rejections_total'),
+            'traffic_cache_requests': mf.counter_values(
+                'traffic_cache_requests_total'),
+            'traffic_model_requests': mf.counter_values(
+                'traffic_model_requests_total'),
+            'fake_service_requests': dict(server.request_counts),
+            'fake_service_errors': dict(server.error_counts)}
+
+
+def print_report(report):
+    """
+    Print a summary of the simulation report
+
+    :param report: dictionary with the results of the simulation
+    :type report: dictionary
+
+    :return None
+    """
+    print('Simulated %g hours from %s with %d jobs in %.0f s' % (
+        report['hours'], report['start_time'], report['num_jobs'],
+        report['real_secs']))
+    for (title, key) in [('End to end latency (simulated s)',
+                          'end_to_end_secs'),
+                         ('Queue depth', 'queue_depth'),
+                         ('Sqlite lock wait (s)', 'lock_wait_secs')]:
+        print(title)
+        for summary in report[key]:
+            print('  %-30s n=%-6d p50=%-10.3g p95=%-10.3g max=%.3g' % (
+                ','.join(summary['labels'].values()), summary['count'],
+                summary.get('p50', float('nan')),
+                summary.get('p95', float('nan')),
+                summary['max'] if summary['max'] is not None
+                else float('nan')))
+    print('Misfires')
+    for misfire in report['misfires']:
+        print('  %-30s %d' % (','.join(misfire['labels'].values()),
+                              misfire['value']))
+    return None
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    ff.create_directories([config.test_file_dir, config.siri_json_dir,
+                           config.gtfs_rt_json_dir, config.benchmark_dir])
+    report = run_simulation(config.scheduler_sql, simulation_speed,
+                            simulation_hours)
+    date_tag = dt.datetime.now().strftime("%Y-%b-%d_%H-%M-%S")
+    report_file = os.path.join(config.benchmark_dir,
+                               'simulation-%s.json' % date_tag)
+    with open(report_file, 'w') as outfile:
+        json.dump(report, outfile, indent=2)
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,47 @@ Description: This file contains all sql_functions. This includes creating a
 """
 import sqlite3
 import datetime as dt
+import glob
+import os
+import stat
+import threading
+import time
+import urllib.parse
+
+import config
+import metrics_functions as mf
+
+# sqlite attaches at most 10 databases to a connection
+max_attached_partitions = 10
+# partitions are created by the job threads
+partition_lock = threading.Lock()
+# transit summary table, see create_transit_summary_table
+transit_summary_table_sql = """CREATE TABLE IF NOT EXISTS %s
+                      (train_start_date text, 
+                      trip_key integer, 
+                      stop_id integer, 
+                      first_recorded_utc integer, 
+                      last_recorded_utc integer, 
+                      first_departure_delay real, 
+                      last_departure_delay real, 
+                      max_departure_delay real, 
+                      last_arrival_delay real, 
+                      num_predictions integer, 
+                      PRIMARY KEY (train_start_date, trip_key, stop_id))
+                   """ % config.transit_summary_table_name
+# the times are stored as integer seconds since the epoch. The local date
+# and time of these columns are derived by the <table>_local views
+# (create_local_time_view).
+local_time_columns = {
+    'traffic_data': ('utc_time',),
+    'process_monitor': ('utc_time',),
+    'dispatch_misfire': ('utc_time',),
+    'periodic_task_monitor': ('utc_time',),
+    'push_monitor': ('utc_time',),
+    config.siri_table_name: ('recorded_at_time_utc', 'aimed_arrival_time_utc',
+                             'aimed_departure_time_utc'),
+    config.gfts_rt_table_name: ('recorded_at_time_utc',
+                                'aimed_departure_time_utc')}
 
 
 def create_connection(db_file, timeout=120, isolation_level=None):
@@ -22,6 +63,29 @@ def create_connection(db_file, timeout=120, isolation_level=None):
     return conn
 
 
+def begin_transaction(conn, db_location, mode):
+    """
+    Begin a write transaction and record the time spent waiting for the
+        database lock in the sqlite_lock_wait_seconds histogram
+    
+    :param conn: connection to the database
+    :type conn: sqlite3.Connection
+    
+    :param db_location: location of the database file, used as the label
+    :type db_location: string
+    
+    :param mode: IMMEDIATE or EXCLUSIVE
+    :type mode: string
+    
+    :return None
+    """
+    start_time = time.perf_counter()
+    conn.execute('BEGIN ' + mode)
+    mf.observe('sqlite_lock_wait_seconds', time.perf_counter() - start_time,
+               {'db': os.path.basename(db_location)})
+    return None
+
+
 def create_table(db_location, table_statement):
     """
     Create a table in the database
@@ -63,6 +127,7 @@ def insert_data(db_location, sql_cmd, data):
     conn = None
     try:
         conn = create_connection(db_location)
+        begin_transaction(conn, db_location, 'IMMEDIATE')
         cursor = conn.cursor()
         cursor.execute(sql_cmd, data)
         conn.commit()
@@ -71,6 +136,33 @@ def insert_data(db_location, sql_cmd, data):
             conn.close()  
 
 
+def insert_many_data(db_location, sql_cmd, data):
+    """
+    Insert several rows into a table in a single transaction
+    
+    :param db_location: location of the database file
+    :type db_location: string    
+    
+    :param sql_cmd: sql command to write a row into the table
+    :type sql_cmd: string
+    
+    :param data: rows to be inserted into the table
+    :type data: list of tuples
+    
+    :return None
+    """   
+    conn = None
+    try:
+        conn = create_connection(db_location)
+        begin_transaction(conn, db_location, 'IMMEDIATE')
+        cursor = conn.cursor()
+        cursor.executemany(sql_cmd, data)
+        conn.commit()
+    finally:
+        if conn:
+            conn.close()  
+
+
 def query_data(db_location, sql_cmd):
     """
     Insert data into a table
@@ -93,10 +185,88 @@ def query_data(db_location, sql_cmd):
         if conn:
             conn.close() 
 
+
+
+def local_date_sql(column):
+    """
+    Construct the sql expression of the local date of an epoch column. The
+        local time zone of the computer is used, like the collection jobs.
+
+    :param column: name of the column with the seconds since the epoch
+    :type column: string
+
+    :return sql expression of the iso format date
+    :rtype: string
+    """
+    return "date(%s, 'unixepoch', 'localtime')" % column
+
+
+def local_time_sql(column):
+    """
+    Construct the sql expression of the local time of an epoch column
+
+    :param column: name of the column with the seconds since the epoch
+    :type column: string
+
+    :return sql expression of the time (hours:minutes:seconds)
+    :rtype: string
+    """
+    return "time(%s, 'unixepoch', 'localtime')" % column
+
+
+def local_time_names(column):
+    """
+    Names of the local date and time columns of an epoch column, the names
+        of the columns that were stored before the times were stored as
+        epochs (utc_time -> date, time and recorded_at_time_utc ->
+        recorded_at_time_date, recorded_at_time_time)
+
+    :param column: name of the column with the seconds since the epoch
+    :type column: string
+
+    :return date_name: name of the date column
+    :rtype: string
+
+    :return time_name: name of the time column
+    :rtype: string
+    """
+    if column == 'utc_time':
+        return 'date', 'time'
+    prefix = column[:-len('utc')]
+    return prefix + 'date', prefix + 'time'
+
+
+def create_local_time_view(db_location, table_name):
+    """
+    Create the view <table_name>_local if it does not exist. It has the
+        columns of the table and the local date and time of each of its
+        epoch columns (local_time_columns).
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param table_name: name of the table
+    :type table_name: string
+
+    :return None
+    """
+    derived = []
+    for column in local_time_columns[table_name]:
+        (date_name, time_name) = local_time_names(column)
+        derived.append('%s AS %s' % (local_date_sql(column), date_name))
+        derived.append('%s AS %s' % (local_time_sql(column), time_name))
+    sql_cmd = 'CREATE VIEW IF NOT EXISTS %s_local AS SELECT %s, * FROM %s' % (
+        table_name, ', '.join(derived), table_name)
+    create_table(db_location, sql_cmd)
+    return None
+
         
 def create_traffic_data_table(db_location): 
     """
-    Create the traffic data table
+    Create the traffic data table. from_cache is 1 if the duration was
+        taken from the traffic cache of another trip between the same
+        stations and from_model is 1 if it was predicted by the traffic
+        model (traffic_model_functions) instead of querying google.
 
     :param db_location: location of the database file
     :type db_location: string  
@@ -105,41 +275,44 @@ def create_traffic_data_table(db_location):
     """
     # create a table
     sql = """CREATE TABLE traffic_data
-                      (date text, time text, utc_time real, 
+                      (utc_time integer, 
                        day_of_week integer, trip_index integer, 
-                       trip_id integer, start_station text, end_station text, 
-                       start_loc text, end_loc text, directions_result text, 
-                       duration_in_traffic real) 
+                       trip_key integer, pair_key integer, 
+                       directions_result text, duration_in_traffic real,
+                       from_cache integer, from_model integer) 
                    """
     create_table(db_location, sql)
+    create_local_time_view(db_location, 'traffic_data')
     return None
 
 
 def insert_traffic_data(db_location, data):
     """
-    Insert the traffic data into the database
+    Insert the traffic data into the partition of its date
     
     :param db_location: location of the database file
     :type db_location: string  
     
-    :param data: data tuple to be inserted into the database
+    :param data: data tuple to be inserted into the database, the utc_time
+        is the first entry. The trip and the stations are stored as the keys
+        of the dimension tables (create_dimension_tables).
     :type data: tuple    
     
     :return None
     """
  
-    sql = """ INSERT INTO traffic_data(date, time, utc_time, day_of_week, 
-                                    trip_index, trip_id, start_station, 
-                                    end_station, start_loc, end_loc, 
-                                    directions_result, duration_in_traffic) 
-              VALUES(?,?,?,?,?,?,?,?,?,?,?,?) """
-    insert_data(db_location, sql, data)
+    sql = """ INSERT INTO traffic_data(utc_time, day_of_week, 
+                                    trip_index, trip_key, pair_key, 
+                                    directions_result, duration_in_traffic,
+                                    from_cache, from_model) 
+              VALUES(?,?,?,?,?,?,?,?,?) """
+    insert_partitioned_data(db_location, sql, data, data[0])
     return None
     
 
 def create_process_monitor_table(db_location):
     """
-    Create the process monitor table
+    Create the process monitor table if it does not exist
 
     :param db_location: location of the database file
     :type db_location: string  
@@ -147,12 +320,13 @@ def create_process_monitor_table(db_location):
     :return None
     """
     # create a table
-    sql_cmd = """CREATE TABLE process_monitor
-                      (date text, time text, utc_time real, 
+    sql_cmd = """CREATE TABLE IF NOT EXISTS process_monitor
+                      (utc_time integer, 
                       day_of_week integer, push_notify integer, 
                       log_name string) 
                    """
     create_table(db_location, sql_cmd)
+    create_local_time_view(db_location, 'process_monitor')
     return None
 
 
@@ -169,13 +343,303 @@ def insert_process_monitor(db_location, data):
     :return None
     """
  
-    sql = """ INSERT INTO process_monitor(date, time, utc_time, day_of_week, 
+    sql = """ INSERT INTO process_monitor(utc_time, day_of_week, 
                                     push_notify, log_name) 
-              VALUES(?,?,?,?,?,?) """
+              VALUES(?,?,?,?) """
     insert_data(db_location, sql, data)
     return None
  
 
+def create_dispatch_misfire_table(db_location):
+    """
+    Create the dispatch misfire table if it does not exist
+
+    :param db_location: location of the database file
+    :type db_location: string  
+
+    :return None
+    """
+    # create a table
+    sql_cmd = """CREATE TABLE IF NOT EXISTS dispatch_misfire
+                      (utc_time integer, 
+                      day_of_week integer, job_id text, 
+                      scheduled_utc_time integer, lag_secs real, reason text) 
+                   """
+    create_table(db_location, sql_cmd)
+    create_local_time_view(db_location, 'dispatch_misfire')
+    return None
+
+
+def insert_dispatch_misfire(db_location, data):
+    """
+    Insert the dispatch misfire data into the database
+    
+    :param db_location: location of the database file
+    :type db_location: string  
+    
+    :param data: data tuple to be inserted into the database
+    :type data: tuple    
+    
+    :return None
+    """
+    sql = """ INSERT INTO dispatch_misfire(utc_time, day_of_week, 
+                                    job_id, scheduled_utc_time, lag_secs,
+                                    reason) 
+              VALUES(?,?,?,?,?,?) """
+    insert_data(db_location, sql, data)
+    return None
+
+
+def create_utc_time_index(db_location, table_name, column='utc_time'):
+    """
+    Create an index on the utc_time column of a table if it does not exist
+
+    :param db_location: location of the database file
+    :type db_location: string  
+
+    :param table_name: name of the table
+    :type table_name: string
+
+    :param column: the time column, defaults to utc_time
+    :type column: string
+
+    :return None
+    """
+    sql_cmd = """CREATE INDEX IF NOT EXISTS %s_%s_idx 
+                     ON %s (%s)""" % (table_name, column, table_name, column)
+    create_table(db_location, sql_cmd)
+    return None
+
+
+def create_completeness_tables(db_location):
+    """
+    Create the tables that store the state of the completeness check if they
+        do not exist. completeness_state stores how far each source has been
+        scanned and checked. completeness_observed stores the slots (trip 
+        index or time index) that were observed on each date.
+
+    :param db_location: location of the database file
+    :type db_location: string  
+
+    :return None
+    """
+    sql_cmd = """CREATE TABLE IF NOT EXISTS completeness_state
+                      (source text PRIMARY KEY, scanned_utc_time real, 
+                      checked_utc_time real) 
+                   """
+    create_table(db_location, sql_cmd)
+    sql_cmd = """CREATE TABLE IF NOT EXISTS completeness_observed
+                      (source text, date text, slot integer, 
+                      PRIMARY KEY (source, date, slot)) 
+                   """
+    create_table(db_location, sql_cmd)
+    return None
+
+
+def insert_completeness_observed(db_location, data):
+    """
+    Insert the observed slots. Slots that were already observed are ignored.
+    
+    :param db_location: location of the database file
+    :type db_location: string  
+    
+    :param data: list of (source, date, slot) tuples
+    :type data: list of tuples
+    
+    :return None
+    """
+    sql = """ INSERT OR IGNORE INTO completeness_observed(source, date, slot) 
+              VALUES(?,?,?) """
+    insert_many_data(db_location, sql, data)
+    return None
+
+
+def update_completeness_state(db_location, data):
+    """
+    Store how far a source has been scanned and checked
+    
+    :param db_location: location of the database file
+    :type db_location: string  
+    
+    :param data: (source, scanned_utc_time, checked_utc_time) tuple
+    :type data: tuple    
+    
+    :return None
+    """
+    sql = """ INSERT OR REPLACE INTO completeness_state(source, 
+                                    scanned_utc_time, checked_utc_time) 
+              VALUES(?,?,?) """
+    insert_data(db_location, sql, data)
+    return None
+
+
+def create_gap_index_table(db_location):
+    """
+    Create the gap index table if it does not exist. Each row stores bitmaps
+        of the expected and observed slots of a source on a date.
+
+    :param db_location: location of the database file
+    :type db_location: string  
+
+    :return None
+    """
+    sql_cmd = """CREATE TABLE IF NOT EXISTS gap_index
+                      (source text, date text, expected_bitmap blob, 
+                      observed_bitmap blob, expected_num integer, 
+                      observed_num integer, missing_num integer, 
+                      PRIMARY KEY (source, date)) 
+                   """
+    create_table(db_location, sql_cmd)
+    return None
+
+
+def insert_gap_index(db_location, data):
+    """
+    Insert or replace the gap index of several dates
+    
+    :param db_location: location of the database file
+    :type db_location: string  
+    
+    :param data: list of (source, date, expected_bitmap, observed_bitmap,
+        expected_num, observed_num, missing_num) tuples
+    :type data: list of tuples
+    
+    :return None
+    """
+    sql = """ INSERT OR REPLACE INTO gap_index(source, date, expected_bitmap,
+                                    observed_bitmap, expected_num, 
+                                    observed_num, missing_num) 
+              VALUES(?,?,?,?,?,?,?) """
+    insert_many_data(db_location, sql, data)
+    return None
+
+
+def create_dimension_tables(db_location):
+    """
+    Create the dimension tables if they do not exist. The stations of every
+        agency (with the mean location of their platforms), the stops of each
+        station, the trips and the start and end station of the traffic
+        trips get a small integer key that the data tables store instead of
+        the names.
+
+    :param db_location: location of the database file
+    :type db_location: string  
+
+    :return None
+    """
+    sql_cmd = """CREATE TABLE IF NOT EXISTS stations
+                      (station_key INTEGER PRIMARY KEY, agency text, 
+                      short_stop_name text, stop_lat real, stop_lon real, 
+                      UNIQUE (agency, short_stop_name)) 
+                   """
+    create_table(db_location, sql_cmd)
+    sql_cmd = """CREATE TABLE IF NOT EXISTS stops
+                      (agency text, stop_id integer, stop_name text, 
+                      station_key integer, PRIMARY KEY (agency, stop_id)) 
+                   """
+    create_table(db_location, sql_cmd)
+    sql_cmd = """CREATE TABLE IF NOT EXISTS trips
+                      (trip_key INTEGER PRIMARY KEY, agency text, 
+                      trip_id text, UNIQUE (agency, trip_id)) 
+                   """
+    create_table(db_location, sql_cmd)
+    sql_cmd = """CREATE TABLE IF NOT EXISTS station_pairs
+                      (pair_key INTEGER PRIMARY KEY, 
+                      start_station_key integer, end_station_key integer, 
+                      UNIQUE (start_station_key, end_station_key)) 
+                   """
+    create_table(db_location, sql_cmd)
+    return None
+
+
+def insert_stations(db_location, data):
+    """
+    Insert the stations. The location of a station that already exists is
+        updated, its key does not change.
+    
+    :param db_location: location of the database file
+    :type db_location: string  
+    
+    :param data: list of (agency, short_stop_name, stop_lat, stop_lon) tuples
+    :type data: list of tuples
+    
+    :return None
+    """
+    sql = """ INSERT INTO stations(agency, short_stop_name, stop_lat, 
+                                    stop_lon) 
+              VALUES(?,?,?,?) 
+              ON CONFLICT (agency, short_stop_name) DO UPDATE SET
+                  stop_lat = coalesce(excluded.stop_lat, stop_lat),
+                  stop_lon = coalesce(excluded.stop_lon, stop_lon) """
+    insert_many_data(db_location, sql, data)
+    return None
+
+
+def insert_stops(db_location, data):
+    """
+    Insert or replace the stops. The stations of the stops must exist.
+    
+    :param db_location: location of the database file
+    :type db_location: string  
+    
+    :param data: list of (agency, stop_id, stop_name, short_stop_name) tuples
+    :type data: list of tuples
+    
+    :return None
+    """
+    sql = """ INSERT OR REPLACE INTO stops(agency, stop_id, stop_name, 
+                                    station_key) 
+              SELECT ?, ?, ?, station_key FROM stations 
+              WHERE agency = ? AND short_stop_name = ? """
+    insert_many_data(db_location, sql, [
+        (agency, stop_id, stop_name, agency, short_stop_name)
+        for (agency, stop_id, stop_name, short_stop_name) in data])
+    return None
+
+
+def insert_trips(db_location, data):
+    """
+    Insert the trips. Trips that already exist are ignored.
+    
+    :param db_location: location of the database file
+    :type db_location: string  
+    
+    :param data: list of (agency, trip_id) tuples
+    :type data: list of tuples
+    
+    :return None
+    """
+    sql = """ INSERT OR IGNORE INTO trips(agency, trip_id) VALUES(?,?) """
+    insert_many_data(db_location, sql, data)
+    return None
+
+
+def insert_station_pairs(db_location, data):
+    """
+    Insert the station pairs. Pairs that already exist are ignored. The
+        stations must exist.
+    
+    :param db_location: location of the database file
+    :type db_location: string  
+    
+    :param data: list of (agency, start short_stop_name, end
+        short_stop_name) tuples
+    :type data: list of tuples
+    
+    :return None
+    """
+    sql = """ INSERT OR IGNORE INTO station_pairs(start_station_key, 
+                                    end_station_key) 
+              SELECT s.station_key, e.station_key 
+              FROM stations AS s, stations AS e 
+              WHERE s.agency = ? AND s.short_stop_name = ? 
+                  AND e.agency = ? AND e.short_stop_name = ? """
+    insert_many_data(db_location, sql, [
+        (agency, start_station, agency, end_station)
+        for (agency, start_station, end_station) in data])
+    return None
+
+
 def create_periodic_task_monitor_table(db_location): 
     """
     Create a periodic task monitor table
@@ -187,16 +651,17 @@ def create_periodic_task_monitor_table(db_location):
     """
     # create a table
     sql = """CREATE TABLE periodic_task_monitor
-                      (date text, time text, utc_time real, 
+                      (utc_time integer, 
                       day_of_week integer, time_index int) 
                    """
     create_table(db_location, sql)
+    create_local_time_view(db_location, 'periodic_task_monitor')
     return None
 
 
 def insert_periodic_task_monitor(db_location, time_index):
     """
-    Insert the process monitor data into the database
+    Insert the process monitor data into the partition of today
     
     :param db_location: location of the database file
     :type db_location: string  
@@ -207,16 +672,15 @@ def insert_periodic_task_monitor(db_location, time_index):
     :return None
     """
     # create the time objects to save the results
-    date_str = dt.datetime.now().date().isoformat()
-    time_str = dt.datetime.now().time().isoformat()
-    day_of_week = dt.datetime.now().isoweekday()
-    utc_time_now = dt.datetime.utcnow().timestamp()
-    task_monitor_data = (str(date_str), str(time_str), float(utc_time_now),
-                         int(day_of_week), int(time_index))
-    sql = """ INSERT INTO periodic_task_monitor(date, time, utc_time, 
-                                    day_of_week, time_index)
-              VALUES(?,?,?,?,?) """
-    insert_data(db_location, sql, task_monitor_data)
+    now = dt.datetime.now()
+    utc_time_now = int(now.timestamp())
+    task_monitor_data = (utc_time_now, int(now.isoweekday()),
+                         int(time_index))
+    sql = """ INSERT INTO periodic_task_monitor(utc_time, day_of_week, 
+                                    time_index)
+              VALUES(?,?,?) """
+    insert_partitioned_data(db_location, sql, task_monitor_data,
+                            utc_time_now)
     return None
  
 
@@ -231,11 +695,12 @@ def create_push_monitor_table(db_location):
     """
     # create a table
     sql_cmd = """CREATE TABLE push_monitor
-                      (date text, time text, utc_time real, 
+                      (utc_time integer, 
                       day_of_week integer, push_notify integer, 
                       push_name text) 
                    """
     create_table(db_location, sql_cmd)
+    create_local_time_view(db_location, 'push_monitor')
     return None
 
 
@@ -252,9 +717,9 @@ def insert_push_monitor(db_location, data):
     :return None
     """
  
-    sql = """ INSERT INTO push_monitor(date, time, utc_time, day_of_week, 
+    sql = """ INSERT INTO push_monitor(utc_time, day_of_week, 
                                     push_notify, push_name) 
-              VALUES(?,?,?,?,?,?) """
+              VALUES(?,?,?,?) """
     insert_data(db_location, sql, data)
     return None    
    
@@ -304,7 +769,9 @@ def insert_results(db_location, data):
 
 def create_transit_data_siri_table(name, db_location): 
     """
-    Create the siri transit data table
+    Create the siri transit data table. The trip is stored as its key in
+        the dimension tables and the station names are found from the stop
+        id (create_dimension_tables).
 
     :param name: name of the table
     :type string
@@ -317,32 +784,25 @@ def create_transit_data_siri_table(name, db_location):
     # create a table
     sql_cmd = """CREATE TABLE %s
                       (train_start_date text,
-                      trip_id text, 
+                      trip_key integer, 
                       stop_id integer,
                       time_index int, 
-                      recorded_at_time_date text, 
-                      recorded_at_time_time text, 
-                      recorded_at_time_utc real, 
-                      station_name text, 
-                      short_stop_name text,  
+                      recorded_at_time_utc integer, 
                       vehicle_at_stop text, 
-                      aimed_arrival_time_date text, 
-                      aimed_arrival_time_time text, 
-                      aimed_arrival_time_utc real, 
-                      aimed_arrival_time_seconds real, 
+                      aimed_arrival_time_utc integer, 
+                      aimed_arrival_time_seconds integer, 
                       scheduled_arrival_time_seconds real, 
                       arrival_on_time int, 
                       arrival_delay real, 
-                      aimed_departure_time_date text,
-                      aimed_departure_time_time text, 
-                      aimed_departure_time_utc real,
-                      aimed_departure_time_seconds real, 
+                      aimed_departure_time_utc integer,
+                      aimed_departure_time_seconds integer, 
                       scheduled_departure_time_seconds real,
                       departure_on_time int, 
                       departure_delay real
                       ) 
                    """ % name
     create_table(db_location, sql_cmd)
+    create_local_time_view(db_location, name)
     return None
 
 
@@ -362,16 +822,11 @@ def create_transit_data_gtfs_rt_table(name, db_location):
     sql_cmd = """CREATE TABLE %s
                       (train_start_date text,
                       time_index int, 
-                      recorded_at_time_date text, 
-                      recorded_at_time_time text, 
-                      recorded_at_time_utc real, 
+                      recorded_at_time_utc integer, 
                       stop_id int, 
-                      short_stop_name text,
-                      trip_id text, 
-                      aimed_departure_time_date text, 
-                      aimed_departure_time_time text, 
-                      aimed_departure_time_utc real,
-                      aimed_departure_time_seconds real,
+                      trip_key integer, 
+                      aimed_departure_time_utc integer,
+                      aimed_departure_time_seconds integer,
                       scheduled_arrival_time_seconds real,
                       scheduled_departure_time_seconds real,
                       departure_on_time int, 
@@ -380,9 +835,66 @@ def create_transit_data_gtfs_rt_table(name, db_location):
                    """ % name
                    
     create_table(db_location, sql_cmd)
+    # the new predictions are read by recorded_at_time_utc
+    # (decision_functions)
+    create_utc_time_index(db_location, name, 'recorded_at_time_utc')
+    create_local_time_view(db_location, name)
+    return None
+
+
+def create_transit_summary_table(db_location):
+    """
+    Create the transit summary table if it does not exist. It has one row
+        for each train and stop with the first and last prediction, the
+        maximum delay and the final delay.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :return None
+    """
+    create_table(db_location, transit_summary_table_sql)
     return None
 
 
+def transit_summary_sql(table_base, columns):
+    """
+    Construct the sql command that adds the transit rows in table_base to
+        the transit summary
+
+    :param table_base: name of the table with the new transit rows
+    :type table_base: string
+
+    :param columns: columns of table_base
+    :type columns: list of strings
+
+    :return sql command
+    :rtype: string
+    """
+    arrival_delay = 'arrival_delay' if 'arrival_delay' in columns else 'NULL'
+    # where true is needed to parse the upsert after a select
+    return """INSERT INTO %s (train_start_date, trip_key, stop_id, 
+                  first_recorded_utc, last_recorded_utc, 
+                  first_departure_delay, last_departure_delay, 
+                  max_departure_delay, last_arrival_delay, num_predictions)
+              SELECT train_start_date, trip_key, stop_id, 
+                  recorded_at_time_utc, recorded_at_time_utc, 
+                  departure_delay, departure_delay, departure_delay, %s, 1
+              FROM %s WHERE true
+              ON CONFLICT (train_start_date, trip_key, stop_id) DO UPDATE SET
+                  last_recorded_utc = excluded.last_recorded_utc,
+                  last_departure_delay = excluded.last_departure_delay,
+                  max_departure_delay = max(
+                      coalesce(max_departure_delay, 
+                               excluded.max_departure_delay),
+                      coalesce(excluded.max_departure_delay, 
+                               max_departure_delay)),
+                  last_arrival_delay = excluded.last_arrival_delay,
+                  num_predictions = num_predictions + 1
+           """ % (config.transit_summary_table_name, arrival_delay,
+                  table_base)
+
+
 def where_statement_common_entries(table_modified, table_base, 
                                    columns_to_compare):
     """
@@ -496,7 +1008,23 @@ def sql_delete_table_if_exists(table_name):
     return sql_query
 
 
-def update_entries(db_location, table_modified, data, columns_to_compare):
+def sql_rows(data):
+    """
+    Convert the rows of a data frame to tuples of python values that sqlite
+        can store, the missing values are stored as null
+
+    :param data: pandas data frame
+    :type data: pandas data frame
+
+    :return rows
+    :rtype: iterator of tuples
+    """
+    return data.astype(object).where(data.notna(), None).itertuples(
+        index=False, name=None)
+
+
+def update_entries(db_location, table_modified, data, columns_to_compare,
+                   summarize=False, table=None):
     """
     Create a table in the database
     
@@ -513,17 +1041,34 @@ def update_entries(db_location, table_modified, data, columns_to_compare):
         if an entry needs to be updated
     :type list
     
+    :param summarize: if True, the transit summary is updated with the new
+        transit rows in the same transaction
+    :type summarize: bool
+
+    :param table: compiled table definition from table_def whose columns
+        data has (prepare_pandas_to_sql), its insert statement is used
+    :type table: dictionary
     
     :return None
     """ 
+    # the temporary table only exists in the connection, so the writers of
+    # the same database do not share it
     temp_table_name = table_modified + '_temp'
+    if table is None:
+        insert_cmd = 'INSERT INTO %%s (%s) VALUES (%s)' % (
+            ', '.join(data.columns), ','.join('?' * len(data.columns)))
+    else:
+        insert_cmd = table['insert']
     conn = None
     try:
         # create an exclusive connection, no other process can read/write
         conn = create_connection(db_location, isolation_level='EXCLUSIVE')
+        begin_transaction(conn, db_location, 'EXCLUSIVE')
         cursor = conn.cursor()
-        # copy the data to a temporary table
-        data.to_sql(temp_table_name, conn, index=False, if_exists='replace')
+        # copy the data to a temporary table with the columns of the table
+        cursor.execute('CREATE TEMP TABLE %s AS SELECT * FROM main.%s WHERE 0'
+                       % (temp_table_name, table_modified))
+        cursor.executemany(insert_cmd % temp_table_name, sql_rows(data))
         # delete entries in the original table that will be replaced
         sql_cmd = delete_entries_in_common(table_modified, temp_table_name, 
                                            columns_to_compare)
@@ -532,6 +1077,10 @@ def update_entries(db_location, table_modified, data, columns_to_compare):
         sql_cmd = copy_new_entries(table_modified, temp_table_name,
                                    columns_to_compare)
         cursor.execute(sql_cmd)
+        if summarize:
+            cursor.execute(transit_summary_table_sql)
+            cursor.execute(transit_summary_sql(temp_table_name,
+                                               list(data.columns)))
         # delete temp table
         sql_cmd = sql_delete_table(temp_table_name)
         cursor.execute(sql_cmd)
@@ -563,9 +1112,9 @@ def create_table_def_string(input_dict):
     return ret_str
 
 
-def create_table_from_dict(db_location, table_name, table_dict):
+def create_table_from_dict(db_location, table_name, table):
     """
-    This creates a table from the table_dict
+    This creates a table from the compiled table definition
     
     :param db_location: location of the database file
     :type db_location: string  
@@ -573,39 +1122,488 @@ def create_table_from_dict(db_location, table_name, table_dict):
     :param table_name: the name of the table
     :type string
     
-    :param table_dict: a dictionary that contains the table definition
-        information
-    :type table_dict: dictionary
+    :param table: compiled table definition from table_def, for example
+        table_def.siri_table
+    :type table: dictionary
     
     :return None
     """
-    table_def_string = create_table_def_string(table_dict)
-    sql_cmd = """CREATE TABLE %s (%s)""" % (table_name, table_def_string)
-    create_table(db_location, sql_cmd)
+    create_table(db_location, table['ddl'] % table_name)
     return None
 
 
-def prepare_pandas_to_sql(df, table_dict):
+def prepare_pandas_to_sql(df, table):
     """
     Prepare the pandas data frame to upload into data frame. Orders the columns
-    so that they are the same order of the sql database and fill missing
-    columns with NaNs.
+    so that they are the same order of the sql database, fill missing
+    columns with NaNs and convert the columns to the compiled dtypes.
     
     :param df: pandas data frame that will be modified
     :type df: pandas data frame
     
-    :param table_dict: dictionary that contains the table definition
-    :type table_dict: dictionary
+    :param table: compiled table definition from table_def, for example
+        table_def.siri_table
+    :type table: dictionary
     
     return: out_df: output pandas data frame
     :type out_df: pandas data frame
     """
-    
-    # creates the list to reindex the data frame
-    ordered_list = []
-    for key in range(len(table_dict)):
-        ordered_list.append(table_dict[key]['pandas_name'])
     # changes the order of the index, by default empty values = NaN
-    out_df = df.reindex(columns=ordered_list)
+    out_df = df.reindex(columns=table['columns']).astype(table['dtypes'])
     return out_df
 
+
+
+def partition_key(date):
+    """
+    Name of the partition that stores the rows of a date, for example
+        2018-01 for monthly partitions (config.sql_partition_format)
+
+    :param date: date of the rows or seconds since the epoch
+    :type date: date, iso format string or int
+
+    :return key
+    :rtype: string
+    """
+    if isinstance(date, str):
+        date = dt.date.fromisoformat(date[:10])
+    elif isinstance(date, (int, float)):
+        date = dt.date.fromtimestamp(date)
+    return date.strftime(config.sql_partition_format)
+
+
+def local_midnight_epoch(date):
+    """
+    Seconds since the epoch of the local midnight at the start of a date
+
+    :param date: date
+    :type date: date
+
+    :return seconds since the epoch
+    :rtype: int
+    """
+    return int(dt.datetime.combine(date, dt.time()).timestamp())
+
+
+def partition_file(db_location, key):
+    """
+    Location of a partition of a database. The partitions are stored next to
+        the database, for example traffic_data-2018-01.sqlite.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param key: name of the partition
+    :type key: string
+
+    :return location of the partition file
+    :rtype: string
+    """
+    (root, ext) = os.path.splitext(db_location)
+    return '%s-%s%s' % (root, key, ext)
+
+
+def partition_location(db_location, date=None):
+    """
+    Location of the partition that the rows of a date are written to. The
+        partition is created with the tables and indexes of db_location if
+        it does not exist, db_location itself keeps the schema and the rows
+        that were written before the data was partitioned. The _temp
+        tables that older versions of update_entries left in the database
+        are not copied.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param date: date of the rows or seconds since the epoch, defaults to
+        today
+    :type date: date, iso format string or int
+
+    :return location of the partition file
+    :rtype: string
+    """
+    location = partition_file(db_location, partition_key(
+        dt.date.today() if date is None else date))
+    if os.path.isfile(location):
+        return location
+    with partition_lock:
+        if not os.path.isfile(location):
+            schema = query_data(
+                db_location,
+                "select sql from sqlite_master where type in "
+                "('table', 'index') and sql is not null and name not like "
+                "'sqlite\\_%' escape '\\' and name not like "
+                "'%\\_temp%' escape '\\' order by type desc")
+            # create the partition under a temporary name so that the other
+            # writers never see a partition without its tables
+            temp_location = location + '.tmp'
+            conn = create_connection(temp_location)
+            try:
+                for (sql_cmd,) in schema:
+                    conn.execute(sql_cmd)
+                conn.commit()
+            finally:
+                conn.close()
+            os.replace(temp_location, location)
+    return location
+
+
+def partition_files(db_location):
+    """
+    Find the partitions of a database
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :return partitions: dictionary with the location of each partition file
+        as the key and the name of the partition as the value
+    :rtype: dictionary
+    """
+    pattern = partition_file(db_location, '*')
+    (prefix, suffix) = pattern.split('*')
+    return {location: location[len(prefix):len(location) - len(suffix)]
+            for location in sorted(glob.glob(pattern))}
+
+
+def partition_locations(db_location, start_date=None, end_date=None):
+    """
+    Locations of the partitions of a database that hold the rows between
+        start_date and end_date. db_location itself is not included.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param start_date: first date, all partitions if None
+    :type start_date: date
+
+    :param end_date: last date, defaults to today
+    :type end_date: date
+
+    :return locations of the partition files, oldest first
+    :rtype: list of strings
+    """
+    partitions = partition_files(db_location)
+    if start_date is None:
+        return list(partitions)
+    if end_date is None:
+        end_date = dt.date.today()
+    wanted = {partition_key(start_date + dt.timedelta(days=day)) for day in
+              range((end_date - start_date).days + 1)}
+    return [location for (location, key) in partitions.items()
+            if key in wanted]
+
+
+def query_new_rows(db_location, table_name, columns, start_date, where,
+                   last_values, cursor_column='rowid'):
+    """
+    Read the rows that were added to a database and its partitions since
+        the previous read. The rows are read in the order of cursor_column,
+        which must only increase within a file. The rowid does not if the
+        rows are updated (update_entries deletes the rows and inserts them
+        again, so they get back the same rowids), then a column like
+        recorded_at_time_utc with an index is used instead. Several rows
+        can share its value, so the rows with the last value are read
+        again and the caller must be able to read a row twice.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param table_name: name of the table
+    :type table_name: string
+
+    :param columns: columns that are read, cursor_column is added in front
+    :type columns: list of strings
+
+    :param start_date: only the partitions from this date are read
+    :type start_date: date
+
+    :param where: condition that selects the rows, for example the rows of
+        the original database that are too old are skipped
+    :type where: string
+
+    :param last_values: dictionary with the last value of cursor_column that
+        was read from each file
+    :type last_values: dictionary
+
+    :param cursor_column: column that orders the new rows, defaults to rowid
+    :type cursor_column: string
+
+    :return rows: the new rows
+    :rtype: list of tuples
+
+    :return values: dictionary with the last value of cursor_column of each
+        file
+    :rtype: dictionary
+    """
+    rows = []
+    values = {}
+    # the rowids are unique
+    operator = '>' if cursor_column == 'rowid' else '>='
+    for location in [db_location] + partition_locations(db_location,
+                                                        start_date):
+        last_value = last_values.get(location, 0)
+        new_rows = query_data(location, 'select %s, %s from %s where %s %s '
+                                        '%d and %s order by %s'
+                              % (cursor_column, ', '.join(columns),
+                                 table_name, cursor_column, operator,
+                                 last_value, where, cursor_column))
+        if len(new_rows) > 0:
+            values[location] = new_rows[-1][0]
+            rows.extend(row[1:] for row in new_rows)
+    return rows, values
+
+
+def open_partition_view(locations, table_name, start_date=None,
+                        end_date=None, time_column='utc_time'):
+    """
+    Attach the partitions to an in memory database and create a temporary
+        view named table_name that is the UNION ALL of the table in every
+        partition, restricted to the dates between start_date and end_date.
+        The frozen (read only) partitions are attached as immutable.
+
+    :param locations: locations of the database files, at most
+        max_attached_partitions
+    :type locations: list of strings
+
+    :param table_name: name of the table
+    :type table_name: string
+
+    :param start_date: first date, no restriction if None
+    :type start_date: date
+
+    :param end_date: last date, no restriction if None
+    :type end_date: date
+
+    :param time_column: epoch column that is restricted to the local dates
+    :type time_column: string
+
+    :raises ValueError: if none of the databases has the table
+
+    :return conn: connection to query the view, close it when done
+    :rtype: sqlite3.Connection
+    """
+    if len(locations) > max_attached_partitions:
+        raise ValueError('At most %d partitions can be attached' %
+                         max_attached_partitions)
+    conditions = []
+    if start_date is not None:
+        conditions.append('%s >= %d' % (time_column,
+                                        local_midnight_epoch(start_date)))
+    if end_date is not None:
+        conditions.append('%s < %d' % (time_column, local_midnight_epoch(
+            end_date + dt.timedelta(days=1))))
+    where = ' where ' + ' and '.join(conditions) if conditions else ''
+    conn = sqlite3.connect(':memory:', uri=True)
+    selects = []
+    for (ind, location) in enumerate(locations):
+        mode = 'ro&immutable=1' if is_frozen(location) else 'ro'
+        conn.execute("ATTACH DATABASE 'file:%s?mode=%s' AS p%d" % (
+            urllib.parse.quote(os.path.abspath(location)), mode, ind))
+        # the partitions created before a table was added do not have it
+        if conn.execute("select count(*) from p%d.sqlite_master where "
+                        "name = '%s'" % (ind, table_name)).fetchone()[0]:
+            selects.append('select * from p%d.%s%s' % (ind, table_name,
+                                                       where))
+    if len(selects) == 0:
+        conn.close()
+        raise ValueError('None of the %d databases has the table %s' % (
+            len(locations), table_name))
+    conn.execute('CREATE TEMP VIEW %s AS %s' % (table_name,
+                                                ' union all '.join(selects)))
+    return conn
+
+
+def partition_views(db_location, table_name, start_date=None, end_date=None,
+                    time_column='utc_time'):
+    """
+    Open the views of the partitions that hold the rows between start_date
+        and end_date. sqlite limits the number of attached databases, so one
+        view is opened for every max_attached_partitions partitions.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param table_name: name of the table
+    :type table_name: string
+
+    :param start_date: first date, all partitions if None
+    :type start_date: date
+
+    :param end_date: last date, defaults to today
+    :type end_date: date
+
+    :param time_column: epoch column that is restricted to the local dates
+    :type time_column: string
+
+    :return generator of connections, each is closed after it is used
+    :rtype: generator
+    """
+    locations = [db_location] + partition_locations(db_location, start_date,
+                                                    end_date)
+    for ind in range(0, len(locations), max_attached_partitions):
+        conn = open_partition_view(
+            locations[ind:ind + max_attached_partitions], table_name,
+            start_date, end_date, time_column)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+
+def query_partitions(db_location, table_name, sql_cmd, start_date=None,
+                     end_date=None, time_column='utc_time'):
+    """
+    Run a query on the view of the partitions between start_date and
+        end_date. If more than max_attached_partitions partitions are needed
+        the query is run on each group of partitions and the rows are
+        concatenated, so aggregates are per group.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param table_name: name of the table, the query selects from it
+    :type table_name: string
+
+    :param sql_cmd: sql query
+    :type sql_cmd: string
+
+    :param start_date: first date, all partitions if None
+    :type start_date: date
+
+    :param end_date: last date, defaults to today
+    :type end_date: date
+
+    :param time_column: epoch column that is restricted to the local dates
+    :type time_column: string
+
+    :return rows that have returned from the queries
+    :rtype: list
+    """
+    rows = []
+    for conn in partition_views(db_location, table_name, start_date,
+                                end_date, time_column):
+        rows.extend(conn.execute(sql_cmd).fetchall())
+    return rows
+
+
+def insert_partitioned_data(db_location, sql_cmd, data, date):
+    """
+    Insert data into the partition of its date
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param sql_cmd: sql command to write it into the table
+    :type sql_cmd: string
+
+    :param data: data to be inserted into the table
+    :type data: tuple
+
+    :param date: date of the data or seconds since the epoch
+    :type date: date, iso format string or int
+
+    :return None
+    """
+    insert_data(partition_location(db_location, date), sql_cmd, data)
+    return None
+
+
+def update_partitioned_entries(db_location, table_modified, data,
+                               columns_to_compare, date_column,
+                               summarize=False, table=None):
+    """
+    Update the entries in the partitions of the dates in date_column. The
+        dates are part of columns_to_compare, so an entry is always
+        replaced in the partition that holds it.
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param table_modified: name of the table to update
+    :type table_modified: string
+
+    :param data: pandas data frame that contains the new data
+    :type data: pandas data frame
+
+    :param columns_to_compare: a list of the columns to compare to determine
+        if an entry needs to be updated
+    :type list
+
+    :param date_column: iso format date column that selects the partition
+    :type date_column: string
+
+    :param summarize: if True, the transit summary of each partition is
+        updated with the new transit rows
+    :type summarize: bool
+
+    :param table: compiled table definition from table_def, see
+        update_entries
+    :type table: dictionary
+
+    :return None
+    """
+    keys = data[date_column].astype(str).map(partition_key)
+    for (key, partition_data) in data.groupby(keys, sort=False):
+        location = partition_location(db_location, partition_data[
+            date_column].iloc[0])
+        update_entries(location, table_modified, partition_data,
+                       columns_to_compare, summarize, table)
+    return None
+
+
+def is_frozen(location):
+    """
+    Check if a partition was frozen (made read only) by freeze_partition
+
+    :param location: location of the partition file
+    :type location: string
+
+    :return True if the partition is frozen
+    :rtype: bool
+    """
+    return not os.stat(location).st_mode & stat.S_IWUSR
+
+
+def freeze_partition(location):
+    """
+    Compact a partition that is no longer written to and make it read only.
+        The readers attach it as immutable, so no locks are taken.
+
+    :param location: location of the partition file
+    :type location: string
+
+    :return None
+    """
+    conn = create_connection(location)
+    try:
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    os.chmod(location, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    return None
+
+
+def freeze_cold_partitions(db_location, today=None):
+    """
+    Freeze the partitions that have not been written to for
+        config.sql_partition_freeze_days days
+
+    :param db_location: location of the database file
+    :type db_location: string
+
+    :param today: current date, defaults to today
+    :type today: date
+
+    :return frozen: locations of the partitions that were frozen
+    :rtype: list of strings
+    """
+    if today is None:
+        today = dt.date.today()
+    hot_keys = {partition_key(today - dt.timedelta(days=day)) for day in
+                range(config.sql_partition_freeze_days + 1)}
+    frozen = []
+    for (location, key) in partition_files(db_location).items():
+        if key not in hot_keys and not is_frozen(location):
+            freeze_partition(location)
+            frozen.append(location)
+    return frozen
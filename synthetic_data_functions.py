@@ -0,0 +1,136 @@
+"""
+Description: This file contains the functions that create synthetic
+    schedules and SIRI/GTFS-RT payloads. They are used by the benchmarks and
+    by the fake api service.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+
+import pandas as pd
+
+# stations used for the synthetic gtfs, north to south
+synthetic_stations = ['San Francisco', '22nd Street', 'Millbrae', 'San Mateo',
+                      'Hillsdale', 'Redwood City', 'Palo Alto',
+                      'Mountain View', 'Sunnyvale', 'San Jose Diridon']
+first_stop_id = 70011
+
+
+def synthetic_stop_times(num_trips, rng):
+    """
+    Create a list of (trip_id, stop_id, station, departure seconds from
+        midnight) for trains that serve every synthetic station
+
+    :param num_trips: number of trips
+    :type num_trips: int
+
+    :param rng: random number generator
+    :type rng: numpy Generator
+
+    :return stop_times: list of tuples
+    :rtype: list
+    """
+    stop_times = []
+    for trip_ind in range(num_trips):
+        trip_id = str(101 + trip_ind)
+        # spread the trains over the commute hours
+        departure_secs = int(rng.uniform(6.5, 20) * 60 * 60)
+        for (station_ind, station) in enumerate(synthetic_stations):
+            stop_id = first_stop_id + 10 * station_ind
+            stop_times.append((trip_id, stop_id, station, departure_secs))
+            departure_secs += int(rng.integers(3, 8) * 60)
+    return stop_times
+
+
+def synthetic_siri(num_visits, rng, now):
+    """
+    Create a synthetic SIRI stop monitoring payload
+
+    :param num_visits: number of monitored stop visits
+    :type num_visits: int
+
+    :param rng: random number generator
+    :type rng: numpy Generator
+
+    :param now: time that the payload is recorded at
+    :type now: datetime
+
+    :return monitored_stops: list of monitored stop visits
+    :rtype: list of dictionaries
+    """
+    num_trips = max(1, num_visits // len(synthetic_stations))
+    stop_times = synthetic_stop_times(num_trips, rng)[:num_visits]
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    monitored_stops = []
+    for (trip_id, stop_id, station, departure_secs) in stop_times:
+        aimed_time = midnight + dt.timedelta(
+            seconds=departure_secs + int(rng.integers(-60, 600)))
+        monitored_stops.append({
+            'RecordedAtTime': now.isoformat(),
+            'MonitoredVehicleJourney': {
+                'FramedVehicleJourneyRef': {
+                    'DatedVehicleJourneyRef': trip_id},
+                'MonitoredCall': {
+                    'StopPointName': station + ' Caltrain',
+                    'StopPointRef': str(stop_id),
+                    'AimedArrivalTime': aimed_time.isoformat(),
+                    'AimedDepartureTime': aimed_time.isoformat(),
+                    'VehicleAtStop': 'false'}}})
+    return monitored_stops
+
+
+def synthetic_gtfs_rt(num_updates, rng, now):
+    """
+    Create a synthetic GTFS-RT trip update payload in the format returned by
+        MessageToDict
+
+    :param num_updates: number of stop time updates
+    :type num_updates: int
+
+    :param rng: random number generator
+    :type rng: numpy Generator
+
+    :param now: time that the payload is recorded at
+    :type now: datetime
+
+    :return transit_data: the trip update payload
+    :rtype: dictionary
+    """
+    num_trips = max(1, num_updates // len(synthetic_stations))
+    stop_times = synthetic_stop_times(num_trips, rng)[:num_updates]
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    entities = {}
+    for (trip_id, stop_id, station, departure_secs) in stop_times:
+        departure_time = midnight + dt.timedelta(
+            seconds=departure_secs + int(rng.integers(-60, 600)))
+        entity = entities.setdefault(trip_id, {
+            'id': trip_id,
+            'tripUpdate': {'trip': {'tripId': trip_id},
+                           'stopTimeUpdate': []}})
+        entity['tripUpdate']['stopTimeUpdate'].append({
+            'stopId': str(stop_id),
+            'departure': {'time': str(int(departure_time.timestamp()))}})
+    return {'header': {'gtfsRealtimeVersion': '2.0',
+                       'timestamp': str(int(now.timestamp()))},
+            'entity': list(entities.values())}
+
+
+def synthetic_schedule_monitor(stop_times):
+    """
+    Create the schedule monitor for the synthetic stop times
+
+    :param stop_times: list of (trip_id, stop_id, station, departure seconds)
+    :type stop_times: list of tuples
+
+    :return schedule_monitor: data frame indexed by trip_id and stop_id
+    :rtype: pandas data frame
+    """
+    schedule_monitor = pd.DataFrame(stop_times, columns=[
+        'trip_id', 'stop_id', 'short_stop_name',
+        'scheduled_departure_time_seconds'])
+    schedule_monitor['scheduled_arrival_time_seconds'] = schedule_monitor[
+        'scheduled_departure_time_seconds']
+    schedule_monitor['trip_start_date_delta'] = 0.0
+    schedule_monitor['short_stop_name'] = schedule_monitor[
+        'short_stop_name'].astype('category')
+    return schedule_monitor.set_index(['trip_id', 'stop_id'])
@@ -0,0 +1,21 @@
+"""
+Description: This file configures pytest. The modules of the repository are
+    imported from its root. The stubs of the modules that are missing in a
+    checkout (private_config, the compiled table_def and python-pushover)
+    are imported from tests/stubs, which is searched last so that the real
+    modules are used if they exist. The stubs are files, so the worker
+    processes that are spawned by the tests import them too. The tests only
+    write to their temporary directories.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import os
+import sys
+import tempfile
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(tests_dir))
+sys.path.append(os.path.join(tests_dir, 'stubs'))
+# base_dir of the private_config stub, it is inherited by the spawned workers
+os.environ.setdefault('TRANSIT_VS_CAR_TEST_DIR',
+                      tempfile.mkdtemp(prefix='transit_vs_car_'))
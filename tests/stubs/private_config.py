@@ -0,0 +1,14 @@
+"""
+Description: private_config of the tests. It is used if there is no
+    private_config. The example is used with the directories in the
+    temporary directory of the test session (conftest.py), the spawned
+    worker processes import it too.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import os
+
+from private_config_example import *
+
+base_dir = os.environ['TRANSIT_VS_CAR_TEST_DIR']
+gtfs_zip_path = os.path.join(base_dir, 'caltrain-GTFS.zip')
@@ -0,0 +1,20 @@
+"""
+Description: pushover stub of the tests. It is used if python-pushover is
+    not installed, the tests never send a notification.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+BASE_URL = None
+
+
+class Client:
+    """
+    Client that drops the messages
+    """
+
+    def __init__(self, user_key, api_token=None):
+        self.user_key = user_key
+        self.api_token = api_token
+
+    def send_message(self, message, title=None):
+        return None
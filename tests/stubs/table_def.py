@@ -0,0 +1,47 @@
+"""
+Description: table_def stub of the tests. It is used if the table
+    definitions were not compiled from the spreadsheet (compile_table_def.py)
+    and has the columns of the transit tables of sql_functions.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import compile_table_def as ctd
+
+
+def table_dict(columns):
+    """
+    Table definition like a sheet of the spreadsheet
+
+    :param columns: (name, sql type) of each column
+    :type columns: list of tuples
+
+    :return dictionary like {column index -> {'pandas_name', 'sql_name',
+        'sql_type'}}
+    :rtype: dictionary
+    """
+    return {ind: {'pandas_name': name, 'sql_name': name, 'sql_type': sql_type}
+            for (ind, (name, sql_type)) in enumerate(columns)}
+
+
+siri_dict = table_dict([
+    ('train_start_date', 'text'), ('trip_id', 'text'),
+    ('stop_id', 'integer'), ('time_index', 'int'),
+    ('recorded_at_time_utc', 'integer'), ('station_name', 'text'),
+    ('vehicle_at_stop', 'text'), ('aimed_arrival_time_utc', 'integer'),
+    ('aimed_arrival_time_seconds', 'integer'),
+    ('scheduled_arrival_time_seconds', 'real'), ('arrival_on_time', 'int'),
+    ('arrival_delay', 'real'), ('aimed_departure_time_utc', 'integer'),
+    ('aimed_departure_time_seconds', 'integer'),
+    ('scheduled_departure_time_seconds', 'real'),
+    ('departure_on_time', 'int'), ('departure_delay', 'real')])
+siri_table = ctd.compile_table(siri_dict)
+
+gtfs_dict = table_dict([
+    ('train_start_date', 'text'), ('time_index', 'int'),
+    ('recorded_at_time_utc', 'integer'), ('stop_id', 'int'),
+    ('trip_id', 'text'), ('aimed_departure_time_utc', 'integer'),
+    ('aimed_departure_time_seconds', 'integer'),
+    ('scheduled_arrival_time_seconds', 'real'),
+    ('scheduled_departure_time_seconds', 'real'),
+    ('departure_on_time', 'int'), ('departure_delay', 'real')])
+gtfs_table = ctd.compile_table(gtfs_dict)
@@ -0,0 +1,89 @@
+"""
+Description: Tests of the adaptive polling of the transit feeds
+    (adaptive_polling_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+
+import pytest
+
+import adaptive_polling_functions as ap
+
+# a tuesday
+poll_date = dt.date(2026, 10, 20)
+
+
+@pytest.fixture
+def poll_spec():
+    """
+    A grid of 12 slots every 5 minutes from 6:00 on the weekdays with a
+        monitored trip that departs at 6:30
+    """
+    ap.fast_until.clear()
+    ap.poll_counts.clear()
+    yield {'key': 'grt_', 'agency': 'CT', 'start_secs': 6 * 3600,
+           'frequency_secs': 300, 'num_slots': 12,
+           'day_codes': ['mon', 'tue', 'wed', 'thu', 'fri'],
+           'stations': None,
+           'windows': [(6 * 3600 + 30 * 60 - ap.active_lead_secs,
+                        6 * 3600 + 30 * 60 + ap.active_lag_secs)]}
+    ap.fast_until.clear()
+    ap.poll_counts.clear()
+
+
+def local_time(hour, minute, second=0, date=poll_date):
+    return dt.datetime.combine(date, dt.time(hour, minute, second),
+                               tzinfo=ap.timezone)
+
+
+def test_poll_slots_slow_stride_and_active_window(poll_spec):
+    # every third slot and the slots from 6:20 to 7:00 while the trip is
+    # active
+    assert [slot for (slot, _) in ap.poll_slots(poll_spec)] == [
+        0, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+
+
+def test_next_poll_time_is_strictly_after_now(poll_spec):
+    assert ap.next_poll_time(poll_spec, local_time(5, 0)) == local_time(6, 0)
+    assert ap.next_poll_time(poll_spec, local_time(6, 0)) == local_time(6,
+                                                                        15)
+    assert ap.next_poll_time(poll_spec, local_time(6, 16)) == local_time(6,
+                                                                         20)
+    # after the last slot of friday the next poll is on monday
+    friday = poll_date + dt.timedelta(days=3)
+    monday = poll_date + dt.timedelta(days=6)
+    assert ap.next_poll_time(poll_spec, local_time(7, 0, date=friday)) == (
+        local_time(6, 0, date=monday))
+
+
+def test_next_poll_time_is_fast_while_a_delay_develops(poll_spec):
+    now = local_time(6, 16)
+    ap.fast_until['CT'] = now.timestamp() + ap.fast_hold_secs
+    assert ap.next_poll_time(poll_spec, now) == now + dt.timedelta(
+        seconds=ap.fast_poll_secs)
+
+
+def test_within_budget(poll_spec):
+    secs = 6 * 3600 + 16 * 60
+    # 8 slots are left after 6:16 (6:20 to 6:55)
+    assert ap.within_budget(poll_spec, poll_date, secs)
+    for _ in range(3):
+        ap.record_poll(poll_spec, poll_date)
+    assert ap.within_budget(poll_spec, poll_date, secs)
+    ap.record_poll(poll_spec, poll_date)
+    assert not ap.within_budget(poll_spec, poll_date, secs)
+    # the polls of the previous day are not counted
+    assert ap.within_budget(poll_spec, poll_date + dt.timedelta(days=1),
+                            secs)
+
+
+def test_trigger_fires_after_the_previous_fire_time(poll_spec):
+    trigger = ap.AdaptivePollTrigger(poll_spec)
+    # the local timezone, like the cron triggers of the periodic jobs
+    assert trigger.timezone == ap.timezone
+    previous_fire_time = local_time(6, 15)
+    now = local_time(6, 10).astimezone(dt.timezone.utc)
+    assert trigger.get_next_fire_time(previous_fire_time, now) == (
+        local_time(6, 20))
+    assert trigger.get_next_fire_time(None, now) == local_time(6, 15)
@@ -0,0 +1,98 @@
+"""
+Description: Tests of the train delay alert engine (alert_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import pandas as pd
+import pytest
+
+import alert_functions as al
+import data_collection_functions as dcf
+
+
+@pytest.fixture(autouse=True)
+def clear_state():
+    al.train_states.clear()
+    al.pending_alerts.clear()
+    al.alerts_in_flight = False
+    yield
+    al.train_states.clear()
+    al.pending_alerts.clear()
+    al.alerts_in_flight = False
+
+
+def delays(delay_secs, trip_id='101'):
+    """
+    Data of a train with one stop ahead
+    """
+    return pd.DataFrame({'trip_id': [trip_id],
+                         'short_stop_name': ['Palo Alto'],
+                         'aimed_departure_time_seconds': [30000],
+                         'departure_delay': [float(delay_secs)]})
+
+
+class SendRecorder:
+    """
+    Accepts the notifications and keeps their callbacks
+    """
+
+    def __init__(self, accept=True):
+        self.accept = accept
+        self.sent = []
+
+    def __call__(self, body_str, on_sent, on_failed):
+        self.sent.append((body_str, on_sent, on_failed))
+        return self.accept
+
+
+def test_alert_on_crossing_a_threshold():
+    assert al.update_delay_alerts(delays(60), 'CT', now=0) == []
+    assert al.update_delay_alerts(delays(6 * 60), 'CT', now=10) == [
+        ('CT', '101')]
+    # a small change does not raise an alert
+    assert al.update_delay_alerts(delays(7 * 60), 'CT', now=20) == []
+    assert al.update_delay_alerts(delays(60), 'CT', now=30) == [
+        ('CT', '101')]
+    assert al.pending_alerts[('CT', '101')].endswith(
+        'on time')
+
+
+def test_a_late_train_is_alerted_from_one_feed(monkeypatch):
+    send = SendRecorder()
+    monkeypatch.setattr(dcf.config, 'delay_alert_agencies', ['CT'])
+    monkeypatch.setattr(dcf.config, 'delay_alert_source', 'siri')
+    monkeypatch.setattr(dcf.pn, 'delay_push_notify',
+                        lambda sql_db_loc, *args: send(*args))
+    # both feeds report the same late train
+    dcf.notify_delays(delays(6 * 60), 'siri', 'CT')
+    send.sent[0][1]()
+    dcf.notify_delays(delays(6 * 60), 'gtfs-rt', 'CT')
+    assert len(send.sent) == 1
+    assert list(al.train_states) == [('CT', '101')]
+
+
+def test_alerts_are_kept_until_sent():
+    al.update_delay_alerts(delays(6 * 60), 'CT', now=0)
+    send = SendRecorder()
+    assert al.notify_pending_alerts(send)
+    # only one notification is sent at a time
+    assert not al.notify_pending_alerts(send)
+    (body_str, on_sent, on_failed) = send.sent[0]
+    assert 'CT 101' in body_str
+    on_failed()
+    assert ('CT', '101') in al.pending_alerts
+    assert al.notify_pending_alerts(send)
+    # an alert that changed while it was sent is sent again
+    al.update_delay_alerts(delays(11 * 60), 'CT', now=10)
+    send.sent[1][1]()
+    assert ('CT', '101') in al.pending_alerts
+    assert al.notify_pending_alerts(send)
+    send.sent[2][1]()
+    assert al.pending_alerts == {}
+
+
+def test_alerts_are_kept_if_not_accepted():
+    al.update_delay_alerts(delays(6 * 60), 'CT', now=0)
+    assert not al.notify_pending_alerts(SendRecorder(accept=False))
+    assert not al.alerts_in_flight
+    assert ('CT', '101') in al.pending_alerts
@@ -0,0 +1,122 @@
+"""
+Description: Tests of the data collection functions
+    (data_collection_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import os
+import threading
+import time
+
+import pytest
+
+import config
+import data_collection_functions as dcf
+
+start_loc = {'lat': 37.44, 'lng': -122.16}
+end_loc = {'lat': 37.78, 'lng': -122.39}
+departure = dt.datetime(2024, 1, 1, 8, 2)
+
+
+@pytest.fixture
+def google_calls(monkeypatch):
+    calls = []
+
+    def query_google_api(start, end):
+        calls.append((start, end))
+        return 900.0 + len(calls), {'call': len(calls)}
+
+    monkeypatch.setattr(dcf, 'query_google_api', query_google_api)
+    monkeypatch.setattr(config, 'traffic_cache_ttl_secs', 300)
+    monkeypatch.setattr(config, 'traffic_cache_max_entries', 2)
+    dcf.traffic_cache.clear()
+    yield calls
+    dcf.traffic_cache.clear()
+
+
+def test_parse_pool_spawns_its_workers_at_start(monkeypatch):
+    monkeypatch.setitem(config.executor_config, 'parse',
+                        {'type': 'process', 'max_workers': 1})
+    try:
+        pool = dcf.start_parse_pool()
+        assert pool is dcf.start_parse_pool()
+        assert pool._mp_context.get_start_method() == 'spawn'
+        assert dcf.run_parser(divmod, 7, 2) == (3, 1)
+        assert pool.submit(dcf.parse_worker_pid).result() != os.getpid()
+    finally:
+        dcf.shutdown_parse_pool()
+    assert dcf.parse_pool is None
+
+
+def test_run_parser_without_workers(monkeypatch):
+    monkeypatch.setitem(config.executor_config, 'parse',
+                        {'type': 'process', 'max_workers': 0})
+    assert dcf.start_parse_pool() is None
+    assert dcf.run_parser(divmod, 7, 2) == (3, 1)
+
+
+def test_cached_google_api_hit_and_expiry(google_calls):
+    assert dcf.cached_google_api(start_loc, end_loc, departure) == (
+        901.0, {'call': 1}, False)
+    # same bucket of departure
+    assert dcf.cached_google_api(
+        start_loc, end_loc, departure + dt.timedelta(minutes=2)) == (
+        901.0, {'call': 1}, True)
+    key = next(iter(dcf.traffic_cache))
+    dcf.traffic_cache[key] = (time.monotonic() - 301,) + \
+        dcf.traffic_cache[key][1:]
+    assert dcf.cached_google_api(start_loc, end_loc, departure) == (
+        902.0, {'call': 2}, False)
+    assert len(google_calls) == 2
+
+
+def test_cached_google_api_evicts_the_oldest(google_calls):
+    for minutes in [0, 5, 10]:
+        dcf.cached_google_api(start_loc, end_loc,
+                              departure + dt.timedelta(minutes=minutes))
+    assert len(dcf.traffic_cache) == 2
+    dcf.cached_google_api(start_loc, end_loc, departure)
+    assert len(google_calls) == 4
+
+
+def test_cached_google_api_coalesces_misses(google_calls, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    query_google_api = dcf.query_google_api
+
+    def slow_query_google_api(start, end):
+        started.set()
+        release.wait(5)
+        return query_google_api(start, end)
+
+    monkeypatch.setattr(dcf, 'query_google_api', slow_query_google_api)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        dcf.cached_google_api(start_loc, end_loc, departure)))
+        for _ in range(4)]
+    threads[0].start()
+    assert started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # let the other threads reach the query in flight
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(google_calls) == 1
+    assert sorted(from_cache for (_, _, from_cache) in results) == [
+        False, True, True, True]
+    assert dcf.traffic_queries == {}
+
+
+def test_cached_google_api_does_not_cache_errors(google_calls,
+                                                   monkeypatch):
+    def failed_query_google_api(start, end):
+        raise Exception('google is down')
+
+    monkeypatch.setattr(dcf, 'query_google_api', failed_query_google_api)
+    with pytest.raises(Exception, match='google is down'):
+        dcf.cached_google_api(start_loc, end_loc, departure)
+    assert dcf.traffic_queries == {}
+    assert len(dcf.traffic_cache) == 0
@@ -0,0 +1,97 @@
+"""
+Description: Tests of the car or train decision cache (decision_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import os
+
+import pandas as pd
+import pytest
+
+import config
+import decision_functions as dec
+import sql_functions as sf
+
+
+@pytest.fixture
+def databases(tmp_path):
+    traffic_db_loc = os.path.join(str(tmp_path), 'traffic_data.sqlite')
+    transit_db_loc = os.path.join(str(tmp_path), 'gtfs_rt_data.sqlite')
+    sf.create_traffic_data_table(traffic_db_loc)
+    sf.create_transit_data_gtfs_rt_table(config.gfts_rt_table_name,
+                                         transit_db_loc)
+    dec.last_values.clear()
+    dec.latest_delays.clear()
+    dec.latest_traffic.clear()
+    dec.traffic_history.clear()
+    yield traffic_db_loc, transit_db_loc
+    dec.last_values.clear()
+    dec.latest_delays.clear()
+
+
+def prediction(train_start_date, recorded_utc_time, delay):
+    """
+    A gtfs-rt prediction of train 7 at stop 70012
+    """
+    return pd.DataFrame([{
+        'train_start_date': train_start_date, 'time_index': 0,
+        'recorded_at_time_utc': recorded_utc_time, 'stop_id': 70012,
+        'trip_key': 7, 'aimed_departure_time_utc': recorded_utc_time,
+        'aimed_departure_time_seconds': 0,
+        'scheduled_arrival_time_seconds': 0.0,
+        'scheduled_departure_time_seconds': 0.0, 'departure_on_time': 0,
+        'departure_delay': delay}])
+
+
+def test_refresh_cache_reads_updated_prediction(databases):
+    (traffic_db_loc, transit_db_loc) = databases
+    today = dt.date.today()
+    recorded_utc_time = sf.local_midnight_epoch(today) + 8 * 3600
+    for (offset, delay) in [(0, 60.0), (30, 300.0)]:
+        # the prediction of the same train and stop is replaced, so it gets
+        # back the same rowid
+        sf.update_partitioned_entries(
+            transit_db_loc, config.gfts_rt_table_name,
+            prediction(today.isoformat(), recorded_utc_time + offset, delay),
+            ['train_start_date', 'trip_key', 'stop_id'], 'train_start_date')
+        dec.refresh_cache(traffic_db_loc, transit_db_loc, today)
+        assert dec.latest_delays[(today.isoformat(), 7, 70012)] == (
+            recorded_utc_time + offset, delay)
+
+
+def test_refresh_cache_reads_traffic_once(databases):
+    (traffic_db_loc, transit_db_loc) = databases
+    now = int(dt.datetime.now().timestamp())
+    sf.insert_traffic_data(traffic_db_loc, (now, 1, 3, 1, 5, '', 900.0, 0,
+                                            0))
+    assert dec.refresh_cache(traffic_db_loc, transit_db_loc) == 1
+    assert dec.refresh_cache(traffic_db_loc, transit_db_loc) == 0
+    assert dec.latest_traffic[5] == (now, 900.0)
+    assert dec.traffic_history[3] == [900.0]
+
+
+def test_decide_includes_the_trains_of_yesterday_after_midnight(
+        databases):
+    now = dt.datetime(2024, 1, 2, 0, 30)
+    yesterday = (now.date() - dt.timedelta(days=1)).isoformat()
+    every_day = list(range(7))
+    trip = {'trip_index': 1, 'stop_id_start': 70012, 'stop_id_stop': 70022,
+            'weekdays': every_day}
+    dec.departures[('A', 'B')] = [
+        dict(trip, trip_id='101', departure_secs=6 * 3600,
+             arrival_secs=7 * 3600),
+        dict(trip, trip_id='199', departure_secs=25 * 3600,
+             arrival_secs=26 * 3600)]
+    dec.trip_keys.update({'101': 1, '199': 9})
+    dec.latest_delays[(yesterday, 9, 70022)] = (0, 120.0)
+    try:
+        decision = dec.decide('A', 'B', now)
+    finally:
+        dec.departures.clear()
+        dec.trip_keys.clear()
+    assert decision['mode'] == 'train'
+    assert decision['train']['trip_id'] == '199'
+    assert decision['train']['train_start_date'] == yesterday
+    assert decision['train']['arrival_secs'] == 7200 + 120.0
+    assert decision['train']['duration_secs'] == 7200 + 120.0 - 1800
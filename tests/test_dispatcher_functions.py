@@ -0,0 +1,122 @@
+"""
+Description: Tests of the job dispatcher (dispatcher_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import collections
+import datetime as dt
+import os
+import threading
+import time
+import types
+
+import pytest
+
+import dispatcher_functions as disp
+import sql_functions as sf
+
+
+@pytest.fixture
+def monitor_db_loc(tmp_path):
+    location = os.path.join(str(tmp_path), 'process_monitor.sqlite')
+    sf.create_dispatch_misfire_table(location)
+    return location
+
+
+@pytest.fixture
+def pools():
+    pools = disp.create_pools({'default': {'type': 'thread',
+                                           'max_workers': 1}})
+    yield pools
+    for (pool, slots) in pools.values():
+        pool.shutdown(wait=True)
+
+
+def create_job(job_id, func, grace_secs=120):
+    return types.SimpleNamespace(id=job_id, func=func, args=(), kwargs={},
+                                 executor='default', max_instances=1,
+                                 misfire_grace_time=grace_secs)
+
+
+def misfire_reasons(monitor_db_loc):
+    return [row[0] for row in sf.query_data(
+        monitor_db_loc, 'select reason from dispatch_misfire')]
+
+
+def test_dispatch_job_does_not_wait_for_a_full_pool(pools, monitor_db_loc):
+    release = threading.Event()
+    now = disp.utc_now()
+    instances = collections.Counter()
+    assert disp.dispatch_job(pools, instances,
+                             create_job('trf-1', release.wait), now, now,
+                             monitor_db_loc)
+    start = time.monotonic()
+    assert disp.dispatch_job(pools, instances,
+                             create_job('trf-2', lambda: None), now, now,
+                             monitor_db_loc) is None
+    assert time.monotonic() - start < 1
+    assert misfire_reasons(monitor_db_loc) == []
+    release.set()
+
+
+def test_dispatch_job_pool_full_after_grace(pools, monitor_db_loc):
+    release = threading.Event()
+    now = disp.utc_now()
+    instances = collections.Counter()
+    disp.dispatch_job(pools, instances, create_job('trf-1', release.wait),
+                      now, now, monitor_db_loc)
+    fire_time = now - dt.timedelta(seconds=121)
+    assert disp.dispatch_job(pools, instances,
+                             create_job('trf-2', lambda: None), fire_time,
+                             now, monitor_db_loc, pool_was_full=True) is False
+    assert disp.dispatch_job(pools, instances,
+                             create_job('trf-3', lambda: None), fire_time,
+                             now, monitor_db_loc) is False
+    assert misfire_reasons(monitor_db_loc) == ['pool full', 'late']
+    release.set()
+
+
+def test_dispatch_job_misfire_without_monitor_table(pools, tmp_path):
+    # the misfire is logged but the database error does not escape
+    monitor_db_loc = os.path.join(str(tmp_path), 'empty.sqlite')
+    now = disp.utc_now()
+    assert disp.dispatch_job(pools, collections.Counter(),
+                             create_job('trf-1', lambda: None),
+                             now - dt.timedelta(seconds=121), now,
+                             monitor_db_loc) is False
+
+
+def create_interval_job(job_id, interval_secs, on_completion=False):
+    """
+    Job that fires every interval_secs seconds
+    """
+    def get_next_fire_time(previous_fire_time, now):
+        if previous_fire_time is None:
+            return now + dt.timedelta(seconds=interval_secs)
+        return previous_fire_time + dt.timedelta(seconds=interval_secs)
+    trigger = types.SimpleNamespace(
+        timezone=dt.timezone.utc, get_next_fire_time=get_next_fire_time,
+        reschedule_on_completion=on_completion)
+    return types.SimpleNamespace(id=job_id, trigger=trigger)
+
+
+def test_reload_keeps_the_jobs_waiting_for_a_full_pool():
+    now = disp.utc_now()
+    fire_time = now - dt.timedelta(seconds=5)
+    due_time = now + dt.timedelta(seconds=disp.pool_full_retry_secs)
+    jobs = {'trf-1': create_interval_job('trf-1', 60),
+            'sr_0': create_interval_job('sr_0', 30, on_completion=True)}
+    timer_heap = [(due_time, 7, 'trf-1', fire_time),
+                  (now + dt.timedelta(seconds=55), 8, 'trf-1',
+                   now + dt.timedelta(seconds=55)),
+                  (due_time, 9, 'sr_0', fire_time),
+                  (due_time, 10, 'trf-2', fire_time)]
+    entries = sorted((job_id, due_time, fire_time) for
+                     (due_time, _, job_id, fire_time) in
+                     disp.reload_timer_heap(jobs, timer_heap, now))
+    # the waiting run of the removed job trf-2 is dropped and the poller
+    # sr_0 gets its next run when the waiting run is done
+    assert entries == [('sr_0', due_time, fire_time),
+                       ('trf-1', due_time, fire_time),
+                       ('trf-1', now + dt.timedelta(seconds=60),
+                        now + dt.timedelta(seconds=60))]
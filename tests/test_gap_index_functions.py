@@ -0,0 +1,71 @@
+"""
+Description: Tests of the gap index (gap_index_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import config
+import gap_index_functions as gif
+import sql_functions as sf
+
+
+@pytest.fixture
+def gap_db_loc(tmp_path):
+    db_location = os.path.join(str(tmp_path), 'gap_index.sqlite')
+    sf.create_gap_index_table(db_location)
+    return db_location
+
+
+def test_bitmap_round_trip():
+    assert gif.slots_to_bitmap([]) == b''
+    assert gif.slots_to_bitmap([0, 9]) == bytes([0b10000000, 0b01000000])
+    assert gif.bitmap_to_slots(gif.slots_to_bitmap(
+        {3, 8, 17})).tolist() == [3, 8, 17]
+
+
+def test_missing_slots_and_job_ids(gap_db_loc):
+    expected = pd.DataFrame({'date': ['2024-01-01'] * 4 + ['2024-01-02'] * 2,
+                             'slot': [0, 1, 2, 12, 0, 1]})
+    # the observed bitmap of 2024-01-01 is shorter than the expected one
+    observed = {('2024-01-01', 1), ('2024-01-02', 0), ('2024-01-02', 1),
+                ('2024-01-03', 5)}
+    gif.update_gap_index(gap_db_loc, 'traffic', expected, observed)
+    missing = gif.missing_slots(gap_db_loc, 'traffic', '2024-01-01',
+                                '2024-01-31')
+    assert list(missing) == ['2024-01-01']
+    assert missing['2024-01-01'].tolist() == [0, 2, 12]
+    assert gif.missing_job_ids(gap_db_loc, 'traffic', '2024-01-01') == [
+        'trf-0', 'trf-2', 'trf-12']
+    assert gif.missing_job_ids(gap_db_loc, 'traffic', '2024-01-02') == []
+
+
+def test_missing_job_ids_of_an_adaptive_poller(gap_db_loc, monkeypatch):
+    source = 'siri' + config.agency_suffix(config.default_agency)
+    id_modifier = config.agency_id_modifier('siri', config.default_agency)
+    expected = pd.DataFrame({'date': ['2024-01-01'] * 3 + ['2024-01-02'],
+                             'slot': [0, 3, 6, 0]})
+    gif.update_gap_index(gap_db_loc, source, expected,
+                         {('2024-01-01', 0), ('2024-01-02', 0)})
+    monkeypatch.setattr(config, 'adaptive_transit_polling', False)
+    assert gif.missing_job_ids(gap_db_loc, source, '2024-01-01') == [
+        id_modifier + '3', id_modifier + '6']
+    # the poller has a single job that collects all of the slots
+    monkeypatch.setattr(config, 'adaptive_transit_polling', True)
+    assert gif.missing_job_ids(gap_db_loc, source, '2024-01-01') == [
+        id_modifier + '0']
+    assert gif.missing_job_ids(gap_db_loc, source, '2024-01-02') == []
+
+
+def test_gap_summary(gap_db_loc):
+    expected = pd.DataFrame({'date': ['2024-01-01', '2024-01-01'],
+                             'slot': [0, 1]})
+    gif.update_gap_index(gap_db_loc, 'traffic', expected,
+                         {('2024-01-01', 0)})
+    summary = gif.gap_summary(gap_db_loc, '2024-01-01', '2024-01-01')
+    assert summary.to_dict('records') == [
+        {'source': 'traffic', 'date': '2024-01-01', 'expected_num': 2,
+         'observed_num': 1, 'missing_num': 1}]
@@ -0,0 +1,55 @@
+"""
+Description: Tests of the lazy imports (import_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import concurrent.futures
+import sys
+
+import pytest
+
+import import_functions as imf
+
+
+@pytest.fixture
+def slow_module(tmp_path, monkeypatch):
+    """
+    A module that takes a moment to import and counts its imports
+    """
+    (tmp_path / 'slow_lazy_module.py').write_text(
+        'import builtins\n'
+        'import time\n'
+        'builtins.slow_lazy_imports = getattr(builtins, '
+        '"slow_lazy_imports", 0) + 1\n'
+        'time.sleep(0.2)\n'
+        'value = 42\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield 'slow_lazy_module'
+    sys.modules.pop('slow_lazy_module', None)
+    imf.lazy_modules.pop('slow_lazy_module', None)
+    import builtins
+    del builtins.slow_lazy_imports
+
+
+def test_lazy_import_is_imported_once_by_many_threads(slow_module):
+    module = imf.lazy_import(slow_module)
+    assert slow_module not in sys.modules
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        values = list(pool.map(lambda _: module.value, range(16)))
+    assert values == [42] * 16
+    import builtins
+    assert builtins.slow_lazy_imports == 1
+    # once imported, the module itself is returned
+    assert imf.lazy_import(slow_module) is sys.modules[slow_module]
+
+
+def test_lazy_import_sets_attributes_on_the_module(slow_module):
+    module = imf.lazy_import(slow_module)
+    module.value = 7
+    assert sys.modules[slow_module].value == 7
+    assert module.value == 7
+
+
+def test_lazy_import_missing_module():
+    with pytest.raises(ModuleNotFoundError):
+        imf.lazy_import('no_such_module_for_the_tests')
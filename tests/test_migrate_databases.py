@@ -0,0 +1,64 @@
+"""
+Description: Tests of the migration of the legacy databases
+    (migrate_databases).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import os
+import time
+
+import pytest
+
+import config
+import migrate_databases as mdb
+import sql_functions as sf
+
+
+@pytest.fixture
+def legacy_traffic_db(tmp_path):
+    """
+    A traffic database with the tables of the first collections
+    """
+    location = os.path.join(str(tmp_path), 'traffic_data.sqlite')
+    sf.create_table(location, """CREATE TABLE traffic_data
+                      (date text, time text, utc_time real,
+                       day_of_week integer, trip_index integer,
+                       trip_id integer, start_station text, end_station text,
+                       start_loc text, end_loc text, directions_result text,
+                       duration_in_traffic real)""")
+    sf.insert_data(location, 'INSERT INTO traffic_data VALUES '
+                             '(?,?,?,?,?,?,?,?,?,?,?,?)',
+                   ('2019-03-05', '08:15:00', 0.0, 2, 4, 101, 'Palo Alto',
+                    'San Francisco', '', '', '{}', 3000.0))
+    return location
+
+
+def test_migrate_file_converts_legacy_rows(tmp_path, legacy_traffic_db):
+    dimension_db_loc = os.path.join(str(tmp_path), 'dimension.sqlite')
+    agency = config.default_agency
+    assert mdb.pending_migrations([(legacy_traffic_db, agency)],
+                                  None) == [legacy_traffic_db]
+    assert mdb.migrate_file(legacy_traffic_db, agency, dimension_db_loc)
+    (row,) = sf.query_data(legacy_traffic_db, 'select * from traffic_data')
+    local_time = dt.datetime(2019, 3, 5, 8, 15).astimezone()
+    (trip_key,) = sf.query_data(
+        dimension_db_loc, "select trip_key from trips where trip_id = '101'")
+    assert row[:4] == (int(local_time.timestamp()), 2, 4, trip_key[0])
+    assert row[4] is not None
+    assert row[5:] == ('{}', 3000.0, 0, 0)
+    # the file is current, so it is not migrated again
+    assert mdb.pending_migrations([(legacy_traffic_db, agency)], None) == []
+    assert not mdb.migrate_file(legacy_traffic_db, agency, dimension_db_loc)
+    assert not os.path.isfile(legacy_traffic_db + '.tmp')
+
+
+def test_collector_is_running(tmp_path):
+    heartbeat_file = os.path.join(str(tmp_path), 'collect_data.heartbeat')
+    assert not mdb.collector_is_running(heartbeat_file, 60)
+    with open(heartbeat_file, 'w') as outfile:
+        outfile.write('1')
+    assert mdb.collector_is_running(heartbeat_file, 60)
+    old_time = time.time() - 181
+    os.utime(heartbeat_file, (old_time, old_time))
+    assert not mdb.collector_is_running(heartbeat_file, 60)
@@ -0,0 +1,59 @@
+"""
+Description: Tests of the completeness check (nightly_check).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import os
+
+import gap_index_functions as gif
+import nightly_check as nc
+import sql_functions as sf
+
+
+def expected_slots(local_times):
+    """
+    Expected traffic slots 1, 2, ... at the local times
+    """
+    return nc.slots_frame([(local_time.date().isoformat(), slot, local_time)
+                           for (slot, local_time) in enumerate(local_times,
+                                                               1)])
+
+
+def test_check_buckets():
+    start = dt.datetime(2024, 1, 1, 8, 0)
+    expected = expected_slots([start, start + dt.timedelta(minutes=5),
+                               start + dt.timedelta(minutes=20)])
+    observed = {('2024-01-01', 1), ('2024-01-01', 3)}
+    end_utc_time = nc.stored_utc_time(start + dt.timedelta(hours=1))
+    assert nc.check_buckets(expected, observed, 0, end_utc_time) == [
+        (start, 2, 1)]
+    # the buckets that were checked before are skipped
+    assert nc.check_buckets(expected, observed, end_utc_time,
+                            end_utc_time + 3600) == []
+
+
+def test_completeness_check(tmp_path, monkeypatch):
+    traffic_db_loc = os.path.join(str(tmp_path), 'traffic_data.sqlite')
+    gap_db_loc = os.path.join(str(tmp_path), 'gap_index.sqlite')
+    sf.create_traffic_data_table(traffic_db_loc)
+    local_time = (dt.datetime.now().replace(second=0, microsecond=0) -
+                  dt.timedelta(hours=3))
+    expected = expected_slots([local_time, local_time])
+    monkeypatch.setattr(nc, 'completeness_sources', [
+        ('traffic', traffic_db_loc, 'traffic_data', 'trip_index')])
+    monkeypatch.setattr(nc, 'expected_traffic_slots',
+                        lambda trips_path, dates: expected)
+    monkeypatch.setattr(nc, 'expected_periodic_slots',
+                        lambda periodic_jobs_path, dates: expected)
+    # only the trip of slot 1 was collected
+    sf.insert_traffic_data(traffic_db_loc, (
+        int(local_time.timestamp()) + 5, local_time.isoweekday(), 1, 1, 1,
+        '', 900.0, 0, 0))
+    assert nc.completeness_check(gap_db_loc, None, None) == [
+        'traffic %s: 1 of 2 missing' % local_time.strftime('%a %H:%M')]
+    date = local_time.date().isoformat()
+    assert gif.missing_slots(gap_db_loc, 'traffic', date, date)[
+        date].tolist() == [2]
+    # the buckets are only checked once
+    assert nc.completeness_check(gap_db_loc, None, None) == []
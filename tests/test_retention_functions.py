@@ -0,0 +1,125 @@
+"""
+Description: Tests of the retention policy of the transit data
+    (retention_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import os
+
+import pandas as pd
+import pytest
+
+import config
+import retention_functions as rf
+import sql_functions as sf
+
+table_name = config.gfts_rt_table_name
+today = dt.date(2024, 6, 10)
+columns_to_compare = ['train_start_date', 'trip_key', 'stop_id']
+
+
+@pytest.fixture
+def transit_db_loc(tmp_path, monkeypatch):
+    db_location = os.path.join(str(tmp_path), 'gtfs_rt_data.sqlite')
+    sf.create_transit_data_gtfs_rt_table(table_name, db_location)
+    sf.create_transit_summary_table(db_location)
+    monkeypatch.setattr(config, 'transit_retention_days', 90)
+    monkeypatch.setattr(config, 'transit_archive_dir',
+                        os.path.join(str(tmp_path), 'archive'))
+    monkeypatch.setattr(config, 'retention_batch_rows', 2)
+    return db_location
+
+
+def predictions(train_start_dates, delay=60.0):
+    """
+    gtfs-rt predictions of train 7 at a stop of each service day
+    """
+    rows = []
+    for (stop_id, train_start_date) in enumerate(train_start_dates):
+        recorded_utc_time = sf.local_midnight_epoch(
+            dt.date.fromisoformat(train_start_date)) + 8 * 3600
+        rows.append({
+            'train_start_date': train_start_date, 'time_index': 0,
+            'recorded_at_time_utc': recorded_utc_time,
+            'stop_id': 70000 + stop_id, 'trip_key': 7,
+            'aimed_departure_time_utc': recorded_utc_time,
+            'aimed_departure_time_seconds': 0,
+            'scheduled_arrival_time_seconds': 0.0,
+            'scheduled_departure_time_seconds': 0.0, 'departure_on_time': 0,
+            'departure_delay': delay})
+    return pd.DataFrame(rows)
+
+
+def write_partitions(db_location, train_start_dates):
+    sf.update_partitioned_entries(db_location, table_name,
+                                  predictions(train_start_dates),
+                                  columns_to_compare, 'train_start_date',
+                                  summarize=True)
+    for location in sf.partition_locations(db_location):
+        sf.freeze_partition(location)
+    return None
+
+
+def summary_dates(db_location):
+    return sorted(row[0] for row in sf.query_data(
+        db_location, 'select train_start_date from %s' %
+                     config.transit_summary_table_name))
+
+
+def test_old_frozen_partition_is_collapsed_and_archived(transit_db_loc):
+    write_partitions(transit_db_loc, ['2024-01-05', '2024-01-06'])
+    old_location = sf.partition_location(transit_db_loc, '2024-01-05')
+    (collapsed, num_rows) = rf.apply_retention(transit_db_loc, table_name,
+                                               today)
+    assert collapsed == [old_location]
+    assert num_rows == 0
+    assert not os.path.isfile(old_location)
+    assert os.path.isfile(os.path.join(config.transit_archive_dir,
+                                       os.path.basename(old_location)))
+    assert summary_dates(transit_db_loc) == ['2024-01-05', '2024-01-06']
+
+
+def test_partition_with_a_recent_day_is_kept(transit_db_loc):
+    # the cutoff is 2024-03-12
+    write_partitions(transit_db_loc, ['2024-03-01', '2024-03-20'])
+    location = sf.partition_location(transit_db_loc, '2024-03-01')
+    assert rf.apply_retention(transit_db_loc, table_name, today) == ([], 0)
+    assert os.path.isfile(location)
+    assert summary_dates(transit_db_loc) == []
+
+
+def test_original_rows_are_pruned_in_batches(transit_db_loc):
+    # rows written before the data was partitioned
+    sf.update_entries(transit_db_loc, table_name, predictions(
+        ['2024-01-01', '2024-01-02', '2024-01-03', '2024-06-01']),
+        columns_to_compare)
+    assert rf.apply_retention(transit_db_loc, table_name, today) == ([], 2)
+    assert rf.apply_retention(transit_db_loc, table_name, today) == ([], 1)
+    assert rf.apply_retention(transit_db_loc, table_name, today) == ([], 0)
+    assert sf.query_data(transit_db_loc, 'select train_start_date from %s'
+                                         % table_name) == [('2024-06-01',)]
+    archive_db_loc = rf.archive_location(transit_db_loc,
+                                         config.transit_archive_dir)
+    assert sorted(sf.query_data(archive_db_loc,
+                                'select train_start_date from %s' %
+                                table_name)) == [
+        ('2024-01-01',), ('2024-01-02',), ('2024-01-03',)]
+    assert summary_dates(transit_db_loc) == ['2024-01-01', '2024-01-02',
+                                             '2024-01-03']
+
+
+def test_without_archive_the_data_is_deleted(transit_db_loc, monkeypatch):
+    monkeypatch.setattr(config, 'transit_archive_dir', None)
+    write_partitions(transit_db_loc, ['2024-01-05'])
+    sf.update_entries(transit_db_loc, table_name, predictions(
+        ['2024-01-01']), columns_to_compare)
+    old_location = sf.partition_location(transit_db_loc, '2024-01-05')
+    assert rf.apply_retention(transit_db_loc, table_name, today) == (
+        [old_location], 1)
+    assert not os.path.isfile(old_location)
+    assert sf.query_data(transit_db_loc, 'select count(*) from %s' %
+                                         table_name) == [(0,)]
+    assert summary_dates(transit_db_loc) == ['2024-01-01', '2024-01-05']
+    assert not os.path.exists(os.path.join(
+        os.path.dirname(transit_db_loc), 'archive'))
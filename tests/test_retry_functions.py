@@ -0,0 +1,76 @@
+"""
+Description: Tests of the retry budget and the circuit breakers
+    (retry_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import pytest
+
+import retry_functions as rtf
+
+
+@pytest.fixture(autouse=True)
+def reset_state():
+    rtf.breakers.clear()
+    rtf.retry_bucket = None
+    yield
+    rtf.breakers.clear()
+    rtf.retry_bucket = None
+
+
+def test_circuit_opens_after_the_failure_threshold():
+    for _ in range(rtf.breaker_failure_threshold - 1):
+        rtf.before_call('api', now=0)
+        rtf.record_failure('api', now=0)
+    assert rtf.breakers['api']['state'] == 'closed'
+    rtf.record_failure('api', now=0)
+    assert rtf.breakers['api']['state'] == 'open'
+    with pytest.raises(rtf.CircuitOpenError):
+        rtf.before_call('api', now=rtf.breaker_open_secs - 1)
+
+
+def test_half_open_lets_a_single_trial_through():
+    rtf.breaker_state('api').update(state='open', opened=0)
+    rtf.before_call('api', now=rtf.breaker_open_secs)
+    assert rtf.breakers['api']['state'] == 'half-open'
+    # the other calls fail fast while the trial is running
+    with pytest.raises(rtf.CircuitOpenError):
+        rtf.before_call('api', now=rtf.breaker_open_secs)
+    rtf.record_success('api')
+    assert rtf.breakers['api'] == {'state': 'closed', 'failures': 0,
+                                   'opened': None, 'trial': False}
+    rtf.before_call('api', now=rtf.breaker_open_secs)
+
+
+def test_failed_trial_opens_the_circuit_again():
+    rtf.breaker_state('api').update(state='open', opened=0)
+    rtf.before_call('api', now=100)
+    rtf.record_failure('api', now=100)
+    assert rtf.breakers['api']['state'] == 'open'
+    assert rtf.breakers['api']['opened'] == 100
+    with pytest.raises(rtf.CircuitOpenError):
+        rtf.before_call('api', now=100 + rtf.breaker_open_secs - 1)
+
+
+def test_retry_budget_refills(monkeypatch):
+    monkeypatch.setattr(rtf, 'retry_rate_limit', (2, 10))
+    assert rtf.take_retry_token(now=0)
+    assert rtf.take_retry_token(now=0)
+    assert not rtf.take_retry_token(now=0)
+    assert not rtf.take_retry_token(now=5)
+    assert rtf.take_retry_token(now=15)
+
+
+def test_external_call_fails_fast_when_open():
+    calls = []
+
+    @rtf.external_call('api')
+    def call():
+        calls.append(1)
+        return 'ok'
+
+    assert call() == 'ok'
+    rtf.breaker_state('api').update(state='open', opened=float('inf'))
+    with pytest.raises(rtf.CircuitOpenError):
+        call()
+    assert len(calls) == 1
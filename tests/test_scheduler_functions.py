@@ -0,0 +1,75 @@
+"""
+Description: Tests of the reconciliation of the job database
+    (scheduler_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import file_functions as ff
+import scheduler_functions as sched
+
+
+@pytest.fixture
+def sched_sql_loc(tmp_path):
+    return os.path.join(str(tmp_path), 'tasks.sqlite')
+
+
+def job_specs(minutes, args=('siri_data.sqlite',)):
+    """
+    Job specification of a job at 6:<minute> on the weekdays for each minute
+    """
+    return pd.DataFrame({'id': [str(ind) for ind in range(len(minutes))],
+                         'day_of_week': 'mon-fri', 'hour': 6,
+                         'minute': minutes, 'second': 0,
+                         'args': [list(args)] * len(minutes)})
+
+
+def reconcile(sched_sql_loc, minutes, id_modifier='sr_'):
+    return sched.reconcile_jobs(sched_sql_loc, ff.heartbeat_age,
+                                job_specs(minutes), id_modifier, 'transit')
+
+
+def stored_jobs(sched_sql_loc):
+    (scheduler, job_store) = sched.open_job_store(sched_sql_loc)
+    try:
+        return {job.id: job for job in job_store.get_all_jobs()}
+    finally:
+        job_store.shutdown()
+
+
+def test_reconcile_add_unchanged_modify_remove(sched_sql_loc):
+    assert reconcile(sched_sql_loc, [0, 5, 10]) == {
+        'add': ['sr_0', 'sr_1', 'sr_2'], 'modify': [], 'unchanged': [],
+        'remove': []}
+    next_run_time = stored_jobs(sched_sql_loc)['sr_0'].next_run_time
+    assert reconcile(sched_sql_loc, [0, 5, 10]) == {
+        'add': [], 'modify': [], 'unchanged': ['sr_0', 'sr_1', 'sr_2'],
+        'remove': []}
+    # the unchanged jobs keep their state
+    assert stored_jobs(sched_sql_loc)['sr_0'].next_run_time == next_run_time
+    assert reconcile(sched_sql_loc, [0, 6]) == {
+        'add': [], 'modify': ['sr_1'], 'unchanged': ['sr_0'],
+        'remove': ['sr_2']}
+    jobs = stored_jobs(sched_sql_loc)
+    assert sorted(jobs) == ['sr_0', 'sr_1']
+    assert jobs['sr_1'].next_run_time.minute == 6
+
+
+def test_reconcile_only_touches_its_id_modifier(sched_sql_loc):
+    reconcile(sched_sql_loc, [0, 5], 'sr_BA_')
+    reconcile(sched_sql_loc, [0], 'sr_')
+    # the jobs of the other agency are not removed by a reconcile of sr_
+    assert reconcile(sched_sql_loc, [], 'sr_')['remove'] == ['sr_0']
+    assert sorted(stored_jobs(sched_sql_loc)) == ['sr_BA_0', 'sr_BA_1']
+
+
+def test_reconcile_dry_run(sched_sql_loc):
+    assert reconcile(sched_sql_loc, [0, 5])['add'] == ['sr_0', 'sr_1']
+    assert sched.reconcile_jobs(sched_sql_loc, ff.heartbeat_age,
+                                job_specs([0]), 'sr_', 'transit',
+                                dry_run=True)['remove'] == ['sr_1']
+    assert sorted(stored_jobs(sched_sql_loc)) == ['sr_0', 'sr_1']
@@ -0,0 +1,161 @@
+"""
+Description: Tests of the sql functions (sql_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import sql_functions as sf
+
+traffic_insert_sql = (
+    'INSERT INTO traffic_data(utc_time, day_of_week, trip_index, trip_key, '
+    'pair_key, directions_result, duration_in_traffic, from_cache, '
+    'from_model) VALUES(?,?,?,?,?,?,?,?,?)')
+
+
+def test_partition_location_copies_tables_and_indexes(tmp_path):
+    db_location = os.path.join(str(tmp_path), 'traffic_data.sqlite')
+    sf.create_traffic_data_table(db_location)
+    sf.create_table(db_location, 'create index traffic_pair_idx on '
+                                 'traffic_data(pair_key)')
+    # left behind by an update_entries that was killed
+    sf.create_table(db_location, 'create table traffic_data_temp (a integer)')
+    sf.create_table(db_location, 'create table traffic_data_temp_7 '
+                                 '(a integer)')
+    sf.create_table(db_location, 'create view traffic_view as select * from '
+                                 'traffic_data')
+    location = sf.partition_location(db_location, dt.date(2024, 1, 1))
+    assert location != db_location
+    names = {name for (name,) in sf.query_data(
+        location, 'select name from sqlite_master')}
+    assert 'traffic_data' in names
+    assert 'traffic_pair_idx' in names
+    assert 'traffic_view' not in names
+    assert not any('_temp' in name for name in names)
+
+
+def test_update_entries_replaces_rows(tmp_path):
+    db_location = os.path.join(str(tmp_path), 'entries.sqlite')
+    sf.create_table(db_location, 'create table entries (key integer, value '
+                                 'real)')
+    for value in [1.0, 2.0]:
+        sf.update_entries(db_location, 'entries',
+                          pd.DataFrame([{'key': 1, 'value': value}]), ['key'])
+    assert sf.query_data(db_location, 'select key, value from entries') == [
+        (1, 2.0)]
+    assert sf.query_data(db_location, "select name from sqlite_master where "
+                                       "name like 'entries_temp%'") == []
+
+
+def test_process_monitor_tables_are_created_in_an_existing_file(tmp_path):
+    db_location = os.path.join(str(tmp_path), 'process_monitor.sqlite')
+    # the collector connected before the tables were created
+    sf.query_data(db_location, 'select 1')
+    for _ in range(2):
+        sf.create_process_monitor_table(db_location)
+        sf.create_dispatch_misfire_table(db_location)
+    assert sf.query_data(db_location, 'select count(*) from process_monitor '
+                                      'join dispatch_misfire') == [(0,)]
+
+
+def traffic_row(date, duration):
+    utc_time = sf.local_midnight_epoch(date) + 8 * 3600
+    return (utc_time, 1, 3, 1, 5, '', duration, 0, 0)
+
+
+@pytest.fixture
+def partitioned_db_loc(tmp_path):
+    db_location = os.path.join(str(tmp_path), 'traffic_data.sqlite')
+    sf.create_traffic_data_table(db_location)
+    # written before the data was partitioned
+    sf.insert_data(db_location, traffic_insert_sql,
+                   traffic_row(dt.date(2023, 12, 30), 800.0))
+    for (date, duration) in [(dt.date(2024, 1, 5), 900.0),
+                             (dt.date(2024, 2, 5), 1000.0),
+                             (dt.date(2024, 3, 5), 1100.0)]:
+        sf.insert_traffic_data(db_location, traffic_row(date, duration))
+    return db_location
+
+
+def test_query_partitions_union_and_date_range(partitioned_db_loc):
+    sql_cmd = 'select duration_in_traffic from traffic_data'
+    assert sorted(row[0] for row in sf.query_partitions(
+        partitioned_db_loc, 'traffic_data', sql_cmd)) == [
+        800.0, 900.0, 1000.0, 1100.0]
+    assert sorted(row[0] for row in sf.query_partitions(
+        partitioned_db_loc, 'traffic_data', sql_cmd, dt.date(2024, 1, 5),
+        dt.date(2024, 2, 28))) == [900.0, 1000.0]
+
+
+def test_query_partitions_groups_the_partitions(partitioned_db_loc,
+                                                monkeypatch):
+    monkeypatch.setattr(sf, 'max_attached_partitions', 3)
+    # the original database and three partitions in two groups
+    assert sf.query_partitions(partitioned_db_loc, 'traffic_data',
+                               'select count(*) from traffic_data') == [
+        (3,), (1,)]
+
+
+def test_frozen_partitions_are_attached_immutable(partitioned_db_loc,
+                                                  monkeypatch):
+    frozen = sf.freeze_cold_partitions(partitioned_db_loc,
+                                       dt.date(2024, 3, 10))
+    assert frozen == [sf.partition_location(partitioned_db_loc, date) for
+                      date in ['2024-01-05', '2024-02-05']]
+    # a frozen partition is not frozen again
+    assert sf.freeze_cold_partitions(partitioned_db_loc,
+                                     dt.date(2024, 3, 10)) == []
+    statements = []
+    connect = sqlite3.connect
+
+    class RecordingConnection:
+        def __init__(self, *args, **kwargs):
+            self.conn = connect(*args, **kwargs)
+
+        def execute(self, sql_cmd):
+            statements.append(sql_cmd)
+            return self.conn.execute(sql_cmd)
+
+        def close(self):
+            self.conn.close()
+
+    monkeypatch.setattr(sf.sqlite3, 'connect', RecordingConnection)
+    assert sf.query_partitions(partitioned_db_loc, 'traffic_data',
+                               'select count(*) from traffic_data') == [
+        (4,)]
+    attached = [sql_cmd for sql_cmd in statements if
+                sql_cmd.startswith('ATTACH')]
+    assert ['immutable=1' in sql_cmd for sql_cmd in attached] == [
+        False, True, True, False]
+
+
+def test_open_partition_view_without_the_table(partitioned_db_loc):
+    with pytest.raises(ValueError, match='has the table missing'):
+        sf.open_partition_view([partitioned_db_loc], 'missing')
+
+
+def test_update_entries_with_the_compiled_table(tmp_path):
+    db_location = os.path.join(str(tmp_path), 'entries.sqlite')
+    sf.create_table(db_location, 'create table entries (key integer, '
+                                 'utc_time integer, value real)')
+    # like a table of table_def (compile_table_def.compile_table)
+    table = {'columns': ('key', 'utc_time', 'value'),
+             'sql_columns': ('key', 'utc_time', 'value'),
+             'dtypes': {'key': 'Int64', 'utc_time': 'Int64',
+                        'value': 'float64'},
+             'insert': 'INSERT INTO %s (key, utc_time, value) VALUES '
+                       '(?,?,?)'}
+    data = sf.prepare_pandas_to_sql(pd.DataFrame(
+        {'value': [1.5, None], 'key': [1.0, 2.0], 'other': ['a', 'b']}),
+        table)
+    assert list(data.columns) == ['key', 'utc_time', 'value']
+    assert str(data['key'].dtype) == 'Int64'
+    sf.update_entries(db_location, 'entries', data, ['key'], table=table)
+    assert sf.query_data(db_location, 'select key, utc_time, value from '
+                                      'entries order by key') == [
+        (1, None, 1.5), (2, None, None)]
@@ -0,0 +1,97 @@
+"""
+Description: Tests of the historical traffic model (traffic_model_functions).
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import datetime as dt
+import os
+import threading
+
+import pytest
+
+import config
+import sql_functions as sf
+import traffic_model_functions as tm
+
+
+@pytest.fixture
+def traffic_db_loc(tmp_path):
+    db_location = os.path.join(str(tmp_path), 'traffic_data.sqlite')
+    sf.create_traffic_data_table(db_location)
+    tm.last_rowids.clear()
+    tm.bucket_durations.clear()
+    tm.last_refresh = None
+    yield db_location
+    tm.last_rowids.clear()
+    tm.bucket_durations.clear()
+    tm.last_refresh = None
+
+
+def test_quantile():
+    values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+    assert tm.quantile(values, 0.5) == 6
+    assert tm.quantile(values, 0.1) == 2
+    assert tm.quantile(values, 1.0) == 10
+    assert tm.quantile([7], 0.9) == 7
+
+
+def test_is_confident():
+    samples = config.traffic_model_min_samples
+    assert not tm.is_confident(None)
+    assert tm.is_confident({'median': 1000.0, 'low': 950.0, 'high': 1050.0,
+                            'samples': samples})
+    assert not tm.is_confident({'median': 1000.0, 'low': 950.0,
+                                'high': 1050.0, 'samples': samples - 1})
+    assert not tm.is_confident({'median': 1000.0, 'low': 700.0,
+                                'high': 1300.0, 'samples': samples})
+
+
+def test_time_bucket_uses_local_timezone():
+    # 2024-01-01 16:00 UTC is monday 08:00 in america/los_angeles
+    utc_time = dt.datetime(2024, 1, 1, 16, tzinfo=dt.timezone.utc)
+    assert config.local_timezone == 'America/Los_Angeles'
+    assert tm.time_bucket(utc_time.timestamp()) == (1, 8 * 60 //
+                                                    tm.bucket_mins)
+
+
+def test_refresh_model_learns_live_durations(traffic_db_loc):
+    now = int(dt.datetime.now().timestamp())
+    for (week, from_cache, from_model) in [(1, 0, 0), (2, 0, 0), (3, 1, 0),
+                                           (4, 0, 1)]:
+        sf.insert_traffic_data(traffic_db_loc,
+                               (now - week * 7 * 86400, 1, 3, 1, 5, '',
+                                900.0 + week, from_cache, from_model))
+    assert tm.refresh_model(traffic_db_loc) == 2
+    prediction = tm.predict(5, now)
+    assert prediction['samples'] == 2
+    assert prediction['low'] == 901.0
+    assert prediction['high'] == 902.0
+    # refreshed less than refresh_secs ago
+    assert tm.refresh_model(traffic_db_loc) == 0
+
+
+def test_predict_runs_while_the_model_is_read(traffic_db_loc, monkeypatch):
+    reading = threading.Event()
+    release = threading.Event()
+    query_new_rows = sf.query_new_rows
+
+    def slow_query_new_rows(*args, **kwargs):
+        reading.set()
+        release.wait(5)
+        return query_new_rows(*args, **kwargs)
+
+    monkeypatch.setattr(sf, 'query_new_rows', slow_query_new_rows)
+    thread = threading.Thread(target=tm.refresh_model,
+                              args=(traffic_db_loc,))
+    thread.start()
+    try:
+        assert reading.wait(5)
+        # the lock is not held by the read and a second refresh does not
+        # read again
+        assert tm.predict(5, 0) is None
+        assert tm.refresh_model(traffic_db_loc) == 0
+    finally:
+        release.set()
+        thread.join()
+    assert not tm.refreshing
+    assert tm.last_refresh is not None
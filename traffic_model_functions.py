@@ -0,0 +1,203 @@
+"""
+Description: This file contains the historical traffic model that replaces
+    the google directions calls of the trips whose duration in traffic
+    barely varies. The recent live durations of each station pair, day of
+    the week and bucket of bucket_mins minutes of the day are kept in
+    memory and the model predicts their median with the interval between
+    the quantiles in config.traffic_model_quantiles. The model is refreshed
+    incrementally from the rows that were added to the traffic database
+    since the previous refresh. The durations that were taken from the
+    traffic cache or predicted by the model are not learned from.
+
+@author: Robert Hennessy (robertghennessy@gmail.com)
+"""
+import collections
+import datetime as dt
+import random
+import threading
+import time
+
+import config
+import metrics_functions as mf
+import sql_functions as sf
+
+# minutes of the day in a bucket of the model
+bucket_mins = 5
+# days of traffic history that are read when the model is first loaded. A
+# trip is driven once a week, so the first predictions take
+# config.traffic_model_min_samples weeks.
+history_days = 120
+# number of the most recent durations of a bucket that are kept, the older
+# durations are forgotten so that the model follows the changes in traffic
+max_samples = 12
+# seconds between the refreshes of the model
+refresh_secs = 15 * 60
+
+# the model is shared by the traffic job threads
+model_lock = threading.Lock()
+# {database file: last rowid that was read}
+last_rowids = {}
+# {(pair_key, day_of_week, bucket): recent durations, the oldest first}
+bucket_durations = {}
+# monotonic time of the last refresh
+last_refresh = None
+# True while a thread reads the new rows. The rows are read without the
+# lock, so the other traffic jobs keep predicting during the first load.
+refreshing = False
+
+
+def time_bucket(utc_time):
+    """
+    Find the day of the week and the bucket of the day of a time in
+        config.local_timezone
+
+    :param utc_time: seconds since the epoch
+    :type utc_time: float
+
+    :return day of the week (1 is monday) and bucket of the day
+    :rtype: tuple
+    """
+    local_time = dt.datetime.fromtimestamp(utc_time, config.to_zone)
+    return (local_time.isoweekday(),
+            (local_time.hour * 60 + local_time.minute) // bucket_mins)
+
+
+def refresh_model(traffic_db_loc, today=None):
+    """
+    Learn the live durations that were added to the traffic database since
+        the previous refresh. Nothing is read if the model was refreshed less
+        than refresh_secs seconds ago or another thread is refreshing it.
+
+    :param traffic_db_loc: location of the traffic database
+    :type traffic_db_loc: string
+
+    :param today: current date, defaults to today
+    :type today: date
+
+    :return num_rows: number of rows that were learned
+    :rtype: int
+    """
+    global last_refresh, refreshing
+    if today is None:
+        today = dt.date.today()
+    first_date = today - dt.timedelta(days=history_days)
+    with model_lock:
+        if refreshing or (last_refresh is not None and
+                          time.monotonic() - last_refresh < refresh_secs):
+            return 0
+        refreshing = True
+        read_rowids = dict(last_rowids)
+    try:
+        (rows, rowids) = sf.query_new_rows(
+            traffic_db_loc, 'traffic_data',
+            ['utc_time', 'pair_key', 'duration_in_traffic'], first_date,
+            'utc_time >= %d and from_cache = 0 and from_model = 0' %
+            sf.local_midnight_epoch(first_date), read_rowids)
+        buckets = [(pair_key,) + time_bucket(utc_time)
+                   for (utc_time, pair_key, _) in rows]
+        with model_lock:
+            for (key, (_, _, duration)) in zip(buckets, rows):
+                if key not in bucket_durations:
+                    bucket_durations[key] = collections.deque(
+                        maxlen=max_samples)
+                bucket_durations[key].append(duration)
+            last_rowids.update(rowids)
+            last_refresh = time.monotonic()
+    finally:
+        with model_lock:
+            refreshing = False
+    return len(rows)
+
+
+def quantile(sorted_values, fraction):
+    """
+    Nearest rank quantile of sorted values
+
+    :param sorted_values: values in ascending order
+    :type sorted_values: list
+
+    :param fraction: quantile between 0 and 1
+    :type fraction: float
+
+    :return the quantile
+    :rtype: float
+    """
+    return sorted_values[min(int(fraction * len(sorted_values)),
+                             len(sorted_values) - 1)]
+
+
+def predict(pair_key, utc_time):
+    """
+    Predict the duration in traffic between a station pair at a time
+
+    :param pair_key: key of the station pair in the dimension tables
+    :type pair_key: int
+
+    :param utc_time: seconds since the epoch
+    :type utc_time: float
+
+    :return prediction: dictionary with the median, the low and high
+        quantiles and the number of samples. None if the bucket has no
+        durations.
+    :rtype: dictionary
+    """
+    with model_lock:
+        durations = sorted(bucket_durations.get(
+            (pair_key,) + time_bucket(utc_time), []))
+    if len(durations) == 0:
+        return None
+    (low, high) = config.traffic_model_quantiles
+    return {'median': quantile(durations, 0.5),
+            'low': quantile(durations, low),
+            'high': quantile(durations, high),
+            'samples': len(durations)}
+
+
+def is_confident(prediction):
+    """
+    A prediction is confident if it has enough samples and the interval
+        between its quantiles is narrow compared to its median
+
+    :param prediction: the prediction of the model
+    :type prediction: dictionary
+
+    :return True if the prediction can replace a live call
+    :rtype: bool
+    """
+    return (prediction is not None and
+            prediction['samples'] >= config.traffic_model_min_samples and
+            prediction['high'] - prediction['low'] <=
+            config.traffic_model_max_spread * prediction['median'])
+
+
+def model_duration(traffic_db_loc, pair_key, utc_time):
+    """
+    Return the prediction of the model if it is confident and the call was
+        not picked for a live sample. config.traffic_model_live_rate of the
+        calls are made live to keep the model fresh.
+
+    :param traffic_db_loc: location of the traffic database
+    :type traffic_db_loc: string
+
+    :param pair_key: key of the station pair in the dimension tables
+    :type pair_key: int
+
+    :param utc_time: seconds since the epoch
+    :type utc_time: float
+
+    :return prediction: the prediction that replaces the live call, None if
+        google has to be called
+    :rtype: dictionary
+    """
+    if not config.traffic_model:
+        return None
+    refresh_model(traffic_db_loc)
+    prediction = predict(pair_key, utc_time)
+    if not is_confident(prediction):
+        result = 'unconfident'
+    elif random.random() < config.traffic_model_live_rate:
+        result = 'sampled'
+    else:
+        result = 'model'
+    mf.increment('traffic_model_requests_total', {'result': result})
+    return prediction if result == 'model' else None